@@ -0,0 +1,598 @@
+"""Latency benchmarks for individual endpoints against a real MongoDB.
+
+Data is seeded into a throwaway database (BENCHMARK_DB_NAME, default
+``travel_agency_benchmark``) which is dropped afterwards unless --keep is given.
+
+    python benchmark.py payment-deadlines --installments 10000
+    python benchmark.py serialization --rows 5000
+    python benchmark.py login-load --logins 50
+    python benchmark.py commissions --practices 20000
+    python benchmark.py suite --baseline benchmarks/baseline.json
+
+``suite`` drives every route family through the ASGI app in-process, against
+MONGO_URL or, with --backend fake, an in-memory mongomock-motor database. It also
+records the database commands per request and flags any route that issues more
+than in the baseline; on the fake backend these are counted by fakedb, one per
+collection call.
+"""
+import asyncio
+import io
+import json
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+import typer
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+os.environ["DB_NAME"] = os.environ.get("BENCHMARK_DB_NAME", "travel_agency_benchmark")
+os.environ.setdefault("UPLOAD_DIR", str(Path(tempfile.gettempdir()) / "travel_agency_benchmark_uploads"))
+
+import datagen  # noqa: E402
+import server  # noqa: E402  (DB_NAME must be set before the client is created)
+
+cli = typer.Typer()
+
+
+@cli.callback()
+def main():
+    """Travel Agency endpoint benchmarks."""
+
+
+def percentile(sorted_ms: list, fraction: float) -> float:
+    return sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * fraction))]
+
+
+def report(name: str, timings_ms: list, extra: str = ""):
+    timings_ms = sorted(timings_ms)
+    typer.echo(
+        f"{name}: runs={len(timings_ms)} min={timings_ms[0]:.1f}ms "
+        f"median={statistics.median(timings_ms):.1f}ms p95={percentile(timings_ms, 0.95):.1f}ms "
+        f"p99={percentile(timings_ms, 0.99):.1f}ms {extra}"
+    )
+
+
+async def timed(coro_factory, runs: int) -> tuple:
+    timings_ms = []
+    result = None
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = await coro_factory()
+        timings_ms.append((time.perf_counter() - started) * 1000)
+    return timings_ms, result
+
+
+async def seed_payment_deadlines(installments: int, practices: int, seed: int):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    agents = [{"id": str(uuid.uuid4()), "role": "agent"} for _ in range(10)]
+    clients = [{
+        "id": str(uuid.uuid4()),
+        "email": f"client{i}@example.com",
+        "first_name": f"Client{i}",
+        "last_name": "Benchmark",
+        "role": "client"
+    } for i in range(max(1, practices // 2))]
+
+    trips, admins = [], []
+    for i in range(practices):
+        trip_id = str(uuid.uuid4())
+        trips.append({
+            "id": trip_id,
+            "title": f"Trip {i}",
+            "agent_id": rng.choice(agents)["id"],
+            "client_id": rng.choice(clients)["id"],
+        })
+        admins.append({
+            "id": str(uuid.uuid4()),
+            "trip_id": trip_id,
+            "balance_due": rng.choice([0, rng.uniform(100, 5000)]),
+            "client_departure_date": server.mongo_datetime(now + timedelta(days=rng.uniform(-30, 90))),
+        })
+
+    payments = [{
+        "id": str(uuid.uuid4()),
+        "trip_admin_id": rng.choice(admins)["id"],
+        "amount": round(rng.uniform(50, 2000), 2),
+        "payment_date": server.mongo_datetime(now + timedelta(days=rng.uniform(-30, 90))),
+        "payment_type": "installment",
+        "notes": ""
+    } for _ in range(installments)]
+
+    await server.db.users.insert_many(clients + agents)
+    await server.db.trips.insert_many(trips)
+    await server.db.trip_admin.insert_many(admins)
+    await server.db.payment_installments.insert_many(payments)
+    return agents
+
+
+@cli.command("payment-deadlines")
+def payment_deadlines(
+    installments: int = typer.Option(10000, help="Number of payment installments to seed"),
+    practices: int = typer.Option(2000, help="Number of trip_admin practices to seed"),
+    runs: int = typer.Option(20, help="Timed runs per role"),
+    seed: int = typer.Option(42),
+    keep: bool = typer.Option(False, help="Keep the benchmark database afterwards"),
+):
+    """Time /notifications/payment-deadlines for an admin and an agent."""
+    async def run():
+        await server.client.drop_database(server.db.name)
+        await server.apply_index_migrations()
+        agents = await seed_payment_deadlines(installments, practices, seed)
+
+        for role, user in [("admin", {"id": "benchmark-admin", "role": "admin"}), ("agent", agents[0])]:
+            async def call():
+                return await server.get_payment_deadlines(current_user=user)
+            await call()  # warm up
+            timings, result = await timed(call, runs)
+            report(f"payment-deadlines[{role}]", timings, f"notifications={result['total_count']}")
+
+        if not keep:
+            await server.client.drop_database(server.db.name)
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.client.close()
+
+
+def legacy_parse_from_mongo(item):
+    """The pre-codec read path: strip _id and sniff every string for a date."""
+    if isinstance(item, dict):
+        item.pop("_id", None)
+        for key, value in item.items():
+            if isinstance(value, str) and "T" in value and (value.endswith("Z") or "+" in value):
+                try:
+                    item[key] = datetime.fromisoformat(value.replace("Z", "+00:00"))
+                except ValueError:
+                    pass
+            elif isinstance(value, dict):
+                item[key] = legacy_parse_from_mongo(value)
+            elif isinstance(value, list):
+                item[key] = [legacy_parse_from_mongo(v) if isinstance(v, dict) else v for v in value]
+    return item
+
+
+def legacy_serialize(model, adapter: TypeAdapter, documents: list) -> bytes:
+    """Model(**parse_from_mongo(doc)) per row, then FastAPI's response_model pass."""
+    models = [model(**legacy_parse_from_mongo(dict(document))) for document in documents]
+    validated = adapter.validate_python([m.model_dump() for m in models])
+    return json.dumps(jsonable_encoder(adapter.dump_python(validated, mode="json"))).encode()
+
+
+def sample_rows(model, rows: int, rng: random.Random) -> list:
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    samples = {
+        server.Trip: lambda i: {
+            "title": f"Trip {i}", "destination": "Caraibi", "description": "Crociera di 7 giorni",
+            "start_date": now, "end_date": now + timedelta(days=7), "client_id": str(uuid.uuid4()),
+            "agent_id": str(uuid.uuid4()), "status": "active", "trip_type": "cruise",
+        },
+        server.TripAdmin: lambda i: server.calculate_trip_admin_fields({
+            "trip_id": str(uuid.uuid4()), "practice_number": f"P{i}", "booking_number": f"B{i}",
+            "gross_amount": rng.uniform(500, 9000), "net_amount": rng.uniform(400, 8000),
+            "discount": rng.uniform(0, 200), "practice_confirm_date": now,
+            "client_departure_date": now + timedelta(days=60), "confirmation_deposit": 300.0,
+            "status": "confirmed",
+        }),
+        server.ClientPhoto: lambda i: {
+            "trip_id": str(uuid.uuid4()), "client_id": str(uuid.uuid4()),
+            "url": f"/uploads/{uuid.uuid4()}.jpg", "caption": "Tramonto", "photo_category": "destination",
+        },
+    }
+    return [{"_id": ObjectId(), **model(**samples[model](i)).model_dump()} for i in range(rows)]
+
+
+@cli.command()
+def serialization(
+    rows: int = typer.Option(5000, help="Rows per model"),
+    runs: int = typer.Option(10, help="Timed runs per path"),
+    seed: int = typer.Option(42),
+):
+    """Per-row list serialization cost: legacy parse + double validation vs ModelCodec."""
+    rng = random.Random(seed)
+    for model in (server.Trip, server.TripAdmin, server.ClientPhoto):
+        documents = sample_rows(model, rows, rng)
+        adapter = TypeAdapter(List[model])
+        codec = server.codec_for(model)
+        assert json.loads(codec.encode_many(documents)) == json.loads(legacy_serialize(model, adapter, documents))
+
+        for name, serialize in [
+            ("legacy", lambda: legacy_serialize(model, adapter, documents)),
+            ("codec", lambda: codec.encode_many(documents)),
+        ]:
+            timings_ms = []
+            for _ in range(runs):
+                started = time.perf_counter()
+                serialize()
+                timings_ms.append((time.perf_counter() - started) * 1000)
+            per_row_us = statistics.median(timings_ms) * 1000 / rows
+            report(f"serialization[{model.__name__}:{name}]", timings_ms, f"per_row={per_row_us:.2f}us")
+
+
+@cli.command()
+def commissions(
+    practices: int = typer.Option(20000, help="Practices to recalculate"),
+    installments: int = typer.Option(5, help="Installments per practice"),
+    runs: int = typer.Option(5, help="Timed runs per path"),
+    seed: int = typer.Option(42),
+):
+    """Per-practice calculate_trip_admin_fields vs one calculate_commissions pass."""
+    rng = random.Random(seed)
+    admins = [{
+        "id": str(uuid.uuid4()), "gross_amount": rng.uniform(500, 9000), "net_amount": rng.uniform(400, 8000),
+        "discount": rng.uniform(0, 200), "confirmation_deposit": 300.0, "supplier": rng.choice(["MSC", "Costa", None]),
+    } for _ in range(practices)]
+    payments = [{"trip_admin_id": admin["id"], "amount": rng.uniform(50, 500)}
+                for admin in admins for _ in range(installments)]
+    rates = server.CommissionRates(0.04, suppliers={"MSC": 0.05})
+
+    def per_row():
+        by_admin = {}
+        for payment in payments:
+            by_admin.setdefault(payment["trip_admin_id"], []).append(payment)
+        return [server.calculate_trip_admin_fields(admin, by_admin.get(admin["id"])) for admin in admins]
+
+    def vectorized():
+        return server.calculate_commissions(
+            [admin["id"] for admin in admins],
+            [admin["gross_amount"] for admin in admins],
+            [admin["net_amount"] for admin in admins],
+            [admin["discount"] for admin in admins],
+            [admin["confirmation_deposit"] for admin in admins],
+            [payment["trip_admin_id"] for payment in payments],
+            [payment["amount"] for payment in payments],
+            suppliers=[admin["supplier"] for admin in admins],
+            rates=rates,
+        )
+
+    server.commission_rates = rates
+    expected = per_row()
+    result = vectorized()
+    for name, values in result.items():
+        assert all(abs(row[name] - value) < 1e-6 for row, value in zip(expected, values)), name
+
+    for name, calculate in [("per-row", per_row), ("vectorized", vectorized)]:
+        timings_ms = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            calculate()
+            timings_ms.append((time.perf_counter() - started) * 1000)
+        report(f"commissions[{name}]", timings_ms, f"practices={practices} installments={len(payments)}")
+
+
+async def poll_me(http: httpx.AsyncClient, headers: dict, until: asyncio.Event) -> list:
+    """Time GET /auth/me back to back until `until` is set."""
+    timings_ms = []
+    while not until.is_set():
+        started = time.perf_counter()
+        response = await http.get("/api/auth/me", headers=headers)
+        response.raise_for_status()
+        timings_ms.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+    return timings_ms
+
+
+@cli.command("login-load")
+def login_load(
+    logins: int = typer.Option(50, help="Concurrent logins per burst"),
+    bursts: int = typer.Option(3, help="Number of login bursts"),
+    on_loop: bool = typer.Option(False, "--on-loop", help="Hash on the event loop, as before the password engine"),
+    keep: bool = typer.Option(False, help="Keep the benchmark database afterwards"),
+):
+    """p99 of /auth/me while bursts of concurrent logins are being verified."""
+    if on_loop:
+        async def run_inline(func, *args):
+            return func(*args)
+        server.password_engine.run = run_inline
+
+    async def run():
+        await server.client.drop_database(server.db.name)
+        await server.apply_index_migrations()
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as http:
+            credentials = {"email": "login-load@example.com", "password": "benchmark-password"}
+            response = await http.post("/api/auth/register", json={
+                **credentials, "first_name": "Load", "last_name": "Test", "role": "client"
+            })
+            response.raise_for_status()
+            headers = {"Authorization": f"Bearer {response.json()['token']}"}
+
+            idle = asyncio.Event()
+            poller = asyncio.create_task(poll_me(http, headers, idle))
+            await asyncio.sleep(1)
+            idle.set()
+            report("auth-me[idle]", await poller)
+
+            busy = asyncio.Event()
+            poller = asyncio.create_task(poll_me(http, headers, busy))
+            login_ms = []
+            for _ in range(bursts):
+                async def login():
+                    started = time.perf_counter()
+                    response = await http.post("/api/auth/login", json=credentials)
+                    response.raise_for_status()
+                    login_ms.append((time.perf_counter() - started) * 1000)
+                await asyncio.gather(*[login() for _ in range(logins)])
+            busy.set()
+            report(f"auth-me[{logins} concurrent logins]", await poller)
+            report("login", login_ms, f"engine={'on-loop' if on_loop else server.password_engine.stats()}")
+
+        if not keep:
+            await server.client.drop_database(server.db.name)
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.client.close()
+
+
+# Route suite
+SUITE_PASSWORD = "benchmark-password"
+SUITE_ROUTES = [
+    # (family, name, role, method, path); {trip_id} is one of the role's trips
+    ("auth", "login", "client", "POST", "/api/auth/login"),
+    ("auth", "me", "client", "GET", "/api/auth/me"),
+    ("trips", "list", "agent", "GET", "/api/trips?limit=50"),
+    ("trips", "with-details", "agent", "GET", "/api/trips/with-details"),
+    ("trips", "full", "agent", "GET", "/api/trips/{trip_id}/full?include=all"),
+    ("analytics", "dashboard", "admin", "GET", "/api/dashboard/stats"),
+    ("analytics", "agent-commissions", "agent", "GET", "/api/analytics/agent-commissions?year={year}"),
+    ("analytics", "breakdown", "admin", "GET", "/api/analytics/breakdown?year={year}"),
+    ("analytics", "export-csv", "agent", "GET", "/api/analytics/export?year={year}"),
+    ("notifications", "payment-deadlines[agent]", "agent", "GET", "/api/notifications/payment-deadlines"),
+    ("notifications", "payment-deadlines[admin]", "admin", "GET", "/api/notifications/payment-deadlines"),
+    ("uploads", "photo", "client", "POST", "/api/trips/{trip_id}/photos"),
+]
+
+
+def use_fake_database():
+    """Swap the server's Motor client for mongomock-motor (pip install mongomock-motor)."""
+    try:
+        from mongomock_motor import AsyncMongoMockClient
+    except ImportError:
+        raise typer.BadParameter("--backend fake needs mongomock-motor installed")
+    import fakedb
+
+    fakedb.MonitoredMongoMock(server.query_monitor).install()
+    server.client = AsyncMongoMockClient()
+    server.db = server.client[server.db.name]
+    server.transactions.mode = "off"
+
+
+async def seed_suite(agents: int, clients: int, trips: int, seed: int) -> dict:
+    """A datagen dataset; returns the ids and tokens the routes use."""
+    anchor = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    counts = await datagen.generate(
+        server.db, agents=agents, clients=clients, trips=trips, seed=seed, anchor=anchor,
+        hashed_password=await server.password_engine.hash(SUITE_PASSWORD),
+    )
+    try:
+        await server.rebuild_financial_rollups()
+    except NotImplementedError:
+        # mongomock can't run the rollup pipeline ($mergeObjects)
+        await insert_rollups()
+
+    # datagen gives the first agent and client the most trips
+    users = {role: await server.db.users.find_one({"email": f"{role}0@example.com"}, {"_id": 0})
+             for role in ("admin", "agent", "client")}
+    return {
+        "users": users,
+        "tokens": {role: server.create_token(user) for role, user in users.items()},
+        "trip_ids": {
+            "agent": await server.db.trips.distinct("id", {"agent_id": users["agent"]["id"]}),
+            "client": await server.db.trips.distinct("id", {"client_id": users["client"]["id"]}),
+        },
+        "year": anchor.year,
+        "volumes": counts,
+    }
+
+
+async def insert_rollups():
+    """The financial_rollups buckets built in Python, from the keys and amounts the server's deltas use."""
+    agent_ids = {trip["id"]: trip.get("agent_id") async for trip in server.db.trips.find({}, {"id": 1, "agent_id": 1})}
+    buckets = {}
+    async for trip_admin in server.db.trip_admin.find():
+        key = server.rollup_key(trip_admin, agent_ids.get(trip_admin.get("trip_id")))
+        bucket = buckets.setdefault(tuple(key.values()), dict(key))
+        for field, amount in server.rollup_amounts(trip_admin).items():
+            bucket[field] = bucket.get(field, 0) + amount
+    await server.db.financial_rollups.delete_many({})
+    if buckets:
+        await server.db.financial_rollups.insert_many(list(buckets.values()))
+
+
+def sample_jpeg() -> bytes:
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", (1600, 1200), (30, 120, 180)).save(buffer, "JPEG", quality=85)
+    return buffer.getvalue()
+
+
+def suite_request(context: dict, role: str, method: str, path: str, rng: random.Random) -> dict:
+    """httpx.request() keyword arguments for one call of a route."""
+    trip_ids = context["trip_ids"].get(role) or [None]
+    request = {
+        "method": method,
+        "url": path.format(trip_id=rng.choice(trip_ids), year=context["year"]),
+        "headers": {"Authorization": f"Bearer {context['tokens'][role]}"},
+    }
+    if path == "/api/auth/login":
+        request["json"] = {"email": context["users"][role]["email"], "password": SUITE_PASSWORD}
+        del request["headers"]
+    elif path.endswith("/photos"):
+        request["files"] = {"file": ("benchmark.jpg", context["jpeg"], "image/jpeg")}
+        request["data"] = {"caption": "Benchmark", "photo_category": "destination"}
+    return request
+
+
+async def run_route(http: httpx.AsyncClient, context: dict, route: tuple, requests: int, concurrency: int,
+                    seed: int) -> dict:
+    """Warm up, then send `requests` calls from `concurrency` workers; latency and throughput."""
+    family, name, role, method, path = route
+    rng = random.Random(seed)
+    try:
+        # The first call also counts the database commands one request issues
+        with server.track_queries() as queries:
+            (await http.request(**suite_request(context, role, method, path, rng))).raise_for_status()
+        for _ in range(min(2, requests - 1)):
+            (await http.request(**suite_request(context, role, method, path, rng))).raise_for_status()
+    except NotImplementedError as error:
+        # mongomock lacks some aggregation stages the route needs
+        return {"family": family, "unsupported": str(error).split(".")[0]}
+
+    timings_ms, errors = [], 0
+    remaining = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for _ in remaining:
+            request = suite_request(context, role, method, path, rng)
+            started = time.perf_counter()
+            response = await http.request(**request)
+            timings_ms.append((time.perf_counter() - started) * 1000)
+            errors += response.status_code >= 400
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return {**summarize(family, timings_ms, time.perf_counter() - started, errors),
+            "db_operations": queries.operations, "repeated_queries": len(queries.repeated())}
+
+
+def summarize(family: str, timings_ms: list, seconds: float, errors: int = 0) -> dict:
+    timings_ms = sorted(timings_ms)
+    return {
+        "family": family,
+        "requests": len(timings_ms),
+        "errors": errors,
+        "throughput_rps": round(len(timings_ms) / seconds, 1),
+        "p50_ms": round(percentile(timings_ms, 0.50), 2),
+        "p95_ms": round(percentile(timings_ms, 0.95), 2),
+        "p99_ms": round(percentile(timings_ms, 0.99), 2),
+    }
+
+
+def regressions(results: dict, baseline: dict, tolerance: float, min_delta_ms: float) -> List[str]:
+    """Routes whose p95 grew or throughput fell by more than `tolerance` against the baseline,
+    or that now issue more database commands per request."""
+    found = []
+    for name, expected in baseline["routes"].items():
+        actual = results["routes"].get(name)
+        if not actual or "unsupported" in expected:
+            continue
+        if "unsupported" in actual:
+            found.append(f"{name}: no longer runs ({actual['unsupported']})")
+            continue
+        if actual["errors"] > expected.get("errors", 0):
+            found.append(f"{name}: {actual['errors']} error(s), baseline {expected.get('errors', 0)}")
+        slower = actual["p95_ms"] - expected["p95_ms"]
+        if slower > min_delta_ms and actual["p95_ms"] > expected["p95_ms"] * (1 + tolerance):
+            found.append(f"{name}: p95 {actual['p95_ms']}ms vs baseline {expected['p95_ms']}ms")
+        if actual["throughput_rps"] < expected["throughput_rps"] * (1 - tolerance):
+            found.append(f"{name}: {actual['throughput_rps']} req/s vs baseline {expected['throughput_rps']} req/s")
+        if actual.get("db_operations", 0) > expected.get("db_operations", actual.get("db_operations", 0)):
+            found.append(f"{name}: {actual['db_operations']} database operations vs baseline {expected['db_operations']}")
+    return found
+
+
+@cli.command()
+def suite(
+    backend: str = typer.Option("mongod", help="mongod (MONGO_URL) or fake (in-memory mongomock-motor)"),
+    agents: int = typer.Option(20, help="Agents to seed"),
+    clients: int = typer.Option(500, help="Clients to seed"),
+    trips: int = typer.Option(5000, help="Trips to seed with datagen, with their itineraries, practices and photos"),
+    requests: int = typer.Option(200, help="Timed requests per route"),
+    concurrency: int = typer.Option(8, help="Concurrent requests per route"),
+    family: Optional[List[str]] = typer.Option(None, help="Only these route families (repeatable)"),
+    baseline: Optional[Path] = typer.Option(None, help="Baseline JSON to compare against"),
+    update_baseline: bool = typer.Option(False, "--update-baseline", help="Write the results to --baseline"),
+    output: Optional[Path] = typer.Option(None, help="Also write the results JSON here"),
+    tolerance: float = typer.Option(0.25, help="Allowed p95/throughput regression, as a fraction"),
+    min_delta_ms: float = typer.Option(2.0, help="Ignore p95 regressions smaller than this"),
+    seed: int = typer.Option(42),
+    keep: bool = typer.Option(False, help="Keep the benchmark database afterwards"),
+):
+    """Throughput and p50/p95/p99 per route family, optionally checked against a baseline."""
+    if backend not in ("mongod", "fake"):
+        raise typer.BadParameter("backend must be mongod or fake")
+    if backend == "fake":
+        use_fake_database()
+    routes = [route for route in SUITE_ROUTES if not family or route[0] in family]
+
+    async def run() -> dict:
+        await server.client.drop_database(server.db.name)
+        await server.app.router.startup()
+        try:
+            context = await seed_suite(agents, clients, trips, seed)
+            context["jpeg"] = sample_jpeg()
+            typer.echo(f"seeded {context['volumes']} on {backend}")
+            results = {
+                "created_at": datetime.now(timezone.utc).isoformat(),
+                "backend": backend,
+                "volumes": context["volumes"],
+                "requests": requests,
+                "concurrency": concurrency,
+                "routes": {},
+                "families": {},
+            }
+            transport = httpx.ASGITransport(app=server.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as http:
+                for index, route in enumerate(routes):
+                    name = f"{route[0]}:{route[1]}"
+                    results["routes"][name] = result = await run_route(
+                        http, context, route, requests, concurrency, seed + index
+                    )
+                    if "unsupported" in result:
+                        typer.echo(f"{name}: skipped, {result['unsupported']}")
+                    else:
+                        typer.echo(f"{name}: {result['throughput_rps']} req/s p50={result['p50_ms']}ms "
+                                   f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms errors={result['errors']} "
+                                   f"queries={result['db_operations']}")
+            return results
+        finally:
+            await server.app.router.shutdown()
+            if not keep:
+                await server.client.drop_database(server.db.name)
+            shutil.rmtree(os.environ["UPLOAD_DIR"], ignore_errors=True)
+
+    results = asyncio.run(run())
+
+    # A family reports its slowest route and the summed throughput of its routes
+    for name in dict.fromkeys(route[0] for route in routes):
+        measured = [r for r in results["routes"].values() if r["family"] == name and "unsupported" not in r]
+        if measured:
+            results["families"][name] = {
+                "routes": len(measured),
+                "throughput_rps": round(sum(r["throughput_rps"] for r in measured), 1),
+                **{key: max(r[key] for r in measured) for key in ("p50_ms", "p95_ms", "p99_ms")},
+            }
+            typer.echo(f"[{name}] " + " ".join(f"{key}={value}" for key, value in results["families"][name].items()))
+
+    if output:
+        output.write_text(json.dumps(results, indent=2))
+    if baseline and update_baseline:
+        baseline.parent.mkdir(parents=True, exist_ok=True)
+        baseline.write_text(json.dumps(results, indent=2))
+        typer.echo(f"baseline written to {baseline}")
+    elif baseline:
+        found = regressions(results, json.loads(baseline.read_text()), tolerance, min_delta_ms)
+        for line in found:
+            typer.echo(f"REGRESSION {line}", err=True)
+        if found:
+            raise typer.Exit(code=1)
+        typer.echo(f"no regressions against {baseline}")
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,349 @@
+"""Deterministic synthetic datasets for load tests and benchmarks.
+
+The same seed and anchor date always produce the same documents, ids included.
+Trips are generated in independent chunks (one RNG per chunk, in a worker
+thread) and written with insert_many, several batches in flight at once, so
+memory stays flat however many millions of documents are requested.
+
+    python manage.py generate-data --trips 1000000 --drop
+"""
+import asyncio
+import bisect
+import itertools
+import random
+import uuid
+from datetime import datetime, time, timedelta, timezone
+from typing import Dict, List, Optional
+
+import server
+
+COLLECTIONS = ["users", "trips", "itineraries", "port_schedules", "trip_admin", "payment_installments",
+               "client_photos"]
+MODELS = {
+    "users": server.User,
+    "trips": server.Trip,
+    "itineraries": server.Itinerary,
+    "port_schedules": server.PortSchedule,
+    "trip_admin": server.TripAdmin,
+    "payment_installments": server.PaymentInstallment,
+    "client_photos": server.ClientPhoto,
+}
+TRIPS_PER_CHUNK = 1000
+
+# Departures per month (Jan..Dec) and the share of them that are cruises: summer
+# in the Mediterranean and winter in the Caribbean
+MONTH_WEIGHTS = [7, 6, 6, 6, 8, 10, 12, 13, 10, 7, 5, 8]
+CRUISE_SHARE = [0.65, 0.6, 0.5, 0.4, 0.45, 0.6, 0.7, 0.7, 0.6, 0.45, 0.4, 0.65]
+# Installments per practice, 0..12: most pay in a few installments
+INSTALLMENT_WEIGHTS = [10, 18, 20, 16, 11, 8, 6, 4, 3, 2, 1, 0.6, 0.4]
+
+DESTINATIONS = {
+    "cruise": ["Mediterraneo Occidentale", "Isole Greche", "Caraibi", "Fiordi Norvegesi", "Emirati"],
+    "resort": ["Maldive", "Sharm el-Sheikh", "Zanzibar", "Sardegna", "Mauritius"],
+    "tour": ["Giappone", "Perù", "Stati Uniti Coast to Coast", "Marocco", "Islanda"],
+    "custom": ["Viaggio di nozze", "Gruppo aziendale"],
+}
+PORTS = ["Barcellona", "Marsiglia", "Genova", "Napoli", "Palermo", "La Valletta", "Santorini", "Mykonos",
+         "Miami", "Cozumel", "Nassau", "Bergen", "Geiranger", "Dubai", "Abu Dhabi"]
+SUPPLIERS = {
+    "cruise": ["MSC Crociere", "Costa Crociere", "Royal Caribbean", "Norwegian Cruise Line"],
+    "resort": ["Alpitour", "Veratour", "Eden Viaggi"],
+    "tour": ["Kuoni", "Il Diamante", "Go Asia"],
+    "custom": [None],
+}
+PHOTO_CATEGORIES = {
+    "cruise": ["destination", "ship_cabin", "ship_facilities", "dining", "excursion"],
+    "resort": ["destination", "resort_room", "resort_beach", "resort_pool", "dining"],
+    "tour": ["destination", "tour_attractions", "tour_hotels", "dining"],
+    "custom": ["destination", "activities"],
+}
+
+
+def zipf_cumulative(count: int, exponent: float) -> List[float]:
+    """Cumulative weights where the i-th item is picked ~1/(i+1)^exponent as often as the first"""
+    return list(itertools.accumulate(1 / (rank + 1) ** exponent for rank in range(count)))
+
+
+def pick(rng: random.Random, items: list, cumulative: List[float]):
+    return items[bisect.bisect(cumulative, rng.random() * cumulative[-1])]
+
+
+def make_id(rng: random.Random) -> str:
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+
+class Population:
+    """The users trips are spread over; agent 0 and client 0 are the busiest"""
+    def __init__(self, seed: int, agents: int, clients: int, anchor: datetime, hashed_password: str):
+        rng = random.Random(f"{seed}:users")
+
+        def user(role: str, index: int) -> dict:
+            return {
+                "id": make_id(rng),
+                "email": f"{role}{index}@example.com",
+                "first_name": f"{role.title()}{index}",
+                "last_name": rng.choice(["Rossi", "Bianchi", "Esposito", "Romano", "Colombo", "Ricci"]),
+                "role": role,
+                "blocked": False,
+                "created_at": anchor - timedelta(days=rng.uniform(30, 2000)),
+                "hashed_password": hashed_password,
+            }
+
+        self.admins = [user("admin", 0)]
+        self.agents = [user("agent", index) for index in range(agents)]
+        self.clients = [user("client", index) for index in range(clients)]
+        self.agent_weights = zipf_cumulative(agents, 1.1)
+        self.client_weights = zipf_cumulative(clients, 0.6)
+
+    @property
+    def users(self) -> List[dict]:
+        return self.admins + self.agents + self.clients
+
+
+def generate_chunk(population: Population, seed: int, chunk: int, trips: int, anchor: datetime,
+                   years: int) -> Dict[str, List[dict]]:
+    """Every document belonging to `trips` trips, from the chunk's own RNG"""
+    rng = random.Random(f"{seed}:trips:{chunk}")
+    documents = {name: [] for name in COLLECTIONS if name != "users"}
+    month_cumulative = list(itertools.accumulate(MONTH_WEIGHTS))
+    first_year = anchor.year - years
+
+    for _ in range(trips):
+        # Departure: a weighted month in one of the past `years` years or the next one
+        month = bisect.bisect(month_cumulative, rng.random() * month_cumulative[-1]) + 1
+        start = datetime(rng.randint(first_year, anchor.year + 1), month, rng.randint(1, 28), 17,
+                         tzinfo=timezone.utc)
+        if rng.random() < CRUISE_SHARE[month - 1]:
+            trip_type = "cruise"
+        else:
+            trip_type = rng.choices(["resort", "tour", "custom"], [5, 4, 1])[0]
+        days = rng.choice([7, 7, 7, 10, 14]) if trip_type == "cruise" else rng.randint(5, 14)
+        end = start + timedelta(days=days)
+        if end < anchor:
+            status = rng.choices(["completed", "cancelled"], [95, 5])[0]
+        else:
+            status = rng.choices(["active", "draft", "cancelled"], [80, 15, 5])[0]
+
+        agent = pick(rng, population.agents, population.agent_weights)
+        client = pick(rng, population.clients, population.client_weights)
+        created_at = start - timedelta(days=rng.uniform(20, 300))
+        trip = {
+            "id": make_id(rng),
+            "title": f"{rng.choice(DESTINATIONS[trip_type])} {start:%B %Y}",
+            "destination": rng.choice(DESTINATIONS[trip_type]),
+            "description": f"{days} giorni",
+            "start_date": start,
+            "end_date": end,
+            "client_id": client["id"],
+            "agent_id": agent["id"],
+            "status": status,
+            "trip_type": trip_type,
+            "created_at": created_at,
+        }
+        documents["trips"].append(trip)
+
+        for day in range(days):
+            date = start + timedelta(days=day)
+            if trip_type == "cruise":
+                itinerary_type = "port_day" if day == 0 or rng.random() < 0.65 else "sea_day"
+            else:
+                itinerary_type = {"resort": "resort_day", "tour": "tour_day"}.get(trip_type, "free_day")
+            itinerary = {
+                "id": make_id(rng),
+                "trip_id": trip["id"],
+                "day_number": day + 1,
+                "date": date,
+                "title": f"Giorno {day + 1}",
+                "description": "",
+                "itinerary_type": itinerary_type,
+                "created_at": created_at,
+            }
+            documents["itineraries"].append(itinerary)
+            if itinerary_type == "port_day":
+                arrival = datetime.combine(date.date(), time(rng.choice([7, 8, 9]), tzinfo=timezone.utc))
+                departure = arrival + timedelta(hours=rng.choice([8, 9, 10, 11]))
+                documents["port_schedules"].append({
+                    "id": make_id(rng),
+                    "trip_id": trip["id"],
+                    "itinerary_id": itinerary["id"],
+                    "port_name": rng.choice(PORTS),
+                    "arrival_time": arrival,
+                    "departure_time": departure,
+                    "all_aboard_time": departure - timedelta(minutes=30),
+                    "transport_info": "",
+                    "created_at": created_at,
+                })
+
+        if status != "draft" and rng.random() < 0.85:
+            documents["trip_admin"].append(practice(rng, trip, anchor, documents["payment_installments"]))
+
+        if status == "completed" and rng.random() < 0.3:
+            for _ in range(rng.randint(1, 20)):
+                photo_id = make_id(rng)
+                documents["client_photos"].append({
+                    "id": photo_id,
+                    "trip_id": trip["id"],
+                    "client_id": client["id"],
+                    "url": f"/uploads/{photo_id}.jpg",
+                    "caption": "",
+                    "photo_category": rng.choice(PHOTO_CATEGORIES[trip_type]),
+                    "sha256": f"{rng.getrandbits(256):064x}",
+                    "size_bytes": rng.randint(300_000, 6_000_000),
+                    "storage_key": f"{photo_id}.jpg",
+                    "variants": {size: f"/uploads/variants/{photo_id}-{size}.webp" for size in server.PHOTO_VARIANTS},
+                    "variants_status": "ready",
+                    "uploaded_at": end + timedelta(days=rng.uniform(0, 30)),
+                })
+
+    calculate_practices(documents["trip_admin"], documents["payment_installments"],
+                        {trip["id"]: trip["agent_id"] for trip in documents["trips"]})
+    return documents
+
+
+def practice(rng: random.Random, trip: dict, anchor: datetime, installments: List[dict]) -> dict:
+    """A trip_admin record, appending its 0-12 installments to `installments`"""
+    gross_amount = round(min(rng.lognormvariate(8, 0.6), 40000), 2)
+    confirm_date = trip["created_at"] + timedelta(days=rng.uniform(0, 10))
+    deposit = round(gross_amount * rng.choice([0.2, 0.25, 0.3]), 2)
+    admin = {
+        "id": make_id(rng),
+        "trip_id": trip["id"],
+        "practice_number": f"PR-{confirm_date:%Y}-{rng.getrandbits(40):012d}",
+        "booking_number": f"BK-{rng.getrandbits(32):010d}",
+        "supplier": rng.choice(SUPPLIERS[trip["trip_type"]]),
+        "gross_amount": gross_amount,
+        "net_amount": round(gross_amount * rng.uniform(0.78, 0.9), 2),
+        "discount": rng.choice([0.0] * 4 + [round(rng.uniform(50, 300), 2)]),
+        "practice_confirm_date": confirm_date,
+        "client_departure_date": trip["start_date"],
+        "confirmation_deposit": deposit,
+        "status": "cancelled" if trip["status"] == "cancelled" else rng.choices(["confirmed", "paid"], [3, 1])[0],
+        "created_at": confirm_date,
+        "updated_at": confirm_date,
+    }
+
+    # The rest is paid in installments between confirmation and departure;
+    # practices departing later may not be fully paid yet
+    count = rng.choices(range(len(INSTALLMENT_WEIGHTS)), INSTALLMENT_WEIGHTS)[0]
+    if count:
+        paid_share = 1.0 if trip["start_date"] < anchor else rng.uniform(0.2, 1.0)
+        weights = [rng.random() + 0.2 for _ in range(count)]
+        span = max((trip["start_date"] - confirm_date).total_seconds(), 86400)
+        for index, weight in enumerate(weights):
+            installments.append({
+                "id": make_id(rng),
+                "trip_admin_id": admin["id"],
+                "amount": round((gross_amount - deposit) * paid_share * weight / sum(weights), 2),
+                "payment_date": confirm_date + timedelta(seconds=span * (index + 1) / (count + 1)),
+                "payment_type": "balance" if index == count - 1 and paid_share == 1.0 else "installment",
+                "notes": "",
+                "created_at": confirm_date,
+            })
+    return admin
+
+
+def calculate_practices(admins: List[dict], installments: List[dict], agent_ids: Dict[str, str]):
+    """Fill in the derived fields of a chunk's practices with one calculate_commissions call"""
+    if not admins:
+        return
+    fields = server.calculate_commissions(
+        [admin["id"] for admin in admins],
+        [admin["gross_amount"] for admin in admins],
+        [admin["net_amount"] for admin in admins],
+        [admin["discount"] for admin in admins],
+        [admin["confirmation_deposit"] for admin in admins],
+        [installment["trip_admin_id"] for installment in installments],
+        [installment["amount"] for installment in installments],
+        agent_ids=[agent_ids[admin["trip_id"]] for admin in admins],
+        suppliers=[admin["supplier"] for admin in admins],
+    )
+    for name, values in fields.items():
+        for admin, value in zip(admins, values.tolist()):
+            admin[name] = round(value, 2) or 0.0  # No -0.0 balances
+
+
+class BatchWriter:
+    """insert_many in batches of batch_size, with up to `parallelism` batches in flight"""
+    def __init__(self, db, batch_size: int, parallelism: int):
+        self.db = db
+        self.batch_size = batch_size
+        self.slots = asyncio.Semaphore(parallelism)
+        self.buffers = {name: [] for name in COLLECTIONS}
+        self.counts = {name: 0 for name in COLLECTIONS}
+        self.tasks = set()
+
+    async def add(self, collection_name: str, documents: List[dict]):
+        buffer = self.buffers[collection_name]
+        buffer.extend(documents)
+        while len(buffer) >= self.batch_size:
+            await self.write(collection_name, buffer[:self.batch_size])
+            del buffer[:self.batch_size]
+
+    async def write(self, collection_name: str, batch: List[dict]):
+        # Waiting for a free slot is what keeps memory bounded
+        await self.slots.acquire()
+        task = asyncio.create_task(self.insert(collection_name, batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def insert(self, collection_name: str, batch: List[dict]):
+        try:
+            await self.db[collection_name].insert_many([server.prepare_for_mongo(doc) for doc in batch],
+                                                       ordered=False)
+            self.counts[collection_name] += len(batch)
+        finally:
+            self.slots.release()
+
+    async def close(self):
+        for collection_name, buffer in self.buffers.items():
+            if buffer:
+                await self.write(collection_name, list(buffer))
+                buffer.clear()
+        await asyncio.gather(*self.tasks)
+
+
+def check_models(documents: Dict[str, List[dict]]):
+    """The first document of each collection must load into its model"""
+    for collection_name, batch in documents.items():
+        if batch:
+            MODELS[collection_name](**batch[0])
+
+
+async def generate(
+    db,
+    agents: int = 50,
+    clients: int = 20000,
+    trips: int = 100000,
+    seed: int = 42,
+    anchor: Optional[datetime] = None,
+    years: int = 3,
+    hashed_password: str = "",
+    batch_size: int = 5000,
+    parallelism: int = 4,
+    progress=None,
+) -> Dict[str, int]:
+    """Generate and insert a dataset; returns the number of documents per collection.
+
+    `anchor` is "today" for the data (default: midnight UTC today); fix it to get
+    byte-identical datasets on different days. `progress(trips_done)` is called
+    after every chunk.
+    """
+    anchor = anchor or datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    population = Population(seed, agents, clients, anchor, hashed_password)
+    server.User(**population.users[0])
+    writer = BatchWriter(db, batch_size, parallelism)
+    await writer.add("users", population.users)
+
+    done = 0
+    for chunk in range((trips + TRIPS_PER_CHUNK - 1) // TRIPS_PER_CHUNK):
+        count = min(TRIPS_PER_CHUNK, trips - done)
+        documents = await asyncio.to_thread(generate_chunk, population, seed, chunk, count, anchor, years)
+        if chunk == 0:
+            check_models(documents)
+        for collection_name, batch in documents.items():
+            await writer.add(collection_name, batch)
+        done += count
+        if progress:
+            progress(done)
+    await writer.close()
+    return writer.counts
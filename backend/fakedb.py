@@ -0,0 +1,137 @@
+"""mongomock-motor as a stand-in MongoDB, for the tests and `benchmark.py suite --backend fake`.
+
+mongomock has no command monitoring, so MonitoredMongoMock publishes one command
+event per collection call to a pymongo CommandListener (server.query_monitor),
+the way pymongo does against a real server. Query counts on the fake backend are
+therefore the commands issued by the code, one per collection method call.
+
+It also rewrites the aggregation stages the server uses that mongomock lacks:
+$unionWith runs both sides and aggregates the rest over their concatenation,
+$unset becomes an exclusion $project, and $convert to date passes dates through
+(dates are stored natively here). Aware datetimes in a pipeline become naive UTC,
+as BSON encoding does, so they compare with the stored ones.
+"""
+import itertools
+import types
+import uuid
+from datetime import datetime, timezone
+
+from mongomock.collection import Collection
+from mongomock.command_cursor import CommandCursor
+from pymongo.errors import OperationFailure
+
+# Collection method -> (command name, command body)
+COMMANDS = {
+    "find": lambda name, filter=None, *a, **k: ("find", {"find": name, "filter": filter or {}}),
+    "find_one": lambda name, filter=None, *a, **k: ("find", {"find": name, "filter": filter or {}}),
+    "aggregate": lambda name, pipeline, *a, **k: ("aggregate", {"aggregate": name, "pipeline": pipeline}),
+    "count_documents": lambda name, filter, *a, **k: ("aggregate", {"aggregate": name, "pipeline": [{"$match": filter}]}),
+    "estimated_document_count": lambda name, *a, **k: ("count", {"count": name}),
+    "distinct": lambda name, key, filter=None, *a, **k: ("distinct", {"distinct": name, "key": key, "query": filter or {}}),
+    "insert_one": lambda name, *a, **k: ("insert", {"insert": name}),
+    "insert_many": lambda name, *a, **k: ("insert", {"insert": name}),
+    "update_one": lambda name, filter, *a, **k: ("update", {"update": name, "updates": [{"q": filter}]}),
+    "update_many": lambda name, filter, *a, **k: ("update", {"update": name, "updates": [{"q": filter}]}),
+    "replace_one": lambda name, filter, *a, **k: ("update", {"update": name, "updates": [{"q": filter}]}),
+    "delete_one": lambda name, filter, *a, **k: ("delete", {"delete": name, "deletes": [{"q": filter}]}),
+    "delete_many": lambda name, filter, *a, **k: ("delete", {"delete": name, "deletes": [{"q": filter}]}),
+    "find_one_and_update": lambda name, filter, *a, **k: ("findAndModify", {"findAndModify": name, "query": filter}),
+    "find_one_and_replace": lambda name, filter, *a, **k: ("findAndModify", {"findAndModify": name, "query": filter}),
+    "find_one_and_delete": lambda name, filter, *a, **k: ("findAndModify", {"findAndModify": name, "query": filter}),
+    "bulk_write": lambda name, *a, **k: ("update", {"update": name}),
+}
+
+
+def translate_expression(value):
+    """Replace {"$convert": {"input": x, "to": "date"}} by x, and aware datetimes by naive UTC, at any depth"""
+    if isinstance(value, datetime) and value.tzinfo:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, list):
+        return [translate_expression(item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    convert = value.get("$convert")
+    if len(value) == 1 and isinstance(convert, dict) and convert.get("to") == "date":
+        return translate_expression(convert["input"])
+    return {key: translate_expression(item) for key, item in value.items()}
+
+
+def translate_stage(stage: dict) -> dict:
+    if "$unset" in stage:
+        fields = stage["$unset"]
+        return {"$project": {field: 0 for field in ([fields] if isinstance(fields, str) else fields)}}
+    return translate_expression(stage)
+
+
+def translated_aggregate(aggregate):
+    """Collection.aggregate accepting $unionWith, $unset and $convert to date"""
+    def run(collection, pipeline, *args, **kwargs):
+        kwargs.pop("allowDiskUse", None)
+        for index, stage in enumerate(pipeline):
+            if "$unionWith" in stage:
+                union = stage["$unionWith"]
+                documents = list(run(collection, pipeline[:index], *args, **kwargs))
+                documents += list(run(collection.database[union["coll"]], union.get("pipeline", []), *args, **kwargs))
+                combined = collection.database[f"union_{uuid.uuid4().hex}"]
+                try:
+                    if documents:
+                        combined.insert_many(documents)
+                    return CommandCursor(list(run(combined, pipeline[index + 1:], *args, **kwargs)))
+                finally:
+                    combined.drop()
+        return aggregate(collection, [translate_stage(stage) for stage in pipeline], *args, **kwargs)
+
+    run.__name__ = aggregate.__name__
+    return run
+
+
+class MonitoredMongoMock:
+    """Patches mongomock's Collection to report its calls as command events to listener.
+
+    With empty_on_unsupported, an aggregation using a stage mongomock still lacks
+    is counted and answers no documents, so routes built on those pipelines can
+    be checked for their query count.
+    """
+    def __init__(self, listener):
+        self.listener = listener
+        self.request_ids = itertools.count(1)
+        self.depth = 0  # mongomock calls find() from find_one(): count the outer call only
+        self.empty_on_unsupported = False
+
+    def install(self, patch=setattr):
+        """Patch Collection; pass monkeypatch.setattr to undo it after a test"""
+        for method_name, command in COMMANDS.items():
+            method = getattr(Collection, method_name)
+            if method_name == "aggregate":
+                method = translated_aggregate(method)
+            patch(Collection, method_name, self.wrap(method, command))
+        return self
+
+    def wrap(self, method, command):
+        monitor = self
+
+        def monitored(collection, *args, **kwargs):
+            if monitor.depth:
+                return method(collection, *args, **kwargs)
+            command_name, body = command(collection.name, *args, **kwargs)
+            request_id = next(monitor.request_ids)
+            monitor.listener.started(types.SimpleNamespace(
+                request_id=request_id, command_name=command_name, command=body
+            ))
+            monitor.depth += 1
+            result = None
+            try:
+                result = method(collection, *args, **kwargs)
+            except (NotImplementedError, OperationFailure):
+                if not (monitor.empty_on_unsupported and command_name == "aggregate"):
+                    raise
+                result = CommandCursor([])
+            finally:
+                monitor.depth -= 1
+                documents = int(result is not None) if method.__name__ == "find_one" else 0
+                monitor.listener.succeeded(types.SimpleNamespace(
+                    request_id=request_id, duration_micros=100, reply={"n": documents}
+                ))
+            return result
+
+        return monitored
@@ -0,0 +1,184 @@
+"""Maintenance commands for the Travel Agency backend.
+
+Run from the backend directory, e.g. ``python manage.py indexes --report``.
+"""
+import asyncio
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+import typer
+from fastapi import HTTPException
+
+import datagen
+from server import (
+    IMPORT_CHUNK_SIZE,
+    apply_index_migrations,
+    client,
+    db,
+    explain_query_shapes,
+    financial_rollups_drifted,
+    import_extension,
+    import_spreadsheet,
+    migrate_datetimes,
+    notify_deadlines_changed,
+    password_engine,
+    rebuild_financial_rollups,
+    recalculate_commissions,
+    record_write,
+)
+
+cli = typer.Typer()
+
+
+@cli.callback()
+def main():
+    """Travel Agency maintenance commands."""
+
+
+@cli.command()
+def indexes(report: bool = typer.Option(False, "--report", help="Explain every query shape and fail on COLLSCAN")):
+    """Apply pending index migrations, optionally followed by an explain() report."""
+    async def run() -> int:
+        applied = await apply_index_migrations()
+        typer.echo(f"Applied migrations: {applied or 'none pending'}")
+        if not report:
+            return 0
+
+        failures = 0
+        for entry in await explain_query_shapes():
+            marker = "COLLSCAN" if entry["collscan"] else "ok"
+            typer.echo(f"[{marker:>8}] {entry['collection']:<22} {entry['name']:<32} {' > '.join(entry['stages'])}")
+            failures += entry["collscan"]
+        if failures:
+            typer.echo(f"{failures} query shape(s) would scan a whole collection", err=True)
+        return 1 if failures else 0
+
+    try:
+        exit_code = asyncio.run(run())
+    finally:
+        client.close()
+    raise typer.Exit(code=exit_code)
+
+
+@cli.command("rebuild-rollups")
+def rebuild_rollups(
+    if_drifted: bool = typer.Option(False, "--if-drifted", help="Only rebuild when a bucket differs from trip_admin"),
+):
+    """Recompute the financial_rollups buckets from trip_admin."""
+    async def run() -> bool:
+        if if_drifted and not await financial_rollups_drifted():
+            return False
+        await rebuild_financial_rollups()
+        return True
+
+    try:
+        rebuilt = asyncio.run(run())
+    finally:
+        client.close()
+    typer.echo("Financial rollups rebuilt" if rebuilt else "Financial rollups match trip_admin")
+
+
+@cli.command("recalculate-commissions")
+def recalculate_commissions_command(batch_size: int = typer.Option(2000, help="Practices per batch")):
+    """Re-apply COMMISSION_RATES and recompute balance_due for every practice."""
+    async def run() -> int:
+        updated = await recalculate_commissions(batch_size=batch_size)
+        if updated:
+            await record_write("trip_admin")
+            await rebuild_financial_rollups()
+            await notify_deadlines_changed()
+        return updated
+
+    try:
+        updated = asyncio.run(run())
+    finally:
+        client.close()
+    typer.echo(f"{updated} practice(s) updated")
+
+
+@cli.command("generate-data")
+def generate_data(
+    agents: int = typer.Option(50, help="Agents; a few of them get most of the trips"),
+    clients: int = typer.Option(20000, help="Clients"),
+    trips: int = typer.Option(100000, help="Trips, each with its itinerary, practice, installments and photos"),
+    seed: int = typer.Option(42, help="Same seed and anchor, same dataset"),
+    anchor: Optional[datetime] = typer.Option(None, help="The dataset's 'today' (default: today)"),
+    years: int = typer.Option(3, help="Years of history before the anchor"),
+    password: str = typer.Option("password", help="Password of every generated user"),
+    batch_size: int = typer.Option(5000, help="Documents per insert_many"),
+    parallelism: int = typer.Option(4, help="insert_many batches in flight"),
+    drop: bool = typer.Option(False, "--drop", help="Drop the database first"),
+):
+    """Bulk-load a deterministic synthetic dataset into DB_NAME."""
+    async def run():
+        if drop:
+            typer.confirm(f"Drop database {db.name}?", abort=True)
+            await client.drop_database(db.name)
+        elif await db.trips.estimated_document_count():
+            raise typer.BadParameter(f"{db.name} already has trips; use --drop to replace them")
+
+        started = time.perf_counter()
+        counts = await datagen.generate(
+            db, agents=agents, clients=clients, trips=trips, seed=seed,
+            anchor=anchor.replace(tzinfo=timezone.utc) if anchor else None, years=years,
+            hashed_password=await password_engine.hash(password), batch_size=batch_size,
+            parallelism=parallelism, progress=lambda done: typer.echo(f"{done}/{trips} trips", err=True),
+        )
+        seconds = time.perf_counter() - started
+        # Indexes are built once, after the load, rather than maintained per insert
+        await apply_index_migrations()
+        await record_write(*counts)
+        await rebuild_financial_rollups()
+        return counts, seconds
+
+    try:
+        counts, seconds = asyncio.run(run())
+    finally:
+        password_engine.shutdown()
+        client.close()
+    for collection_name, count in counts.items():
+        typer.echo(f"{collection_name}: {count}")
+    total = sum(counts.values())
+    typer.echo(f"{total} document(s) in {seconds:.1f}s ({total / seconds:.0f} docs/s)")
+
+
+@cli.command("migrate-datetimes")
+def migrate_datetimes_command(batch_size: int = typer.Option(1000, help="Documents per bulk write")):
+    """Rewrite ISO string dates as native BSON dates. Safe to interrupt and re-run."""
+    try:
+        counts = asyncio.run(migrate_datetimes(batch_size))
+    finally:
+        client.close()
+    for collection_name, updated in counts.items():
+        typer.echo(f"{collection_name}: {updated} document(s) converted")
+    typer.echo("Date migration complete")
+
+
+@cli.command("import-spreadsheet")
+def import_spreadsheet_command(
+    kind: str = typer.Argument(..., help="practices or installments"),
+    path: Path = typer.Argument(..., exists=True, dir_okay=False, help="A .csv or .xlsx file"),
+    chunk_size: int = typer.Option(IMPORT_CHUNK_SIZE, help="Rows parsed and written per batch"),
+):
+    """Upsert practices (by practice_number) or installments from a CSV/XLSX export."""
+    if kind not in ("practices", "installments"):
+        raise typer.BadParameter("kind must be practices or installments")
+    try:
+        result = asyncio.run(import_spreadsheet(path, kind, import_extension(path.name), chunk_size))
+    except HTTPException as error:
+        typer.echo(error.detail, err=True)
+        raise typer.Exit(code=1)
+    finally:
+        client.close()
+    for rejection in result["rejections"]:
+        typer.echo(f"row {rejection['row']}: {'; '.join(rejection['errors'])}", err=True)
+    typer.echo(
+        f"{result['rows']} row(s) in {result['seconds']}s ({result['rows_per_second']} rows/s): "
+        f"{result['inserted']} inserted, {result['updated']} updated, {result['rejected']} rejected"
+    )
+
+
+if __name__ == "__main__":
+    cli()
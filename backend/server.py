@@ -1,25 +1,380 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, UploadFile, File, Form, Header, Query, Request, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from starlette.datastructures import Headers
+from pydantic_core import to_json
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any, Union
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, CursorType, IndexModel, ReturnDocument, UpdateOne, monitoring
+from pymongo.errors import BulkWriteError, CollectionInvalid, DuplicateKeyError, PyMongoError
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Union, Callable, Literal
 from datetime import datetime, timedelta, timezone
-from passlib.hash import bcrypt
+from passlib.context import CryptContext
+from passlib.exc import MissingBackendError
 import jwt
+import numpy as np
 import os
 import uuid
 from dotenv import load_dotenv
 from pathlib import Path
-import shutil
+import hashlib
+import hmac
+import io
+import re
+import tempfile
+import logging
+import asyncio
+import time
+import base64
+import bisect
+import contextlib
+import contextvars
+import copy
+import csv
+import json
+import binascii
+import random
+import sys
+import threading
+from abc import ABC, abstractmethod
 from enum import Enum
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
+logger = logging.getLogger(__name__)
+
+# Query accounting
+# QueryMonitor is a pymongo command listener. It charges every command to the
+# QueryStats of the request (or query_budget block) that issued it, found through
+# a context variable; Motor copies the context into its executor threads. Each
+# command is reduced to a shape (command, collection, filter with values blanked)
+# and a shape seen QUERY_REPEAT_THRESHOLD times in one request is reported as a
+# likely N+1 loop. Commands issued outside a request are not broken down.
+QUERY_REPEAT_THRESHOLD = int(os.environ.get('QUERY_REPEAT_THRESHOLD', '5'))
+QUERY_LOG_LIMIT = int(os.environ.get('QUERY_LOG_LIMIT', '200'))
+# Adds X-DB-* headers with the request's query counts to every response
+QUERY_DEBUG_HEADERS = os.environ.get('QUERY_DEBUG_HEADERS', 'false').lower() == 'true'
+# Cursor continuations are part of the query that opened the cursor
+UNSHAPED_COMMANDS = {"getMore", "killCursors", "endSessions"}
+SHAPE_FIELDS = ("filter", "pipeline", "query", "key", "updates", "deletes")
+
+def query_shape(value):
+    """The value with every scalar replaced by "?", keeping keys and operators"""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, list) and any(isinstance(item, (dict, list)) for item in value):
+        return [query_shape(item) for item in value]
+    return "?"
+
+def reply_documents(reply: dict) -> int:
+    """Documents a command returned (cursor batches, distinct values) or wrote"""
+    cursor = reply.get("cursor")
+    if cursor:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    if "values" in reply:
+        return len(reply["values"])
+    if "value" in reply:
+        return int(reply["value"] is not None)
+    return reply.get("n", 0)
+
+class QueryStats:
+    """Database commands issued by one request; also charged to the enclosing stats"""
+    def __init__(self, parent: Optional["QueryStats"] = None):
+        self.parent = parent
+        self.operations = 0
+        self.documents = 0
+        self.seconds = 0.0
+        self.shapes: Dict[str, int] = defaultdict(int)
+        self.log: List[dict] = []
+        self.pending: Dict[int, dict] = {}
+
+    def started(self, request_id: int, command_name: str, command: dict):
+        self.operations += 1
+        entry = {"command": command_name}
+        if command_name not in UNSHAPED_COMMANDS:
+            entry["collection"] = command.get(command_name)
+            entry["shape"] = {field: query_shape(command[field]) for field in SHAPE_FIELDS if field in command}
+            self.shapes[json.dumps([command_name, entry["collection"], entry["shape"]], sort_keys=True, default=str)] += 1
+        if len(self.log) < QUERY_LOG_LIMIT:
+            self.log.append(entry)
+        self.pending[request_id] = entry
+
+    def finished(self, request_id: int, duration_micros: int, documents: int, failed: bool = False):
+        entry = self.pending.pop(request_id, None)
+        self.documents += documents
+        self.seconds += duration_micros / 1_000_000
+        if entry is not None:
+            entry["ms"] = round(duration_micros / 1000, 3)
+            entry["documents"] = documents
+            if failed:
+                entry["failed"] = True
+
+    def repeated(self, threshold: int = QUERY_REPEAT_THRESHOLD) -> Dict[str, int]:
+        """Shapes issued at least threshold times"""
+        return {shape: count for shape, count in self.shapes.items() if count >= threshold}
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            "X-DB-Operations": str(self.operations),
+            "X-DB-Documents": str(self.documents),
+            "X-DB-Time-Ms": f"{self.seconds * 1000:.2f}",
+            "X-DB-Repeated-Queries": str(len(self.repeated())),
+        }
+
+current_queries: contextvars.ContextVar[Optional[QueryStats]] = contextvars.ContextVar("current_queries", default=None)
+
+class QueryMonitor(monitoring.CommandListener):
+    """Routes command events to the current QueryStats and keeps per-route totals"""
+    def __init__(self):
+        # Events of one request can arrive from several executor threads at once
+        self.lock = threading.Lock()
+        self.routes: Dict[str, dict] = {}
+
+    def started(self, event):
+        stats = current_queries.get()
+        if stats is None:
+            return
+        with self.lock:
+            while stats is not None:
+                stats.started(event.request_id, event.command_name, event.command)
+                stats = stats.parent
+
+    def record(self, event, documents: int, failed: bool = False):
+        stats = current_queries.get()
+        if stats is None:
+            return
+        with self.lock:
+            while stats is not None:
+                stats.finished(event.request_id, event.duration_micros, documents, failed)
+                stats = stats.parent
+
+    def succeeded(self, event):
+        self.record(event, reply_documents(event.reply))
+
+    def failed(self, event):
+        self.record(event, 0, failed=True)
+
+    def observe(self, route: str, stats: QueryStats):
+        """Add a finished request to its route's totals and report repeated shapes"""
+        totals = self.routes.get(route)
+        if totals is None:
+            totals = self.routes[route] = {"requests": 0, "operations": 0, "documents": 0, "seconds": 0.0,
+                                           "max_operations": 0, "repeated_requests": 0}
+        totals["requests"] += 1
+        totals["operations"] += stats.operations
+        totals["documents"] += stats.documents
+        totals["seconds"] += stats.seconds
+        totals["max_operations"] = max(totals["max_operations"], stats.operations)
+        repeated = stats.repeated()
+        if repeated:
+            totals["repeated_requests"] += 1
+            for shape, count in repeated.items():
+                logger.warning("Possible N+1 in %s: %d x %s", route, count, shape)
+
+    def stats(self) -> dict:
+        return {route: {**totals, "seconds": round(totals["seconds"], 3)} for route, totals in self.routes.items()}
+
+query_monitor = QueryMonitor()
+
+@contextlib.contextmanager
+def track_queries():
+    """Charge the database commands issued inside the block to a new QueryStats"""
+    stats = QueryStats(current_queries.get())
+    token = current_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        current_queries.reset(token)
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+@contextlib.contextmanager
+def query_budget(max_operations: Optional[int] = None, repeat_threshold: int = QUERY_REPEAT_THRESHOLD):
+    """Fail if the block issues more than max_operations commands or repeats a query shape, e.g.
+
+        with query_budget(max_operations=4):
+            await http.get("/api/notifications/payment-deadlines", headers=headers)
+    """
+    with track_queries() as stats:
+        yield stats
+    problems = [f"{count} x {shape}" for shape, count in stats.repeated(repeat_threshold).items()]
+    if max_operations is not None and stats.operations > max_operations:
+        problems.insert(0, f"{stats.operations} database operations, budget {max_operations}")
+    if problems:
+        raise QueryBudgetExceeded("; ".join(problems))
+
+# Metrics
+# Instruments are dicts of plain numbers keyed by label values, rendered in the
+# Prometheus text format by GET /metrics. HTTP metrics are only touched from the
+# event loop; values owned by other components (password engine, photo queue,
+# query totals) are copied in by collectors when /metrics is scraped.
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+    def label_text(self, label_values: tuple, extra: str = "") -> str:
+        pairs = [f'{label}="{escape_label(value)}"' for label, value in zip(self.labels, label_values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{self.label_text(key)} {value}" for key, value in self.values.items()]
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *label_values, amount: float = 1):
+        self.values[label_values] = self.values.get(label_values, 0) - amount
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = ()):
+        super().__init__(name, help_text, labels)
+        self.buckets = sorted(buckets)
+        # label values -> [count per bucket (non-cumulative, +Inf last), sum]
+        self.series: Dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip([*self.buckets, "+Inf"], counts):
+                cumulative += count
+                bucket_label = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.label_text(key, bucket_label)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(key)} {total}")
+            lines.append(f"{self.name}_count{self.label_text(key)} {cumulative}")
+        return lines
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List[Metric] = []
+        self.collectors: List[Callable[[], None]] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def collector(self, func: Callable[[], None]) -> Callable[[], None]:
+        """Register a function that refreshes metrics right before they are rendered"""
+        self.collectors.append(func)
+        return func
+
+    def render(self) -> str:
+        for collect in self.collectors:
+            try:
+                collect()
+            except Exception:
+                logger.exception("Metrics collector %s failed", collect.__name__)
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+def pool_address(event) -> str:
+    host, port = event.address
+    return f"{host}:{port}"
+
+class PoolMonitor(monitoring.ConnectionPoolListener):
+    """Connections open, checked out and awaited, per MongoDB server"""
+    def __init__(self):
+        # Pool events arrive from Motor's executor threads
+        self.lock = threading.Lock()
+        self.connections = metrics.add(Gauge("mongodb_pool_connections", "Open connections", ("address",)))
+        self.checked_out = metrics.add(Gauge("mongodb_pool_checked_out", "Connections in use", ("address",)))
+        self.waiting = metrics.add(Gauge("mongodb_pool_waiting", "Operations waiting for a connection", ("address",)))
+        self.checkout_failures = metrics.add(Counter(
+            "mongodb_pool_checkout_failures_total", "Failed connection checkouts", ("address", "reason")
+        ))
+        self.cleared = metrics.add(Counter("mongodb_pool_cleared_total", "Pool clears after network errors", ("address",)))
+
+    def update(self, metric: Counter, event, amount: int):
+        with self.lock:
+            metric.inc(pool_address(event), amount=amount)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.update(self.cleared, event, 1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self.update(self.connections, event, 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.update(self.connections, event, -1)
+
+    def connection_check_out_started(self, event):
+        self.update(self.waiting, event, 1)
+
+    def connection_check_out_failed(self, event):
+        self.update(self.waiting, event, -1)
+        with self.lock:
+            self.checkout_failures.inc(pool_address(event), event.reason)
+
+    def connection_checked_out(self, event):
+        self.update(self.waiting, event, -1)
+        self.update(self.checked_out, event, 1)
+
+    def connection_checked_in(self, event):
+        self.update(self.checked_out, event, -1)
+
+pool_monitor = PoolMonitor()
+
 # MongoDB connection
+# tz_aware: stored dates come back as UTC-aware datetimes, like the ones we write
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(mongo_url, tz_aware=True, event_listeners=[query_monitor, pool_monitor])
 db = client[os.environ['DB_NAME']]
 
 # JWT Configuration
@@ -77,6 +432,9 @@ class PhotoCategory(str, Enum):
     TOUR_ATTRACTIONS = "tour_attractions"
     TOUR_HOTELS = "tour_hotels"
 
+# Photo variant to serve as url (see PHOTO_VARIANTS)
+PhotoSize = Literal["original", "small", "medium", "large", "web"]
+
 # Models
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -218,6 +576,25 @@ class POICreate(BaseModel):
     price_range: str = ""
     image_urls: List[str] = []
 
+# Bulk writes: items are validated one by one so a batch reports per-item errors
+BULK_MAX_ITEMS = 1000
+IDEMPOTENCY_TTL_SECONDS = 24 * 60 * 60  # How long a retried batch can still be replayed
+
+class BulkRequest(BaseModel):
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=BULK_MAX_ITEMS)
+    ordered: bool = True  # Stop at the first invalid or failed item, like insert_many(ordered=True)
+
+class ItineraryPortSchedule(BaseModel):
+    """Port schedule nested in a bulk itinerary item (ids come from the itinerary)"""
+    port_name: str
+    arrival_time: datetime
+    departure_time: datetime
+    all_aboard_time: datetime
+    transport_info: str = ""
+
+class BulkItineraryItem(ItineraryCreate):
+    port_schedule: Optional[ItineraryPortSchedule] = None
+
 class ItineraryPOI(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     itinerary_id: str
@@ -247,6 +624,11 @@ class ClientPhoto(BaseModel):
     url: str
     caption: str = ""
     photo_category: PhotoCategory
+    sha256: str = ""
+    size_bytes: int = 0
+    storage_key: str = ""
+    variants: Dict[str, str] = {}   # size name -> url, filled in by the photo workers
+    variants_status: str = "none"   # none, pending, ready, failed
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class ShipActivity(BaseModel):
@@ -289,16 +671,18 @@ class TripAdmin(BaseModel):
     trip_id: str
     practice_number: str  # Numero scheda pratica
     booking_number: str   # Numero prenotazione
+    supplier: Optional[str] = None  # Fornitore (tour operator / compagnia)
     gross_amount: float   # Importo lordo saldato
     net_amount: float     # Importo Netto
     discount: float       # Sconto
     gross_commission: float  # Commissione lorda (calculated)
-    supplier_commission: float  # Commissione fornitore (calculated 4%)
+    supplier_commission: float  # Commissione fornitore (calculated, see CommissionRates)
     agent_commission: float     # Commissione Agente (calculated)
     practice_confirm_date: datetime  # Data conferma pratica
     client_departure_date: datetime  # Data partenza Cliente
     confirmation_deposit: float      # Acconto versato per conferma
     balance_due: float              # Saldo da versare (calculated)
+    total_paid: float = 0.0         # Rate versate (running total of the installments)
     status: str = "draft"           # draft, confirmed, paid, cancelled
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -307,6 +691,7 @@ class TripAdminCreate(BaseModel):
     trip_id: str
     practice_number: str
     booking_number: str
+    supplier: Optional[str] = None
     gross_amount: float
     net_amount: float
     discount: float = 0.0
@@ -317,6 +702,7 @@ class TripAdminCreate(BaseModel):
 class TripAdminUpdate(BaseModel):
     practice_number: Optional[str] = None
     booking_number: Optional[str] = None
+    supplier: Optional[str] = None
     gross_amount: Optional[float] = None
     net_amount: Optional[float] = None
     discount: Optional[float] = None
@@ -341,6 +727,259 @@ class PaymentInstallmentCreate(BaseModel):
     payment_type: str = "installment"
     notes: str = ""
 
+# Caching and cross-worker events
+class TTLCache:
+    """Per-process LRU cache whose entries expire after ttl seconds"""
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries: "OrderedDict[Any, tuple]" = OrderedDict()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (time.monotonic() + self.ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+class LocalBroadcaster:
+    """In-process pub/sub, enough when a single worker serves the API"""
+    def __init__(self):
+        self.handlers: Dict[str, list] = defaultdict(list)
+
+    def subscribe(self, channel: str, handler):
+        self.handlers[channel].append(handler)
+
+    async def deliver(self, channel: str, message):
+        for handler in self.handlers.get(channel, []):
+            result = handler(message)
+            if asyncio.iscoroutine(result):
+                await result
+
+    async def publish(self, channel: str, message):
+        await self.deliver(channel, message)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+class MongoBroadcaster(LocalBroadcaster):
+    """Fan-out to every worker through a capped collection that each process tails"""
+    def __init__(self, collection_name: str = "broadcast_events", size_bytes: int = 16 * 1024 * 1024):
+        super().__init__()
+        self.collection_name = collection_name
+        self.size_bytes = size_bytes
+        self.origin = str(uuid.uuid4())
+        self.task = None
+
+    async def publish(self, channel: str, message):
+        # Deliver locally right away; the tailer skips our own events
+        await self.deliver(channel, message)
+        await db[self.collection_name].insert_one({
+            "channel": channel,
+            "message": message,
+            "origin": self.origin,
+            "created_at": datetime.now(timezone.utc)
+        })
+
+    async def start(self):
+        try:
+            await db.create_collection(self.collection_name, capped=True, size=self.size_bytes)
+        except CollectionInvalid:
+            pass  # Already created by another worker
+        self.task = asyncio.create_task(self.tail())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def tail(self):
+        collection = db[self.collection_name]
+        # Only events published after this worker started are relevant
+        await collection.insert_one({"channel": None, "origin": self.origin})
+        newest = await collection.find_one({}, sort=[("$natural", -1)])
+        last_id = newest["_id"]
+        while True:
+            try:
+                cursor = collection.find({"_id": {"$gt": last_id}}, cursor_type=CursorType.TAILABLE_AWAIT)
+                async for event in cursor:
+                    last_id = event["_id"]
+                    if event.get("channel") and event.get("origin") != self.origin:
+                        await self.deliver(event["channel"], event.get("message"))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Broadcast tailer failed, reconnecting")
+            await asyncio.sleep(1)
+
+def broadcast_backend(environ=os.environ) -> str:
+    """BROADCAST_BACKEND, defaulting to mongo when WEB_CONCURRENCY starts several workers.
+
+    Cache invalidations (a blocked user, a changed role) must reach every worker,
+    which the local broadcaster cannot do.
+    """
+    workers = int(environ.get('WEB_CONCURRENCY', '1'))
+    backend = environ.get('BROADCAST_BACKEND', 'mongo' if workers > 1 else 'local')
+    if backend == 'local' and workers > 1:
+        raise RuntimeError(
+            f"BROADCAST_BACKEND=local with WEB_CONCURRENCY={workers}: a blocked user would keep "
+            "access on the other workers. Use BROADCAST_BACKEND=mongo."
+        )
+    return backend
+
+broadcaster = MongoBroadcaster() if broadcast_backend() == 'mongo' else LocalBroadcaster()
+
+# Authenticated users, keyed by id. Writes that affect authorization invalidate
+# the entry on every worker; the TTL bounds staleness if an event is ever lost.
+user_cache = TTLCache(
+    ttl=float(os.environ.get('USER_CACHE_TTL_SECONDS', '30')),
+    max_size=int(os.environ.get('USER_CACHE_MAX_SIZE', '10000'))
+)
+broadcaster.subscribe("user_invalidated", user_cache.invalidate)
+
+async def invalidate_user(user_id: str):
+    await broadcaster.publish("user_invalidated", user_id)
+
+# Dashboard counters, keyed by (role, user id); admins share one entry. Trip and
+# photo writes drop the entries of every user involved plus the admin entry.
+dashboard_cache = TTLCache(
+    ttl=float(os.environ.get('DASHBOARD_CACHE_TTL_SECONDS', '10')),
+    max_size=int(os.environ.get('DASHBOARD_CACHE_MAX_SIZE', '10000'))
+)
+
+def dashboard_cache_key(user: dict) -> tuple:
+    return ("admin", None) if user["role"] == "admin" else (user["role"], user["id"])
+
+def drop_dashboard_stats(user_ids: List[str]):
+    dashboard_cache.invalidate(("admin", None))
+    for user_id in user_ids:
+        dashboard_cache.invalidate(("agent", user_id))
+        dashboard_cache.invalidate(("client", user_id))
+
+broadcaster.subscribe("dashboard_invalidated", drop_dashboard_stats)
+
+async def invalidate_dashboard(*user_ids: Optional[str]):
+    await broadcaster.publish("dashboard_invalidated", [user_id for user_id in user_ids if user_id])
+
+# Password hashing
+# A hash or verify costs hundreds of milliseconds of CPU. It runs on a small
+# dedicated thread pool (bcrypt and argon2 release the GIL) so a burst of logins
+# queues there instead of stalling the event loop. Past max_pending, callers get
+# a 503 instead of waiting indefinitely.
+class PasswordEngine:
+    """Bounded thread pool for password hashing, with queue-depth counters"""
+    def __init__(self, scheme: str, workers: int, max_pending: int, bcrypt_rounds: int,
+                 argon2_memory_kib: int, argon2_time_cost: int):
+        if scheme not in ("bcrypt", "argon2"):
+            raise ValueError(f"Unknown PASSWORD_SCHEME {scheme!r}")
+        # Hashes made with the other scheme or older cost settings still verify
+        # and are flagged for rehashing on the next successful login.
+        self.context = CryptContext(
+            schemes=["argon2", "bcrypt"],
+            default=scheme,
+            deprecated="auto",
+            bcrypt__rounds=bcrypt_rounds,
+            argon2__memory_cost=argon2_memory_kib,
+            argon2__rounds=argon2_time_cost,
+        )
+        # Fail at startup rather than on the first sign-in
+        try:
+            self.context.handler(scheme).get_backend()
+        except MissingBackendError:
+            package = "argon2-cffi" if scheme == "argon2" else "bcrypt"
+            raise RuntimeError(f"PASSWORD_SCHEME={scheme} needs the {package} package installed")
+        self.workers = workers
+        self.max_pending = max_pending
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.max_pending_seen = 0
+        self.completed = 0
+        self.rejected = 0
+        self.rehashed = 0
+        self.wait_ms_total = 0.0
+        self.work_ms_total = 0.0
+
+    async def run(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=503,
+                detail="Too many sign-ins in progress, retry shortly",
+                headers={"Retry-After": "1"}
+            )
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+
+        def timed_call():
+            started = time.perf_counter()
+            return started, func(*args), time.perf_counter() - started
+
+        self.pending += 1
+        self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        queued_at = time.perf_counter()
+        try:
+            started, result, work_seconds = await asyncio.get_running_loop().run_in_executor(self.executor, timed_call)
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        self.wait_ms_total += (started - queued_at) * 1000
+        self.work_ms_total += work_seconds * 1000
+        return result
+
+    async def hash(self, password: str) -> str:
+        return await self.run(self.context.hash, password)
+
+    async def verify_and_update(self, password: str, hashed: str) -> tuple:
+        """(valid, new_hash); new_hash is set when the stored hash uses outdated settings"""
+        return await self.run(self.context.verify_and_update, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "scheme": self.context.default_scheme(),
+            "workers": self.workers,
+            "max_pending": self.max_pending,
+            "in_flight": min(self.pending, self.workers),
+            "queue_depth": max(0, self.pending - self.workers),
+            "max_pending_seen": self.max_pending_seen,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "rehashed": self.rehashed,
+            "avg_wait_ms": round(self.wait_ms_total / self.completed, 2) if self.completed else 0.0,
+            "avg_work_ms": round(self.work_ms_total / self.completed, 2) if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+# PASSWORD_SCHEME=argon2 selects the memory-hard scheme (argon2-cffi)
+password_engine = PasswordEngine(
+    scheme=os.environ.get('PASSWORD_SCHEME', 'bcrypt'),
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1)))),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', '200')),
+    bcrypt_rounds=int(os.environ.get('BCRYPT_ROUNDS', '12')),
+    argon2_memory_kib=int(os.environ.get('ARGON2_MEMORY_KIB', '65536')),
+    argon2_time_cost=int(os.environ.get('ARGON2_TIME_COST', '3'))
+)
+
 # Utility functions
 def create_token(user_data: dict) -> str:
     payload = {
@@ -352,19 +991,58 @@ def create_token(user_data: dict) -> str:
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    user = await user_from_token(credentials.credentials)
+    profile = current_profile.get()
+    if profile:
+        profile.role = user["role"]
+    return user
+
+async def user_from_token(token: str, scope: Optional[str] = None) -> dict:
+    """The user a token was issued to. Scoped tokens (e.g. stream tickets) are only valid for their scope."""
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        user = await db.users.find_one({"id": payload["user_id"]})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        if payload.get("scope") != scope:
+            raise HTTPException(status_code=401, detail="Invalid token")
+        user = user_cache.get(payload["user_id"])
+        if user is None:
+            user = await db.users.find_one({"id": payload["user_id"]})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user["id"], user)
+        if user.get("blocked", False):
+            raise HTTPException(status_code=403, detail="Account blocked. Contact administrator.")
+        # Copy so endpoints can't mutate the cached document
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# "native" stores BSON dates; string dates left in an existing database are
+# converted by `manage.py migrate-datetimes`, and the server refuses to start
+# until they are (see check_stored_datetimes). "iso" keeps writing the legacy
+# ISO strings, for deployments that cannot migrate yet.
+DATETIME_STORAGE = os.environ.get('DATETIME_STORAGE', 'native')
+
+def mongo_datetime(value: datetime):
+    """A datetime as stored, for writes and range queries"""
+    return value if DATETIME_STORAGE == 'native' else value.isoformat()
+
+def stored_datetime(value) -> Optional[datetime]:
+    """Read a datetime stored either natively or as an ISO string"""
+    if isinstance(value, str):
+        try:
+            value = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    return None
+
 def prepare_for_mongo(data):
-    """Convert datetime objects to ISO strings for MongoDB storage"""
+    """Convert datetime objects to ISO strings for MongoDB storage in iso mode"""
+    if DATETIME_STORAGE == 'native':
+        return data
     if isinstance(data, dict):
         for key, value in data.items():
             if isinstance(value, datetime):
@@ -375,51 +1053,646 @@ def prepare_for_mongo(data):
                 data[key] = [prepare_for_mongo(item) if isinstance(item, dict) else item for item in value]
     return data
 
-def calculate_trip_admin_fields(trip_admin_data: dict, installments: List[dict] = None) -> dict:
-    """Calculate derived fields for trip administration"""
-    gross_amount = trip_admin_data.get('gross_amount', 0)
-    net_amount = trip_admin_data.get('net_amount', 0)
-    discount = trip_admin_data.get('discount', 0)
-    confirmation_deposit = trip_admin_data.get('confirmation_deposit', 0)
-    
-    # Calculate commissions
-    gross_commission = gross_amount - discount - net_amount
-    supplier_commission = gross_amount * 0.04  # 4% of gross
-    agent_commission = gross_commission - supplier_commission
-    
-    # Calculate balance due
-    total_paid = confirmation_deposit
-    if installments:
-        total_paid += sum(inst.get('amount', 0) for inst in installments)
-    
-    balance_due = gross_amount - total_paid
-    
+# Commissions
+# The supplier commission is a share of the gross amount. The rate defaults to 4%
+# and can be overridden per agent and, taking precedence, per supplier, e.g.
+# COMMISSION_RATES='{"default": 0.04, "agents": {"<agent id>": 0.03}, "suppliers": {"MSC": 0.05}}'
+class CommissionRates:
+    def __init__(self, default: float = 0.04, agents: Optional[Dict[str, float]] = None,
+                 suppliers: Optional[Dict[str, float]] = None):
+        self.default = default
+        self.agents = agents or {}
+        self.suppliers = suppliers or {}
+
+    @classmethod
+    def from_env(cls) -> "CommissionRates":
+        config = json.loads(os.environ.get('COMMISSION_RATES', '{}'))
+        return cls(config.get("default", 0.04), config.get("agents"), config.get("suppliers"))
+
+    @staticmethod
+    def lookup(keys, rates: Dict[str, float]) -> np.ndarray:
+        """rates[key] for every key, NaN where there is none; one dict lookup per distinct key"""
+        if keys is None or not rates:
+            return None
+        keys = np.asarray(keys, dtype=object)
+        keys[keys == None] = ""  # noqa: E711 (elementwise)
+        distinct, inverse = np.unique(keys.astype(str), return_inverse=True)
+        return np.array([rates.get(key, np.nan) for key in distinct], dtype=float)[inverse]
+
+    def rates_for(self, count: int, agent_ids=None, suppliers=None) -> np.ndarray:
+        rates = np.full(count, self.default, dtype=float)
+        for overrides in (self.lookup(agent_ids, self.agents), self.lookup(suppliers, self.suppliers)):
+            if overrides is not None:
+                rates = np.where(np.isnan(overrides), rates, overrides)
+        return rates
+
+commission_rates = CommissionRates.from_env()
+
+def sum_by_key(keys: np.ndarray, group_keys, amounts) -> np.ndarray:
+    """Sum amounts into the position of their group key in keys (keys must be unique)"""
+    totals = np.zeros(len(keys), dtype=float)
+    group_keys = np.asarray(group_keys, dtype=object)
+    if not len(keys) or not len(group_keys):
+        return totals
+    order = np.argsort(keys)
+    positions = order[np.minimum(np.searchsorted(keys, group_keys, sorter=order), len(keys) - 1)]
+    matched = keys[positions] == group_keys
+    return np.bincount(positions[matched], weights=np.asarray(amounts, dtype=float)[matched], minlength=len(keys))
+
+def calculate_commissions(
+    keys,
+    gross_amount,
+    net_amount,
+    discount,
+    confirmation_deposit,
+    installment_keys=(),
+    installment_amounts=(),
+    agent_ids=None,
+    suppliers=None,
+    rates: Optional[CommissionRates] = None,
+    paid=None,
+) -> Dict[str, np.ndarray]:
+    """Commissions, total_paid and balance_due for many practices at once.
+
+    Practice columns are parallel arrays; installments are (key, amount) pairs
+    matched to their practice by key (usually the trip_admin id). `paid` is an
+    amount already paid per practice on top of those installments.
+    """
+    keys = np.asarray(keys, dtype=object)
+    gross_amount = np.asarray(gross_amount, dtype=float)
+    rate = (rates or commission_rates).rates_for(len(keys), agent_ids, suppliers)
+    
+    gross_commission = gross_amount - np.asarray(discount, dtype=float) - np.asarray(net_amount, dtype=float)
+    supplier_commission = gross_amount * rate
+    total_paid = sum_by_key(keys, installment_keys, installment_amounts)
+    if paid is not None:
+        total_paid += np.asarray(paid, dtype=float)
     return {
-        **trip_admin_data,
-        'gross_commission': gross_commission,
-        'supplier_commission': supplier_commission,
-        'agent_commission': agent_commission,
-        'balance_due': balance_due
+        "gross_commission": gross_commission,
+        "supplier_commission": supplier_commission,
+        "agent_commission": gross_commission - supplier_commission,
+        "total_paid": total_paid,
+        "balance_due": gross_amount - np.asarray(confirmation_deposit, dtype=float) - total_paid,
     }
 
-def parse_from_mongo(item):
-    """Parse datetime strings from MongoDB back to datetime objects and remove ObjectIds"""
-    if isinstance(item, dict):
-        # Remove MongoDB ObjectId field
-        if '_id' in item:
-            del item['_id']
-            
-        for key, value in item.items():
-            if isinstance(value, str) and 'T' in value and (value.endswith('Z') or '+' in value):
-                try:
-                    item[key] = datetime.fromisoformat(value.replace('Z', '+00:00'))
-                except:
-                    pass
-            elif isinstance(value, dict):
-                item[key] = parse_from_mongo(value)
-            elif isinstance(value, list):
-                item[key] = [parse_from_mongo(subitem) if isinstance(subitem, dict) else subitem for subitem in value]
-    return item
+def calculate_trip_admin_fields(trip_admin_data: dict, installments: List[dict] = None,
+                                agent_id: Optional[str] = None) -> dict:
+    """Calculate derived fields for trip administration; without installments the stored total_paid is used"""
+    paid = 0 if installments is not None else trip_admin_data.get('total_paid') or 0
+    installments = installments or []
+    fields = calculate_commissions(
+        [trip_admin_data.get('id')],
+        [trip_admin_data.get('gross_amount') or 0],
+        [trip_admin_data.get('net_amount') or 0],
+        [trip_admin_data.get('discount') or 0],
+        [trip_admin_data.get('confirmation_deposit') or 0],
+        [trip_admin_data.get('id')] * len(installments),
+        [inst.get('amount') or 0 for inst in installments],
+        agent_ids=[agent_id],
+        suppliers=[trip_admin_data.get('supplier')],
+        paid=[paid],
+    )
+    return {**trip_admin_data, **{name: float(values[0]) for name, values in fields.items()}}
+
+# Index management
+# Migrations are applied once, in version order, and recorded in db.schema_migrations.
+# Never edit an applied migration: append a new version instead. A migration may
+# name indexes it supersedes under "drop"; they are removed once it has applied.
+INDEX_MIGRATIONS = [
+    {
+        "version": 1,
+        "description": "Lookup and filter indexes for every endpoint access pattern",
+        "indexes": {
+            "users": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("email", ASCENDING)], unique=True),
+                IndexModel([("role", ASCENDING)]),
+            ],
+            "trips": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("agent_id", ASCENDING), ("status", ASCENDING)]),
+                IndexModel([("client_id", ASCENDING), ("start_date", ASCENDING)]),
+                IndexModel([("status", ASCENDING)]),
+            ],
+            "trip_admin": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING)]),
+                IndexModel([("status", ASCENDING), ("practice_confirm_date", ASCENDING)]),
+                IndexModel([("client_departure_date", ASCENDING)]),
+            ],
+            "payment_installments": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_admin_id", ASCENDING), ("payment_date", ASCENDING)]),
+                IndexModel([("payment_date", ASCENDING)]),
+            ],
+            "itineraries": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING), ("day_number", ASCENDING)]),
+            ],
+            "cruise_info": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING)]),
+            ],
+            "port_schedules": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING)]),
+            ],
+            "pois": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("category", ASCENDING)]),
+            ],
+            "client_photos": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING), ("photo_category", ASCENDING)]),
+                IndexModel([("client_id", ASCENDING)]),
+            ],
+            "client_notes": [
+                IndexModel([("id", ASCENDING)], unique=True),
+                IndexModel([("trip_id", ASCENDING), ("client_id", ASCENDING)]),
+            ],
+        },
+    },
+    {
+        "version": 2,
+        "description": "Keyset pagination: equality filter followed by _id for every list endpoint",
+        "indexes": {
+            "users": [
+                IndexModel([("role", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "trips": [
+                IndexModel([("agent_id", ASCENDING), ("_id", ASCENDING)]),
+                IndexModel([("client_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "payment_installments": [
+                IndexModel([("trip_admin_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "itineraries": [
+                IndexModel([("trip_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "port_schedules": [
+                IndexModel([("trip_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "pois": [
+                IndexModel([("category", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "client_photos": [
+                IndexModel([("trip_id", ASCENDING), ("photo_category", ASCENDING), ("_id", ASCENDING)]),
+                IndexModel([("trip_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+            "client_notes": [
+                IndexModel([("trip_id", ASCENDING), ("client_id", ASCENDING), ("_id", ASCENDING)]),
+            ],
+        },
+    },
+    {
+        "version": 3,
+        "description": "Financial rollup buckets",
+        "indexes": {
+            "financial_rollups": [
+                IndexModel([("agent_id", ASCENDING), ("year", ASCENDING), ("month", ASCENDING), ("status", ASCENDING)],
+                           unique=True),
+                IndexModel([("year", ASCENDING), ("status", ASCENDING)]),
+            ],
+        },
+    },
+    {
+        "version": 4,
+        "description": "Photo variant processing",
+        "indexes": {
+            "client_photos": [
+                IndexModel([("sha256", ASCENDING), ("variants_status", ASCENDING)]),
+                IndexModel([("variants_status", ASCENDING)]),
+            ],
+        },
+    },
+    {
+        "version": 5,
+        "description": "Expire bulk write idempotency records",
+        "indexes": {
+            "idempotency_keys": [
+                IndexModel([("created_at", ASCENDING)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS),
+            ],
+        },
+    },
+    {
+        "version": 6,
+        "description": "Spreadsheet imports upsert practices by practice_number",
+        "indexes": {
+            "trip_admin": [
+                IndexModel([("practice_number", ASCENDING)]),
+            ],
+        },
+    },
+    {
+        "version": 7,
+        "description": "One practice per practice_number; practices without a number are exempt",
+        "indexes": {
+            "trip_admin": [
+                IndexModel([("practice_number", ASCENDING)], name="practice_number_unique", unique=True,
+                           partialFilterExpression={"practice_number": {"$gt": ""}}),
+            ],
+        },
+        # Superseded by the unique index, which serves the same lookups
+        "drop": {"trip_admin": ["practice_number_1"]},
+    },
+    {
+        "version": 8,
+        "description": "Exports stream practices in practice_confirm_date order",
+        "indexes": {
+            "trip_admin": [
+                IndexModel([("practice_confirm_date", ASCENDING), ("_id", ASCENDING)]),
+            ],
+        },
+    },
+]
+
+# Representative query shapes issued by the endpoints, used by the explain report.
+# Values are placeholders: only the shape matters to the query planner.
+QUERY_SHAPES = [
+    ("users by id", "users", {"id": "x"}),
+    ("users by email", "users", {"email": "x@example.com"}),
+    ("clients", "users", {"role": "client"}),
+    ("trip by id", "trips", {"id": "x"}),
+    ("trips by agent", "trips", {"agent_id": "x"}),
+    ("trips by client", "trips", {"client_id": "x"}),
+    ("active trips", "trips", {"status": "active"}),
+    ("agent trips by status", "trips", {"agent_id": "x", "status": "active"}),
+    ("upcoming client trips", "trips", {"client_id": "x", "start_date": {"$gte": "2024-01-01T00:00:00+00:00"}}),
+    ("trip admin by id", "trip_admin", {"id": "x"}),
+    ("trip admin by trip", "trip_admin", {"trip_id": "x"}),
+    ("trip admin by trips", "trip_admin", {"trip_id": {"$in": ["x", "y"]}}),
+    ("confirmed practices by year", "trip_admin", {
+        "status": "confirmed",
+        "practice_confirm_date": {"$gte": "2024-01-01T00:00:00+00:00", "$lt": "2025-01-01T00:00:00+00:00"},
+    }),
+    ("balances due before departure", "trip_admin", {
+        "client_departure_date": {"$gte": "2024-01-01T00:00:00+00:00", "$lte": "2024-01-31T00:00:00+00:00"},
+        "balance_due": {"$gt": 0},
+    }),
+    ("installment by id", "payment_installments", {"id": "x"}),
+    ("installments by practice", "payment_installments", {"trip_admin_id": "x"}),
+    ("installments due", "payment_installments", {
+        "payment_date": {"$gte": "2024-01-01T00:00:00+00:00", "$lte": "2024-01-31T00:00:00+00:00"},
+    }),
+    ("agent installments due", "payment_installments", {
+        "payment_date": {"$gte": "2024-01-01T00:00:00+00:00", "$lte": "2024-01-31T00:00:00+00:00"},
+        "trip_admin_id": {"$in": ["x", "y"]},
+    }),
+    ("itineraries by trip", "itineraries", {"trip_id": "x"}),
+    ("itinerary by id", "itineraries", {"id": "x"}),
+    ("cruise info by trip", "cruise_info", {"trip_id": "x"}),
+    ("cruise info by id", "cruise_info", {"id": "x"}),
+    ("port schedules by trip", "port_schedules", {"trip_id": "x"}),
+    ("pois by category", "pois", {"category": "restaurant"}),
+    ("photos by trip", "client_photos", {"trip_id": "x"}),
+    ("photos by trip and category", "client_photos", {"trip_id": "x", "photo_category": "dining"}),
+    ("photos by client", "client_photos", {"client_id": "x"}),
+    ("notes by trip and client", "client_notes", {"trip_id": "x", "client_id": "y"}),
+    ("note by id and client", "client_notes", {"id": "x", "client_id": "y"}),
+]
+
+async def apply_index_migrations() -> List[int]:
+    """Apply pending index migrations and recreate any declared index that has gone missing"""
+    applied = {doc["version"] async for doc in db.schema_migrations.find({"kind": "indexes"}, {"version": 1})}
+    newly_applied = []
+
+    for migration in INDEX_MIGRATIONS:
+        if migration["version"] in applied:
+            continue
+        for collection_name, indexes in migration["indexes"].items():
+            try:
+                await db[collection_name].create_indexes(indexes)
+            except DuplicateKeyError as error:
+                raise RuntimeError(
+                    f"Index migration {migration['version']} needs unique values in {collection_name}: {error}. "
+                    "Resolve the duplicates and restart."
+                ) from error
+        for collection_name, index_names in migration.get("drop", {}).items():
+            existing = await db[collection_name].index_information()
+            for index_name in index_names:
+                if index_name in existing:
+                    await db[collection_name].drop_index(index_name)
+        await db.schema_migrations.update_one(
+            {"_id": f"indexes:{migration['version']}"},
+            {"$set": {
+                "kind": "indexes",
+                "version": migration["version"],
+                "description": migration["description"],
+                "applied_at": datetime.now(timezone.utc)
+            }},
+            upsert=True
+        )
+        newly_applied.append(migration["version"])
+        logger.info("Applied index migration %s: %s", migration["version"], migration["description"])
+
+    # Verify: an index dropped by hand after its migration ran is recreated here
+    for collection_name, indexes in declared_indexes().items():
+        existing = await db[collection_name].index_information()
+        existing_keys = [tuple(info["key"]) for info in existing.values()]
+        missing = [index for index in indexes if tuple(index.document["key"].items()) not in existing_keys]
+        if missing:
+            logger.warning("Recreating %d missing index(es) on %s", len(missing), collection_name)
+            await db[collection_name].create_indexes(missing)
+
+    return newly_applied
+
+def declared_indexes() -> Dict[str, List[IndexModel]]:
+    """All indexes declared across migrations, grouped by collection"""
+    indexes: Dict[str, List[IndexModel]] = {}
+    for migration in INDEX_MIGRATIONS:
+        for collection_name, models in migration["indexes"].items():
+            indexes.setdefault(collection_name, []).extend(models)
+    return indexes
+
+def find_plan_stages(plan, stages=None) -> List[str]:
+    """Collect every stage name in an explain() plan tree"""
+    if stages is None:
+        stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            find_plan_stages(value, stages)
+    elif isinstance(plan, list):
+        for item in plan:
+            find_plan_stages(item, stages)
+    return stages
+
+async def explain_query_shapes() -> List[dict]:
+    """Run explain() on every known query shape and report the winning plan stages"""
+    report = []
+    for name, collection_name, query in QUERY_SHAPES:
+        explanation = await db[collection_name].find(query).explain()
+        stages = find_plan_stages(explanation.get("queryPlanner", {}).get("winningPlan", {}))
+        report.append({
+            "name": name,
+            "collection": collection_name,
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages
+        })
+    return report
+
+# Date storage migration
+# Rewrites ISO string dates as BSON dates, collection by collection. Progress is
+# checkpointed by _id in db.schema_migrations so an interrupted run resumes.
+COLLECTION_MODELS = {
+    "users": User,
+    "trips": Trip,
+    "itineraries": Itinerary,
+    "cruise_info": CruiseInfo,
+    "port_schedules": PortSchedule,
+    "pois": POI,
+    "client_photos": ClientPhoto,
+    "client_notes": ClientNote,
+    "trip_admin": TripAdmin,
+    "payment_installments": PaymentInstallment,
+}
+
+def model_datetime_fields(model) -> List[str]:
+    return [name for name, field in model.model_fields.items()
+            if field.annotation in (datetime, Optional[datetime])]
+
+async def migrate_datetimes(batch_size: int = 1000) -> Dict[str, int]:
+    """Convert string dates to native datetimes in every collection; returns updated counts"""
+    updated_counts = {}
+    for collection_name, model in COLLECTION_MODELS.items():
+        progress_id = f"datetimes:{collection_name}"
+        progress = await db.schema_migrations.find_one({"_id": progress_id}) or {}
+        if progress.get("completed"):
+            continue
+
+        fields = model_datetime_fields(model)
+        query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+        if progress.get("last_id"):
+            query["_id"] = {"$gt": progress["last_id"]}
+        cursor = db[collection_name].find(query, {field: 1 for field in fields}).sort("_id", ASCENDING)
+
+        updated = progress.get("updated", 0)
+        batch = []
+
+        async def flush(last_id):
+            nonlocal updated
+            if batch:
+                result = await db[collection_name].bulk_write(batch, ordered=False)
+                updated += result.modified_count
+                batch.clear()
+                await record_write(collection_name)
+            await db.schema_migrations.update_one(
+                {"_id": progress_id},
+                {"$set": {"kind": "datetimes", "last_id": last_id, "updated": updated}},
+                upsert=True
+            )
+
+        last_id = progress.get("last_id")
+        async for document in cursor.batch_size(batch_size):
+            last_id = document["_id"]
+            converted = {}
+            for field in fields:
+                if isinstance(document.get(field), str):
+                    value = stored_datetime(document[field])
+                    if value is not None:
+                        converted[field] = value
+            if converted:
+                batch.append(UpdateOne({"_id": document["_id"]}, {"$set": converted}))
+            if len(batch) >= batch_size:
+                await flush(last_id)
+
+        await flush(last_id)
+        await db.schema_migrations.update_one({"_id": progress_id}, {"$set": {"completed": True}})
+        updated_counts[collection_name] = updated
+        logger.info("Migrated %d %s document(s) to native datetimes", updated, collection_name)
+    return updated_counts
+
+async def collections_with_string_dates() -> List[str]:
+    """Collections not yet migrated that still hold at least one string date"""
+    pending = []
+    for collection_name, model in COLLECTION_MODELS.items():
+        progress_id = f"datetimes:{collection_name}"
+        progress = await db.schema_migrations.find_one({"_id": progress_id}) or {}
+        if progress.get("completed"):
+            continue
+        query = {"$or": [{field: {"$type": "string"}} for field in model_datetime_fields(model)]}
+        if await db[collection_name].find_one(query, {"_id": 1}):
+            pending.append(collection_name)
+        else:
+            # Nothing to convert: record it, so later starts skip the scan
+            await db.schema_migrations.update_one(
+                {"_id": progress_id}, {"$set": {"kind": "datetimes", "completed": True}}, upsert=True
+            )
+    return pending
+
+# Fast serialization
+class ModelCodec:
+    """Precompiled decoder/encoder for one model's trusted database rows.
+
+    Documents written by this API already match their model, so list endpoints
+    project them onto the model's fields and dump them straight to JSON bytes
+    instead of validating each row twice (model construction, then response_model).
+    Rows missing a required field fall back to full validation.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.fields = list(model.model_fields)
+        self.datetime_fields = set(model_datetime_fields(model))
+        self.defaults = {
+            name: field.default for name, field in model.model_fields.items()
+            if not field.is_required() and field.default_factory is None
+        }
+        # Only the model's fields travel over the wire (never hashed_password)
+        self.projection = {name: 1 for name in self.fields}
+
+    def decode(self, document: dict) -> dict:
+        row = {}
+        for name in self.fields:
+            if name in document:
+                value = document[name]
+                if name in self.datetime_fields and isinstance(value, str):
+                    value = stored_datetime(value)  # Not yet migrated
+                row[name] = value
+            elif name in self.defaults:
+                row[name] = copy.copy(self.defaults[name])
+            else:
+                return self.model(**document).model_dump()
+        return row
+
+    def encode(self, document: dict, transform: Optional[Callable[[dict], dict]] = None) -> bytes:
+        row = self.decode(document)
+        return to_json(transform(row) if transform else row)
+
+    def encode_many(self, documents: List[dict], transform: Optional[Callable[[dict], dict]] = None) -> bytes:
+        rows = [self.decode(document) for document in documents]
+        return to_json([transform(row) for row in rows] if transform else rows)
+
+codecs: Dict[Any, ModelCodec] = {}
+
+def codec_for(model) -> ModelCodec:
+    if model not in codecs:
+        codecs[model] = ModelCodec(model)
+    return codecs[model]
+
+# Pagination
+# List endpoints page by _id (always indexed, never reused) with an opaque cursor.
+# A page holds DEFAULT_PAGE_SIZE rows unless ?limit= says otherwise, and the next
+# cursor comes back in X-Next-Cursor. ?stream=true without a limit streams every
+# row as NDJSON, read in batches, for callers that need the whole set.
+LIST_BATCH_SIZE = 200
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', '200'))
+MAX_PAGE_SIZE = 1000
+
+def encode_cursor(last_id: ObjectId) -> str:
+    return base64.urlsafe_b64encode(last_id.binary).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> ObjectId:
+    try:
+        return ObjectId(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, InvalidId, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+def page_params(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    stream: bool = False
+) -> dict:
+    """Common query parameters for paginated list endpoints"""
+    if limit is None and not stream:
+        limit = DEFAULT_PAGE_SIZE
+    return {"cursor": cursor, "limit": limit, "stream": stream}
+
+def page_cursor(collection, query: dict, cursor: Optional[str] = None, limit: Optional[int] = None,
+                projection: Optional[dict] = None):
+    """Build the Motor cursor for one page; one extra row is read to detect a next page"""
+    if cursor:
+        query = {**query, "_id": {"$gt": decode_cursor(cursor)}}
+    find_cursor = collection.find(query, projection).sort("_id", ASCENDING).batch_size(LIST_BATCH_SIZE)
+    if limit:
+        find_cursor = find_cursor.limit(limit + 1)
+    return find_cursor
+
+async def fetch_page(collection, query: dict, cursor: Optional[str] = None, limit: Optional[int] = None,
+                     projection: Optional[dict] = None):
+    """Return (documents, next_cursor) for one page, or every document when no limit is given"""
+    documents = []
+    async for document in page_cursor(collection, query, cursor, limit, projection):
+        if limit and len(documents) == limit:
+            return documents, encode_cursor(documents[-1]["_id"])
+        documents.append(document)
+    return documents, None
+
+async def stream_ndjson(find_cursor, codec: ModelCodec, limit: Optional[int] = None, transform=None):
+    """Yield one JSON line per document; a trailing next_cursor line marks a truncated page"""
+    count = 0
+    last_id = None
+    async for document in find_cursor:
+        if limit and count == limit:
+            yield json.dumps({"next_cursor": encode_cursor(last_id)}) + "\n"
+            return
+        last_id = document["_id"]
+        count += 1
+        yield codec.encode(document, transform) + b"\n"
+
+async def list_documents(collection, query: dict, model, cursor: Optional[str] = None,
+                         limit: Optional[int] = None, stream: bool = False,
+                         transform: Optional[Callable[[dict], dict]] = None, etag: Optional[str] = None) -> Response:
+    """Serve a list endpoint as a page (next cursor in X-Next-Cursor) or as an NDJSON stream"""
+    codec = codec_for(model)
+    headers = {"ETag": etag} if etag else {}
+    if stream:
+        find_cursor = page_cursor(collection, query, cursor, limit, codec.projection)
+        return StreamingResponse(stream_ndjson(find_cursor, codec, limit, transform),
+                                 media_type="application/x-ndjson", headers=headers)
+
+    documents, next_cursor = await fetch_page(collection, query, cursor, limit, codec.projection)
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+    return Response(content=codec.encode_many(documents, transform), media_type="application/json", headers=headers)
+
+# Conditional GET
+# Every write bumps its collection's counter in db.collection_versions. Read
+# endpoints hash the counters they depend on, together with the caller, path and
+# query string, into a weak ETag. A matching If-None-Match is answered with 304
+# after a single _id lookup, before any query or serialization.
+async def record_write(*collection_names: str):
+    await db.collection_versions.bulk_write([
+        UpdateOne({"_id": name}, {"$inc": {"version": 1}}, upsert=True) for name in collection_names
+    ], ordered=False)
+
+async def collection_versions(collection_names) -> Dict[str, int]:
+    documents = await db.collection_versions.find({"_id": {"$in": list(collection_names)}}).to_list(None)
+    versions = {document["_id"]: document["version"] for document in documents}
+    return {name: versions.get(name, 0) for name in collection_names}
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison, as If-None-Match requires"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(candidate.strip().removeprefix("W/") == opaque for candidate in if_none_match.split(","))
+
+def conditional_get(*collection_names: str, period_seconds: Optional[int] = None):
+    """Dependency for read endpoints backed by collection_names.
+
+    period_seconds folds the current time window into the ETag for responses
+    that change with the clock (e.g. days until a deadline).
+    """
+    async def dependency(request: Request, response: Response, current_user: dict = Depends(get_current_user)) -> str:
+        parts = [
+            request.url.path, sorted(request.query_params.multi_items()),
+            current_user["role"], current_user["id"], await collection_versions(collection_names)
+        ]
+        if period_seconds:
+            parts.append(int(time.time() // period_seconds))
+        # Keyed so clients can't forge a tag for a response they were never sent
+        digest = hmac.new(JWT_SECRET.encode(), json.dumps(parts).encode(), hashlib.sha1).hexdigest()[:24]
+        etag = f'W/"{digest}"'
+
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            raise HTTPException(status_code=304, headers={"ETag": etag})
+        # Only applies to endpoints returning plain data; Response-returning ones set it themselves
+        response.headers["ETag"] = etag
+        return etag
+    return dependency
 
 # Authentication endpoints
 @api_router.post("/auth/register")
@@ -430,7 +1703,7 @@ async def register(user_data: UserCreate):
         raise HTTPException(status_code=400, detail="Email already registered")
     
     # Hash password
-    hashed_password = bcrypt.hash(user_data.password)
+    hashed_password = await password_engine.hash(user_data.password)
     
     # Create user
     user = User(**user_data.dict(exclude={"password"}))
@@ -438,6 +1711,7 @@ async def register(user_data: UserCreate):
     user_dict["hashed_password"] = hashed_password
     
     await db.users.insert_one(user_dict)
+    await record_write("users")
     
     # Create token
     token = create_token(user_dict)
@@ -447,43 +1721,64 @@ async def register(user_data: UserCreate):
 @api_router.post("/auth/login")
 async def login(login_data: UserLogin):
     user = await db.users.find_one({"email": login_data.email})
-    if not user or not bcrypt.verify(login_data.password, user["hashed_password"]):
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    valid, new_hash = await password_engine.verify_and_update(login_data.password, user["hashed_password"])
+    if not valid:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
+    # Upgrade hashes made with an older scheme or cost
+    if new_hash:
+        await db.users.update_one({"id": user["id"]}, {"$set": {"hashed_password": new_hash}})
+        password_engine.rehashed += 1
+    
     # Check if user is blocked
     if user.get("blocked", False):
         raise HTTPException(status_code=403, detail="Account blocked. Contact administrator.")
     
     token = create_token(user)
-    user_response = User(**parse_from_mongo(user))
+    user_response = User(**user)
     
     return {"user": user_response, "token": token}
 
 @api_router.get("/auth/me")
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
-    return User(**parse_from_mongo(current_user))
+    return User(**current_user)
+
+@api_router.get("/auth/password-engine")
+async def get_password_engine_stats(current_user: dict = Depends(get_current_user)):
+    """Password hashing pool counters (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return password_engine.stats()
 
 # Trip endpoints
-@api_router.get("/trips", response_model=List[Trip])
-async def get_trips(current_user: dict = Depends(get_current_user)):
+def trips_query_for(current_user: dict) -> dict:
+    """Trips visible to the current user"""
     if current_user["role"] == "admin":
-        trips = await db.trips.find().to_list(1000)
+        return {}
     elif current_user["role"] == "agent":
-        trips = await db.trips.find({"agent_id": current_user["id"]}).to_list(1000)
+        return {"agent_id": current_user["id"]}
     else:  # client
-        trips = await db.trips.find({"client_id": current_user["id"]}).to_list(1000)
-    
-    return [Trip(**parse_from_mongo(trip)) for trip in trips]
+        return {"client_id": current_user["id"]}
+
+@api_router.get("/trips", response_model=List[Trip])
+async def get_trips(page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                    etag: str = Depends(conditional_get("trips"))):
+    return await list_documents(db.trips, trips_query_for(current_user), Trip, **page, etag=etag)
 
-@api_router.get("/trips/with-details")
-async def get_trips_with_details(current_user: dict = Depends(get_current_user)):
+@api_router.get("/trips/with-details", dependencies=[Depends(conditional_get("trips", "users"))])
+async def get_trips_with_details(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    current_user: dict = Depends(get_current_user)
+):
     """Get trips with agent and client details"""
-    if current_user["role"] == "admin":
-        trips = await db.trips.find().to_list(1000)
-    elif current_user["role"] == "agent":
-        trips = await db.trips.find({"agent_id": current_user["id"]}).to_list(1000)
-    else:  # client
-        trips = await db.trips.find({"client_id": current_user["id"]}).to_list(1000)
+    trips, next_cursor = await fetch_page(db.trips, trips_query_for(current_user), cursor, limit)
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     
     # Get all unique user IDs
     agent_ids = list(set(trip["agent_id"] for trip in trips))
@@ -492,7 +1787,7 @@ async def get_trips_with_details(current_user: dict = Depends(get_current_user))
     # Fetch agents and clients
     agents = {}
     if agent_ids:
-        agent_list = await db.users.find({"id": {"$in": agent_ids}}).to_list(1000)
+        agent_list = await db.users.find({"id": {"$in": agent_ids}}).to_list(None)
         agents = {agent["id"]: {
             "id": agent["id"],
             "first_name": agent["first_name"],
@@ -502,7 +1797,7 @@ async def get_trips_with_details(current_user: dict = Depends(get_current_user))
     
     clients = {}
     if client_ids:
-        client_list = await db.users.find({"id": {"$in": client_ids}}).to_list(1000)
+        client_list = await db.users.find({"id": {"$in": client_ids}}).to_list(None)
         clients = {client["id"]: {
             "id": client["id"], 
             "first_name": client["first_name"],
@@ -513,7 +1808,7 @@ async def get_trips_with_details(current_user: dict = Depends(get_current_user))
     # Combine trip data with user info
     trips_with_details = []
     for trip in trips:
-        trip_data = Trip(**parse_from_mongo(trip))
+        trip_data = codec_for(Trip).decode(trip)
         agent_info = agents.get(trip["agent_id"])
         client_info = clients.get(trip["client_id"])
         
@@ -534,9 +1829,11 @@ async def create_trip(trip_data: TripCreate, current_user: dict = Depends(get_cu
     trip_dict = prepare_for_mongo(trip.dict())
     
     await db.trips.insert_one(trip_dict)
+    await record_write("trips")
+    await invalidate_dashboard(trip.agent_id, trip.client_id)
     return trip
 
-@api_router.get("/trips/{trip_id}", response_model=Trip)
+@api_router.get("/trips/{trip_id}", response_model=Trip, dependencies=[Depends(conditional_get("trips"))])
 async def get_trip(trip_id: str, current_user: dict = Depends(get_current_user)):
     trip = await db.trips.find_one({"id": trip_id})
     if not trip:
@@ -547,11 +1844,63 @@ async def get_trip(trip_id: str, current_user: dict = Depends(get_current_user))
        (current_user["role"] == "agent" and trip["agent_id"] != current_user["id"]):
         raise HTTPException(status_code=403, detail="Not authorized to view this trip")
     
-    return Trip(**parse_from_mongo(trip))
+    return Trip(**trip)
+
+# Sub-resources GET /trips/{trip_id}/full can embed, selected with ?include=
+TRIP_PARTS = ("itineraries", "cruise_info", "port_schedules", "photos", "notes", "admin")
+STAFF_TRIP_PARTS = {"admin"}
+TRIP_PART_COLLECTIONS = ("itineraries", "cruise_info", "port_schedules", "client_photos", "client_notes",
+                         "trip_admin", "payment_installments")
+
+def parse_trip_parts(include: Optional[str], current_user: dict) -> List[str]:
+    """Comma-separated include list ("all" for every part the user may see)"""
+    if not include:
+        return []
+    names = [name.strip() for name in include.split(",") if name.strip()]
+    if "all" in names:
+        return [part for part in TRIP_PARTS
+                if part not in STAFF_TRIP_PARTS or current_user["role"] in ["admin", "agent"]]
+    
+    unknown = sorted(set(names) - set(TRIP_PARTS))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown include: {', '.join(unknown)}")
+    if current_user["role"] not in ["admin", "agent"] and STAFF_TRIP_PARTS & set(names):
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return list(dict.fromkeys(names))
+
+async def list_rows(collection, query: dict, model, transform=None) -> List[dict]:
+    """Every matching document, decoded like the list endpoints would return it"""
+    codec = codec_for(model)
+    documents, _ = await fetch_page(collection, query, projection=codec.projection)
+    rows = [codec.decode(document) for document in documents]
+    return [transform(row) for row in rows] if transform else rows
+
+async def load_trip_part(part: str, trip_id: str, current_user: dict, photo_size: Optional[str]):
+    if part == "itineraries":
+        return await list_rows(db.itineraries, {"trip_id": trip_id}, Itinerary)
+    if part == "port_schedules":
+        return await list_rows(db.port_schedules, {"trip_id": trip_id}, PortSchedule)
+    if part == "photos":
+        return await list_rows(db.client_photos, {"trip_id": trip_id}, ClientPhoto, photo_size_transform(photo_size))
+    if part == "notes":
+        return await list_rows(db.client_notes, {"trip_id": trip_id, "client_id": current_user["id"]}, ClientNote)
+    if part == "cruise_info":
+        cruise_info = await db.cruise_info.find_one({"trip_id": trip_id})
+        return codec_for(CruiseInfo).decode(cruise_info) if cruise_info else None
+    if part == "admin":
+        trip_admin = await load_trip_admin(trip_id)
+        return codec_for(TripAdmin).decode(trip_admin) if trip_admin else None
 
 @api_router.get("/trips/{trip_id}/full", response_model=Dict[str, Any])
-async def get_trip_with_details(trip_id: str, current_user: dict = Depends(get_current_user)):
-    """Get trip with agent and client details"""
+async def get_trip_with_details(
+    trip_id: str,
+    include: Optional[str] = Query(None, description=f"Comma-separated: {', '.join(TRIP_PARTS)} or all"),
+    photo_size: Optional[PhotoSize] = None,
+    current_user: dict = Depends(get_current_user),
+    etag: str = Depends(conditional_get("trips", "users", *TRIP_PART_COLLECTIONS))
+):
+    """Get trip with agent and client details, plus any included sub-resources"""
+    parts = parse_trip_parts(include, current_user)
     trip = await db.trips.find_one({"id": trip_id})
     if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
@@ -561,33 +1910,21 @@ async def get_trip_with_details(trip_id: str, current_user: dict = Depends(get_c
        (current_user["role"] == "agent" and trip["agent_id"] != current_user["id"]):
         raise HTTPException(status_code=403, detail="Not authorized to view this trip")
     
-    # Get agent details
-    agent = await db.users.find_one({"id": trip["agent_id"]})
-    agent_info = None
-    if agent:
-        agent_info = {
-            "id": agent["id"],
-            "first_name": agent["first_name"],
-            "last_name": agent["last_name"],
-            "email": agent["email"]
-        }
-    
-    # Get client details  
-    client = await db.users.find_one({"id": trip["client_id"]})
-    client_info = None
-    if client:
-        client_info = {
-            "id": client["id"],
-            "first_name": client["first_name"],
-            "last_name": client["last_name"],
-            "email": client["email"]
-        }
+    # Agent, client and every included part in one concurrent round
+    user_fields = {"_id": 0, "id": 1, "first_name": 1, "last_name": 1, "email": 1}
+    users, *loaded = await asyncio.gather(
+        db.users.find({"id": {"$in": [trip["agent_id"], trip["client_id"]]}}, user_fields).to_list(None),
+        *[load_trip_part(part, trip_id, current_user, photo_size) for part in parts]
+    )
+    users_by_id = {user["id"]: user for user in users}
     
-    return {
-        "trip": Trip(**parse_from_mongo(trip)),
-        "agent": agent_info,
-        "client": client_info
+    result = {
+        "trip": codec_for(Trip).decode(trip),
+        "agent": users_by_id.get(trip["agent_id"]),
+        "client": users_by_id.get(trip["client_id"]),
+        **dict(zip(parts, loaded))
     }
+    return Response(content=to_json(result), media_type="application/json", headers={"ETag": etag})
 
 @api_router.put("/trips/{trip_id}", response_model=Trip)
 async def update_trip(trip_id: str, trip_data: TripUpdate, current_user: dict = Depends(get_current_user)):
@@ -607,32 +1944,40 @@ async def update_trip(trip_id: str, trip_data: TripUpdate, current_user: dict =
     for field, value in trip_data.dict(exclude_unset=True).items():
         if value is not None:
             if isinstance(value, datetime):
-                update_data[field] = value.isoformat()
+                update_data[field] = mongo_datetime(value)
             else:
                 update_data[field] = value
     
     if update_data:
         await db.trips.update_one({"id": trip_id}, {"$set": update_data})
+        await record_write("trips")
     
     updated_trip = await db.trips.find_one({"id": trip_id})
-    return Trip(**parse_from_mongo(updated_trip))
+    await invalidate_dashboard(trip["agent_id"], trip["client_id"], updated_trip["agent_id"], updated_trip["client_id"])
+    # Notifications carry the trip title and client name
+    for agent_id in {trip["agent_id"], updated_trip["agent_id"]}:
+        await notify_deadlines_changed(agent_id)
+    return Trip(**updated_trip)
 
 @api_router.delete("/trips/{trip_id}")
 async def delete_trip(trip_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized to delete trips")
     
-    result = await db.trips.delete_one({"id": trip_id})
-    if result.deleted_count == 0:
+    trip = await db.trips.find_one_and_delete({"id": trip_id}, {"agent_id": 1, "client_id": 1})
+    if not trip:
         raise HTTPException(status_code=404, detail="Trip not found")
     
+    await record_write("trips")
+    await invalidate_dashboard(trip.get("agent_id"), trip.get("client_id"))
+    await notify_deadlines_changed(trip.get("agent_id"))
     return {"message": "Trip deleted successfully"}
 
 # Itinerary endpoints
 @api_router.get("/trips/{trip_id}/itineraries", response_model=List[Itinerary])
-async def get_itineraries(trip_id: str, current_user: dict = Depends(get_current_user)):
-    itineraries = await db.itineraries.find({"trip_id": trip_id}).to_list(1000)
-    return [Itinerary(**parse_from_mongo(itinerary)) for itinerary in itineraries]
+async def get_itineraries(trip_id: str, page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                          etag: str = Depends(conditional_get("itineraries"))):
+    return await list_documents(db.itineraries, {"trip_id": trip_id}, Itinerary, **page, etag=etag)
 
 @api_router.post("/itineraries", response_model=Itinerary)
 async def create_itinerary(itinerary_data: ItineraryCreate, current_user: dict = Depends(get_current_user)):
@@ -643,6 +1988,7 @@ async def create_itinerary(itinerary_data: ItineraryCreate, current_user: dict =
     itinerary_dict = prepare_for_mongo(itinerary.dict())
     
     await db.itineraries.insert_one(itinerary_dict)
+    await record_write("itineraries")
     return itinerary
 
 @api_router.put("/itineraries/{itinerary_id}", response_model=Itinerary)
@@ -652,12 +1998,13 @@ async def update_itinerary(itinerary_id: str, itinerary_data: ItineraryCreate, c
     
     update_data = prepare_for_mongo(itinerary_data.dict())
     await db.itineraries.update_one({"id": itinerary_id}, {"$set": update_data})
+    await record_write("itineraries")
     
     updated_itinerary = await db.itineraries.find_one({"id": itinerary_id})
     if not updated_itinerary:
         raise HTTPException(status_code=404, detail="Itinerary not found")
     
-    return Itinerary(**parse_from_mongo(updated_itinerary))
+    return Itinerary(**updated_itinerary)
 
 # Cruise specific endpoints
 @api_router.post("/trips/{trip_id}/cruise-info", response_model=CruiseInfo)
@@ -669,13 +2016,14 @@ async def create_cruise_info(trip_id: str, cruise_data: CruiseInfoCreate, curren
     cruise_dict = prepare_for_mongo(cruise_info.dict())
     
     await db.cruise_info.insert_one(cruise_dict)
+    await record_write("cruise_info")
     return cruise_info
 
-@api_router.get("/trips/{trip_id}/cruise-info", response_model=Optional[CruiseInfo])
+@api_router.get("/trips/{trip_id}/cruise-info", response_model=Optional[CruiseInfo], dependencies=[Depends(conditional_get("cruise_info"))])
 async def get_cruise_info(trip_id: str, current_user: dict = Depends(get_current_user)):
     cruise_info = await db.cruise_info.find_one({"trip_id": trip_id})
     if cruise_info:
-        return CruiseInfo(**parse_from_mongo(cruise_info))
+        return CruiseInfo(**cruise_info)
     return None
 
 @api_router.put("/cruise-info/{cruise_info_id}", response_model=CruiseInfo)
@@ -685,17 +2033,18 @@ async def update_cruise_info(cruise_info_id: str, cruise_data: CruiseInfoCreate,
     
     update_data = prepare_for_mongo(cruise_data.dict())
     await db.cruise_info.update_one({"id": cruise_info_id}, {"$set": update_data})
+    await record_write("cruise_info")
     
     updated_cruise = await db.cruise_info.find_one({"id": cruise_info_id})
     if not updated_cruise:
         raise HTTPException(status_code=404, detail="Cruise info not found")
     
-    return CruiseInfo(**parse_from_mongo(updated_cruise))
+    return CruiseInfo(**updated_cruise)
 
 @api_router.get("/trips/{trip_id}/port-schedules", response_model=List[PortSchedule])
-async def get_port_schedules(trip_id: str, current_user: dict = Depends(get_current_user)):
-    schedules = await db.port_schedules.find({"trip_id": trip_id}).to_list(1000)
-    return [PortSchedule(**parse_from_mongo(schedule)) for schedule in schedules]
+async def get_port_schedules(trip_id: str, page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                             etag: str = Depends(conditional_get("port_schedules"))):
+    return await list_documents(db.port_schedules, {"trip_id": trip_id}, PortSchedule, **page, etag=etag)
 
 @api_router.post("/port-schedules", response_model=PortSchedule)
 async def create_port_schedule(schedule_data: PortScheduleCreate, current_user: dict = Depends(get_current_user)):
@@ -706,17 +2055,22 @@ async def create_port_schedule(schedule_data: PortScheduleCreate, current_user:
     schedule_dict = prepare_for_mongo(schedule.dict())
     
     await db.port_schedules.insert_one(schedule_dict)
+    await record_write("port_schedules")
     return schedule
 
 # POI endpoints
 @api_router.get("/pois", response_model=List[POI])
-async def get_pois(category: Optional[POICategory] = None, current_user: dict = Depends(get_current_user)):
+async def get_pois(
+    category: Optional[POICategory] = None,
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    etag: str = Depends(conditional_get("pois"))
+):
     query = {}
     if category:
         query["category"] = category
     
-    pois = await db.pois.find(query).to_list(1000)
-    return [POI(**parse_from_mongo(poi)) for poi in pois]
+    return await list_documents(db.pois, query, POI, **page, etag=etag)
 
 @api_router.post("/pois", response_model=POI)
 async def create_poi(poi_data: POICreate, current_user: dict = Depends(get_current_user)):
@@ -727,52 +2081,526 @@ async def create_poi(poi_data: POICreate, current_user: dict = Depends(get_curre
     poi_dict = prepare_for_mongo(poi.dict())
     
     await db.pois.insert_one(poi_dict)
+    await record_write("pois")
     return poi
 
-# Photo endpoints
-@api_router.post("/trips/{trip_id}/photos")
-async def upload_photo(
-    trip_id: str,
-    file: UploadFile = File(...),
-    caption: str = Form(""),
-    photo_category: PhotoCategory = Form(...),
-    current_user: dict = Depends(get_current_user)
-):
-    if current_user["role"] != "client":
-        # Check if agent owns this trip
-        trip = await db.trips.find_one({"id": trip_id})
-        if not trip or (current_user["role"] == "agent" and trip["agent_id"] != current_user["id"]):
-            raise HTTPException(status_code=403, detail="Not authorized")
-    else:
-        # Check if client owns this trip
-        trip = await db.trips.find_one({"id": trip_id})
-        if not trip or trip["client_id"] != current_user["id"]:
-            raise HTTPException(status_code=403, detail="Not authorized")
+# Bulk endpoints
+# A batch is validated item by item, written with one insert_many per collection
+# and answered with a result per item: created, invalid, failed or skipped (not
+# attempted because an earlier item of an ordered batch did not go through).
+# An Idempotency-Key header makes a retried batch replay the stored response.
+def validation_errors(exc: ValidationError) -> List[dict]:
+    return [{"loc": list(error["loc"]), "msg": error["msg"]} for error in exc.errors()]
+
+def validate_batch(batch: BulkRequest, build) -> tuple:
+    """(results, valid): results has one entry per item; valid pairs item index with build(item)"""
+    results = [{"index": index, "status": "skipped"} for index in range(len(batch.items))]
+    valid = []
+    for index, item in enumerate(batch.items):
+        try:
+            valid.append((index, build(item)))
+        except ValidationError as exc:
+            results[index].update(status="invalid", errors=validation_errors(exc))
+            if batch.ordered:
+                break
+    return results, valid
+
+async def insert_batch(collection, documents: List[dict], ordered: bool) -> List[Optional[str]]:
+    """insert_many, returning per-document errors (None when inserted, "skipped" when not attempted)"""
+    errors: List[Optional[str]] = [None] * len(documents)
+    if not documents:
+        return errors
+    try:
+        await collection.insert_many(documents, ordered=ordered)
+    except BulkWriteError as exc:
+        write_errors = exc.details.get("writeErrors", [])
+        for write_error in write_errors:
+            errors[write_error["index"]] = write_error["errmsg"]
+        if ordered and write_errors:
+            first_failure = min(write_error["index"] for write_error in write_errors)
+            for index in range(first_failure + 1, len(documents)):
+                errors[index] = "skipped"
+    return errors
+
+def apply_insert_errors(results: List[dict], indexes: List[int], errors: List[Optional[str]]):
+    for index, error in zip(indexes, errors):
+        if error == "skipped":
+            results[index]["status"] = "skipped"
+        elif error:
+            results[index].update(status="failed", error=error)
+
+def bulk_summary(batch: BulkRequest, results: List[dict]) -> dict:
+    counts = defaultdict(int)
+    for result in results:
+        counts[result["status"]] += 1
+    return {
+        "ordered": batch.ordered,
+        "created": counts["created"],
+        "invalid": counts["invalid"],
+        "failed": counts["failed"],
+        "skipped": counts["skipped"],
+        "results": results
+    }
+
+async def run_idempotent(idempotency_key: Optional[str], scope: str, batch: BulkRequest, handler) -> dict:
+    """Run handler() once per (user, endpoint, key); retries get the first response back"""
+    if not idempotency_key:
+        return await handler()
+    if len(idempotency_key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+    
+    key = f"{scope}:{idempotency_key}"
+    request_hash = hashlib.sha256(to_json(batch.model_dump())).hexdigest()
+    try:
+        # created_at is always a BSON date: the TTL index expires these records
+        await db.idempotency_keys.insert_one({
+            "_id": key, "request_hash": request_hash, "response": None, "created_at": datetime.now(timezone.utc)
+        })
+    except DuplicateKeyError:
+        record = await db.idempotency_keys.find_one({"_id": key})
+        if record is None:  # Expired in between
+            return await run_idempotent(idempotency_key, scope, batch, handler)
+        if record["request_hash"] != request_hash:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different batch")
+        if record["response"] is None:
+            raise HTTPException(status_code=409, detail="A batch with this Idempotency-Key is still being processed")
+        return {**record["response"], "replayed": True}
     
-    # Create uploads directory if it doesn't exist
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
+    try:
+        response = await handler()
+    except BaseException:
+        # Nothing to replay: let the client retry with the same key
+        await db.idempotency_keys.delete_one({"_id": key})
+        raise
+    await db.idempotency_keys.update_one({"_id": key}, {"$set": {"response": response}})
+    return response
+
+async def bulk_create(collection, create_model, model, batch: BulkRequest) -> dict:
+    """Validate each item as create_model and insert them as model documents"""
+    results, valid = validate_batch(batch, lambda item: model(**create_model(**item).dict()))
+    documents = [prepare_for_mongo(document.dict()) for _, document in valid]
+    errors = await insert_batch(collection, documents, batch.ordered)
+    for (index, document), error in zip(valid, errors):
+        if error is None:
+            results[index].update(status="created", id=document.id)
+    apply_insert_errors(results, [index for index, _ in valid], errors)
+    if any(result["status"] == "created" for result in results):
+        await record_write(collection.name)
+    return bulk_summary(batch, results)
+
+@api_router.post("/itineraries/bulk")
+async def bulk_create_itineraries(
+    batch: BulkRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Create itinerary days, each optionally with its port schedule"""
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Save file
-    file_id = str(uuid.uuid4())
-    file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-    filename = f"{file_id}.{file_extension}"
-    file_path = upload_dir / filename
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    def build(item: dict) -> tuple:
+        day = BulkItineraryItem(**item)
+        itinerary = Itinerary(**day.dict(exclude={"port_schedule"}))
+        schedule = None
+        if day.port_schedule:
+            schedule = PortSchedule(**day.port_schedule.dict(), trip_id=itinerary.trip_id, itinerary_id=itinerary.id)
+        return itinerary, schedule
+    
+    async def handler() -> dict:
+        results, valid = validate_batch(batch, build)
+        itineraries = [prepare_for_mongo(itinerary.dict()) for _, (itinerary, _) in valid]
+        errors = await insert_batch(db.itineraries, itineraries, batch.ordered)
+        apply_insert_errors(results, [index for index, _ in valid], errors)
+        
+        # Port schedules only for the days that were created
+        created = [(index, itinerary, schedule) for (index, (itinerary, schedule)), error in zip(valid, errors) if error is None]
+        for index, itinerary, _ in created:
+            results[index].update(status="created", id=itinerary.id)
+        with_schedules = [(index, schedule) for index, _, schedule in created if schedule]
+        schedule_errors = await insert_batch(
+            db.port_schedules, [prepare_for_mongo(schedule.dict()) for _, schedule in with_schedules], ordered=False
+        )
+        for (index, schedule), error in zip(with_schedules, schedule_errors):
+            if error:
+                results[index]["port_schedule_error"] = error
+            else:
+                results[index]["port_schedule_id"] = schedule.id
+        
+        if created:
+            await record_write("itineraries", *(["port_schedules"] if with_schedules else []))
+        return bulk_summary(batch, results)
+    
+    return await run_idempotent(idempotency_key, f"{current_user['id']}:itineraries", batch, handler)
+
+@api_router.post("/port-schedules/bulk")
+async def bulk_create_port_schedules(
+    batch: BulkRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return await run_idempotent(idempotency_key, f"{current_user['id']}:port-schedules", batch,
+                                lambda: bulk_create(db.port_schedules, PortScheduleCreate, PortSchedule, batch))
+
+@api_router.post("/pois/bulk")
+async def bulk_create_pois(
+    batch: BulkRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return await run_idempotent(idempotency_key, f"{current_user['id']}:pois", batch,
+                                lambda: bulk_create(db.pois, POICreate, POI, batch))
+
+# Photo storage
+# Uploads are streamed in chunks off the event loop, hashed on the way and stored
+# under their SHA-256, so an identical photo is only kept once.
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+class SpooledUpload:
+    """An upload written to a local temp file, with its digest and size"""
+    def __init__(self, path: Path, sha256: str, size: int, extension: str):
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+        self.extension = extension
+
+    @property
+    def key(self) -> str:
+        return f"{self.sha256}.{self.extension}"
+
+def upload_extension(filename: Optional[str]) -> str:
+    extension = filename.rsplit(".", 1)[-1].lower() if filename and "." in filename else ""
+    return extension if re.fullmatch(r"[a-z0-9]{1,10}", extension) else "jpg"
+
+async def spool_upload(upload: UploadFile, spool_dir: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> SpooledUpload:
+    """Stream an upload to a temp file in spool_dir, rejecting it as soon as it exceeds max_bytes"""
+    if upload.size is not None and upload.size > max_bytes:
+        raise HTTPException(status_code=413, detail="File too large")
+
+    spool_dir.mkdir(parents=True, exist_ok=True)
+    handle, temp_name = tempfile.mkstemp(prefix=".upload-", dir=spool_dir)
+    temp_file = os.fdopen(handle, "wb")
+    digest = hashlib.sha256()
+    size = 0
+
+    def write_chunk(chunk: bytes):
+        digest.update(chunk)
+        temp_file.write(chunk)
+
+    def finish():
+        temp_file.flush()
+        os.fsync(temp_file.fileno())
+        temp_file.close()
+
+    try:
+        while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+            size += len(chunk)
+            if size > max_bytes:
+                raise HTTPException(status_code=413, detail="File too large")
+            await asyncio.to_thread(write_chunk, chunk)
+        await asyncio.to_thread(finish)
+    except BaseException:
+        temp_file.close()
+        os.unlink(temp_name)
+        raise
+    return SpooledUpload(Path(temp_name), digest.hexdigest(), size, upload_extension(upload.filename))
+
+class PhotoStorage(ABC):
+    """Interface for photo backends. Keys are content addresses ("<sha256>.<ext>")."""
+    spool_dir: Path
+
+    async def save(self, upload: UploadFile) -> SpooledUpload:
+        """Store an upload; returns its key, digest and size"""
+        spooled = await spool_upload(upload, self.spool_dir)
+        try:
+            await self.put_file(spooled.path, spooled.key)
+        finally:
+            if spooled.path.exists():
+                await asyncio.to_thread(os.unlink, spooled.path)
+        return spooled
+
+    @abstractmethod
+    async def put_file(self, path: Path, key: str):
+        """Move a finished local file to key. Must be a no-op if key already exists."""
+
+    @abstractmethod
+    async def put_bytes(self, key: str, data: bytes):
+        """Store data under key"""
+
+    @abstractmethod
+    async def get_bytes(self, key: str) -> bytes:
+        """Read back the bytes stored under key"""
+
+    @abstractmethod
+    def url_for(self, key: str) -> str:
+        """Public URL of key: a path on this server, or absolute for external stores"""
+
+class LocalPhotoStorage(PhotoStorage):
+    def __init__(self, root: Path, base_url: str = "/uploads"):
+        self.root = root
+        self.spool_dir = root
+        self.base_url = base_url
+
+    def path_for(self, key: str) -> Path:
+        return self.root / key
+
+    async def put_file(self, path: Path, key: str):
+        target = self.path_for(key)
+        if target.exists():
+            return  # Same content already stored
+        target.parent.mkdir(parents=True, exist_ok=True)
+        # Temp file lives on the same filesystem, so the rename is atomic
+        await asyncio.to_thread(os.replace, path, target)
+
+    async def put_bytes(self, key: str, data: bytes):
+        def write():
+            target = self.path_for(key)
+            target.parent.mkdir(parents=True, exist_ok=True)
+            handle, temp_name = tempfile.mkstemp(prefix=".upload-", dir=target.parent)
+            with os.fdopen(handle, "wb") as temp_file:
+                temp_file.write(data)
+            os.replace(temp_name, target)
+        await asyncio.to_thread(write)
+
+    async def get_bytes(self, key: str) -> bytes:
+        return await asyncio.to_thread(self.path_for(key).read_bytes)
+
+    def url_for(self, key: str) -> str:
+        return f"{self.base_url}/{key}"
+
+class S3PhotoStorage(PhotoStorage):
+    """S3-compatible backend; point S3_ENDPOINT_URL at MinIO or another local stand-in for testing"""
+    def __init__(self, bucket: str, prefix: str = "photos", endpoint_url: Optional[str] = None,
+                 public_base_url: Optional[str] = None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.s3 = boto3.client("s3", endpoint_url=endpoint_url)
+        self.spool_dir = Path(tempfile.gettempdir()) / "photo-uploads"
+        if public_base_url:
+            self.public_base_url = public_base_url.rstrip("/")
+        elif endpoint_url:
+            self.public_base_url = f"{endpoint_url.rstrip('/')}/{bucket}"
+        else:
+            self.public_base_url = f"https://{bucket}.s3.amazonaws.com"
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    async def exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            await asyncio.to_thread(self.s3.head_object, Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+
+    async def put_file(self, path: Path, key: str):
+        if await self.exists(key):
+            return  # Same content already stored
+        await asyncio.to_thread(self.s3.upload_file, str(path), self.bucket, self.object_key(key))
+
+    async def put_bytes(self, key: str, data: bytes):
+        await asyncio.to_thread(self.s3.put_object, Bucket=self.bucket, Key=self.object_key(key), Body=data)
+
+    async def get_bytes(self, key: str) -> bytes:
+        response = await asyncio.to_thread(self.s3.get_object, Bucket=self.bucket, Key=self.object_key(key))
+        return await asyncio.to_thread(response["Body"].read)
+
+    def url_for(self, key: str) -> str:
+        return f"{self.public_base_url}/{self.object_key(key)}"
+
+def create_photo_storage() -> PhotoStorage:
+    if os.environ.get('PHOTO_STORAGE', 'local') == 's3':
+        return S3PhotoStorage(
+            bucket=os.environ['S3_BUCKET'],
+            prefix=os.environ.get('S3_PREFIX', 'photos'),
+            endpoint_url=os.environ.get('S3_ENDPOINT_URL'),
+            public_base_url=os.environ.get('S3_PUBLIC_BASE_URL')
+        )
+    return LocalPhotoStorage(Path(os.environ.get('UPLOAD_DIR', str(ROOT_DIR / 'uploads'))))
+
+photo_storage = create_photo_storage()
+
+# Photo variants
+# upload_photo queues each new photo; worker tasks render thumbnails and a
+# web-optimized copy in a process pool and record their URLs on the photo.
+PHOTO_VARIANTS = {
+    # name: (max width/height, JPEG quality)
+    "small": (160, 75),
+    "medium": (480, 80),
+    "large": (1024, 82),
+    "web": (1920, 85),
+}
+
+def render_photo_variants(data: bytes) -> Dict[str, bytes]:
+    """Render every variant of an image as JPEG bytes (runs in a worker process)"""
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(io.BytesIO(data)) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    for name, (max_side, quality) in PHOTO_VARIANTS.items():
+        variant = image.copy()
+        variant.thumbnail((max_side, max_side), Image.LANCZOS)
+        buffer = io.BytesIO()
+        variant.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+        variants[name] = buffer.getvalue()
+    return variants
+
+class PhotoProcessor:
+    """Bounded queue of photo ids drained by worker tasks into a process pool"""
+    def __init__(self, workers: int, processes: int, queue_size: int = 1000):
+        self.workers = workers
+        self.processes = processes
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.pool: Optional[ProcessPoolExecutor] = None
+        self.tasks: List[asyncio.Task] = []
+        self.active = 0
+        self.processed = 0
+        self.failed = 0
+
+    def enqueue(self, photo_id: str) -> bool:
+        try:
+            self.queue.put_nowait(photo_id)
+            return True
+        except asyncio.QueueFull:
+            return False  # Stays pending; picked up again on the next start
+
+    async def start(self):
+        self.pool = ProcessPoolExecutor(max_workers=self.processes)
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+        # Photos queued by a previous process that never got processed
+        async for photo in db.client_photos.find({"variants_status": "pending"}, {"id": 1}):
+            if not self.enqueue(photo["id"]):
+                break
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        if self.pool:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+    async def work(self):
+        while True:
+            photo_id = await self.queue.get()
+            self.active += 1
+            try:
+                await self.process(photo_id)
+                self.processed += 1
+            except Exception:
+                self.failed += 1
+                logger.exception("Rendering variants for photo %s failed", photo_id)
+                await db.client_photos.update_one({"id": photo_id}, {"$set": {"variants_status": "failed"}})
+                await record_write("client_photos")
+            finally:
+                self.active -= 1
+                self.queue.task_done()
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "processes": self.processes,
+            "queue_size": self.queue.maxsize,
+            "queue_depth": self.queue.qsize(),
+            "active": self.active,
+            "processed": self.processed,
+            "failed": self.failed,
+        }
+
+    async def process(self, photo_id: str):
+        photo = await db.client_photos.find_one({"id": photo_id})
+        if not photo or photo.get("variants_status") != "pending":
+            return
+
+        # An identical upload already has its variants
+        twin = await db.client_photos.find_one(
+            {"sha256": photo["sha256"], "variants_status": "ready"}, {"variants": 1}
+        )
+        if twin:
+            variants = twin["variants"]
+        else:
+            data = await photo_storage.get_bytes(photo["storage_key"])
+            loop = asyncio.get_running_loop()
+            rendered = await loop.run_in_executor(self.pool, render_photo_variants, data)
+            variants = {}
+            for name, content in rendered.items():
+                variant_key = f"{photo['sha256']}_{name}.jpg"
+                await photo_storage.put_bytes(variant_key, content)
+                variants[name] = photo_storage.url_for(variant_key)
+
+        await db.client_photos.update_one(
+            {"id": photo_id}, {"$set": {"variants": variants, "variants_status": "ready"}}
+        )
+        await record_write("client_photos")
+
+photo_processor = PhotoProcessor(
+    workers=int(os.environ.get('PHOTO_QUEUE_WORKERS', '2')),
+    processes=int(os.environ.get('PHOTO_PROCESSES', '2'))
+)
+
+def photo_size_transform(size: Optional[PhotoSize]):
+    """Point url at the requested variant, keeping the original under variants["original"]"""
+    if not size or size == "original":
+        return None
+
+    def transform(row: dict) -> dict:
+        variants = row.get("variants") or {}
+        return {**row, "url": variants.get(size, row["url"]), "variants": {**variants, "original": row["url"]}}
+    return transform
+
+# Photo endpoints
+@api_router.post("/trips/{trip_id}/photos")
+async def upload_photo(
+    trip_id: str,
+    file: UploadFile = File(...),
+    caption: str = Form(""),
+    photo_category: PhotoCategory = Form(...),
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user["role"] != "client":
+        # Check if agent owns this trip
+        trip = await db.trips.find_one({"id": trip_id})
+        if not trip or (current_user["role"] == "agent" and trip["agent_id"] != current_user["id"]):
+            raise HTTPException(status_code=403, detail="Not authorized")
+    else:
+        # Check if client owns this trip
+        trip = await db.trips.find_one({"id": trip_id})
+        if not trip or trip["client_id"] != current_user["id"]:
+            raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # Save file
+    stored = await photo_storage.save(file)
     
     # Save photo info to database
     photo = ClientPhoto(
         trip_id=trip_id,
         client_id=current_user["id"],
-        url=f"/uploads/{filename}",
+        url=photo_storage.url_for(stored.key),
         caption=caption,
-        photo_category=photo_category
+        photo_category=photo_category,
+        sha256=stored.sha256,
+        size_bytes=stored.size,
+        storage_key=stored.key,
+        variants_status="pending"
     )
     
     photo_dict = prepare_for_mongo(photo.dict())
     await db.client_photos.insert_one(photo_dict)
+    await record_write("client_photos")
+    photo_processor.enqueue(photo.id)
+    await invalidate_dashboard(photo.client_id)
     
     return photo
 
@@ -780,20 +2608,24 @@ async def upload_photo(
 async def get_trip_photos(
     trip_id: str,
     category: Optional[PhotoCategory] = None,
-    current_user: dict = Depends(get_current_user)
+    size: Optional[PhotoSize] = None,
+    page: dict = Depends(page_params),
+    current_user: dict = Depends(get_current_user),
+    etag: str = Depends(conditional_get("client_photos"))
 ):
+    """List trip photos; size picks a thumbnail or web variant for url when one is ready"""
     query = {"trip_id": trip_id}
     if category:
         query["photo_category"] = category
     
-    photos = await db.client_photos.find(query).to_list(1000)
-    return [ClientPhoto(**parse_from_mongo(photo)) for photo in photos]
+    return await list_documents(db.client_photos, query, ClientPhoto, transform=photo_size_transform(size), **page, etag=etag)
 
 # Client notes endpoints
 @api_router.get("/trips/{trip_id}/notes", response_model=List[ClientNote])
-async def get_client_notes(trip_id: str, current_user: dict = Depends(get_current_user)):
-    notes = await db.client_notes.find({"trip_id": trip_id, "client_id": current_user["id"]}).to_list(1000)
-    return [ClientNote(**parse_from_mongo(note)) for note in notes]
+async def get_client_notes(trip_id: str, page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                           etag: str = Depends(conditional_get("client_notes"))):
+    query = {"trip_id": trip_id, "client_id": current_user["id"]}
+    return await list_documents(db.client_notes, query, ClientNote, **page, etag=etag)
 
 @api_router.post("/trips/{trip_id}/notes", response_model=ClientNote)
 async def create_client_note(trip_id: str, note_data: ClientNoteCreate, current_user: dict = Depends(get_current_user)):
@@ -804,6 +2636,7 @@ async def create_client_note(trip_id: str, note_data: ClientNoteCreate, current_
     note_dict = prepare_for_mongo(note.dict())
     
     await db.client_notes.insert_one(note_dict)
+    await record_write("client_notes")
     return note
 
 @api_router.put("/notes/{note_id}", response_model=ClientNote)
@@ -814,29 +2647,28 @@ async def update_client_note(note_id: str, note_text: str, current_user: dict =
     
     update_data = {
         "note_text": note_text,
-        "updated_at": datetime.now(timezone.utc).isoformat()
+        "updated_at": mongo_datetime(datetime.now(timezone.utc))
     }
     
     await db.client_notes.update_one({"id": note_id}, {"$set": update_data})
+    await record_write("client_notes")
     
     updated_note = await db.client_notes.find_one({"id": note_id})
-    return ClientNote(**parse_from_mongo(updated_note))
+    return ClientNote(**updated_note)
 
 # Users management (admin only)
 @api_router.get("/users", response_model=List[User])
-async def get_users(current_user: dict = Depends(get_current_user)):
+async def get_users(page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                    etag: str = Depends(conditional_get("users"))):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    users_data = await db.users.find().to_list(1000)
-    
     # If agent, only show clients they can manage
-    if current_user["role"] == "agent":
-        users_data = [user for user in users_data if user.get("role") == "client"]
+    query = {"role": "client"} if current_user["role"] == "agent" else {}
     
-    return [User(**parse_from_mongo(user)) for user in users_data]
+    return await list_documents(db.users, query, User, **page, etag=etag)
 
-@api_router.get("/users/{user_id}", response_model=User)
+@api_router.get("/users/{user_id}", response_model=User, dependencies=[Depends(conditional_get("users"))])
 async def get_user_by_id(user_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
@@ -850,17 +2682,17 @@ async def get_user_by_id(user_id: str, current_user: dict = Depends(get_current_
         if user_data.get("role") != "client":
             raise HTTPException(status_code=403, detail="Not authorized to access this user")
     
-    return User(**parse_from_mongo(user_data))
+    return User(**user_data)
 
 # Clients management (admin and agent)
 @api_router.get("/clients", response_model=List[User])
-async def get_clients(current_user: dict = Depends(get_current_user)):
+async def get_clients(page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                      etag: str = Depends(conditional_get("users"))):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
     # Get all clients
-    clients = await db.users.find({"role": "client"}).to_list(1000)
-    return [User(**parse_from_mongo(client)) for client in clients]
+    return await list_documents(db.users, {"role": "client"}, User, **page, etag=etag)
 
 @api_router.put("/users/{user_id}", response_model=User)
 async def update_user(user_id: str, user_data: UserUpdate, current_user: dict = Depends(get_current_user)):
@@ -885,9 +2717,13 @@ async def update_user(user_id: str, user_data: UserUpdate, current_user: dict =
     update_data = {k: v for k, v in user_data.dict(exclude_unset=True).items() if v is not None}
     if update_data:
         await db.users.update_one({"id": user_id}, {"$set": update_data})
+        await record_write("users")
+        await invalidate_user(user_id)
+        if user_to_update["role"] == "client" and {"first_name", "last_name"} & set(update_data):
+            await notify_deadlines_changed()  # Client names appear in every scope
     
     updated_user = await db.users.find_one({"id": user_id})
-    return User(**parse_from_mongo(updated_user))
+    return User(**updated_user)
 
 @api_router.post("/users/{user_id}/block")
 async def block_user(user_id: str, current_user: dict = Depends(get_current_user)):
@@ -910,6 +2746,8 @@ async def block_user(user_id: str, current_user: dict = Depends(get_current_user
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.users.update_one({"id": user_id}, {"$set": {"blocked": True}})
+    await record_write("users")
+    await invalidate_user(user_id)
     return {"message": "User blocked successfully"}
 
 @api_router.post("/users/{user_id}/unblock")
@@ -926,6 +2764,8 @@ async def unblock_user(user_id: str, current_user: dict = Depends(get_current_us
         raise HTTPException(status_code=403, detail="Not authorized")
     
     await db.users.update_one({"id": user_id}, {"$set": {"blocked": False}})
+    await record_write("users")
+    await invalidate_user(user_id)
     return {"message": "User unblocked successfully"}
 
 @api_router.delete("/users/{user_id}")
@@ -942,47 +2782,67 @@ async def delete_user(user_id: str, current_user: dict = Depends(get_current_use
         raise HTTPException(status_code=400, detail="Cannot delete yourself")
     
     result = await db.users.delete_one({"id": user_id})
+    await record_write("users")
+    await invalidate_user(user_id)
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
     
     return {"message": "User deleted successfully"}
 
 # Dashboard stats
-@api_router.get("/dashboard/stats")
-async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
+async def count_dashboard_stats(current_user: dict) -> dict:
+    """Run the role's counts concurrently; whole-collection totals come from metadata"""
     if current_user["role"] == "admin":
-        total_trips = await db.trips.count_documents({})
-        total_users = await db.users.count_documents({})
-        active_trips = await db.trips.count_documents({"status": "active"})
+        total_trips, total_users, active_trips, total_photos = await asyncio.gather(
+            db.trips.estimated_document_count(),
+            db.users.estimated_document_count(),
+            db.trips.count_documents({"status": "active"}),
+            db.client_photos.estimated_document_count()
+        )
         
         return {
             "total_trips": total_trips,
             "total_users": total_users,
             "active_trips": active_trips,
-            "total_photos": await db.client_photos.count_documents({})
+            "total_photos": total_photos
         }
     elif current_user["role"] == "agent":
-        agent_trips = await db.trips.count_documents({"agent_id": current_user["id"]})
-        active_trips = await db.trips.count_documents({"agent_id": current_user["id"], "status": "active"})
+        agent_trips, active_trips, completed_trips = await asyncio.gather(
+            db.trips.count_documents({"agent_id": current_user["id"]}),
+            db.trips.count_documents({"agent_id": current_user["id"], "status": "active"}),
+            db.trips.count_documents({"agent_id": current_user["id"], "status": "completed"})
+        )
         
         return {
             "my_trips": agent_trips,
             "active_trips": active_trips,
-            "completed_trips": await db.trips.count_documents({"agent_id": current_user["id"], "status": "completed"})
+            "completed_trips": completed_trips
         }
     else:  # client
-        my_trips = await db.trips.count_documents({"client_id": current_user["id"]})
-        my_photos = await db.client_photos.count_documents({"client_id": current_user["id"]})
+        my_trips, my_photos, upcoming_trips = await asyncio.gather(
+            db.trips.count_documents({"client_id": current_user["id"]}),
+            db.client_photos.count_documents({"client_id": current_user["id"]}),
+            db.trips.count_documents({
+                "client_id": current_user["id"],
+                "start_date": {"$gte": mongo_datetime(datetime.now(timezone.utc))}
+            })
+        )
         
         return {
             "my_trips": my_trips,
             "my_photos": my_photos,
-            "upcoming_trips": await db.trips.count_documents({
-                "client_id": current_user["id"],
-                "start_date": {"$gte": datetime.now(timezone.utc).isoformat()}
-            })
+            "upcoming_trips": upcoming_trips
         }
 
+@api_router.get("/dashboard/stats", dependencies=[Depends(conditional_get("trips", "users", "client_photos", period_seconds=60))])
+async def get_dashboard_stats(current_user: dict = Depends(get_current_user)):
+    key = dashboard_cache_key(current_user)
+    stats = dashboard_cache.get(key)
+    if stats is None:
+        stats = await count_dashboard_stats(current_user)
+        dashboard_cache.set(key, stats)
+    return stats
+
 # Trip Administration endpoints (Admin/Agent only)
 @api_router.post("/trips/{trip_id}/admin", response_model=TripAdmin)
 async def create_trip_admin(trip_id: str, admin_data: TripAdminCreate, current_user: dict = Depends(get_current_user)):
@@ -999,25 +2859,39 @@ async def create_trip_admin(trip_id: str, admin_data: TripAdminCreate, current_u
     
     # Calculate derived fields
     admin_dict = prepare_for_mongo(admin_data.dict())
-    calculated_data = calculate_trip_admin_fields(admin_dict)
+    calculated_data = calculate_trip_admin_fields(admin_dict, agent_id=trip["agent_id"])
     
     trip_admin = TripAdmin(**calculated_data)
     admin_dict = prepare_for_mongo(trip_admin.dict())
     
-    await db.trip_admin.insert_one(admin_dict)
+    async def create(session):
+        await db.trip_admin.insert_one(admin_dict, session=session)
+        await apply_rollup_delta(None, admin_dict, trip["agent_id"], session)
+    
+    await transactions.run(create)
+    await record_write("trip_admin")
+    await notify_deadlines_changed(trip["agent_id"])
     return trip_admin
 
-@api_router.get("/trips/{trip_id}/admin", response_model=Optional[TripAdmin])
+async def load_trip_admin(trip_id: str) -> Optional[dict]:
+    """A trip's admin record with its derived fields recalculated"""
+    trip_admin = await db.trip_admin.find_one({"trip_id": trip_id})
+    if not trip_admin:
+        return None
+    installments = None
+    if "total_paid" not in trip_admin:
+        # Not written since total_paid was introduced: sum the installments instead
+        installments = await db.payment_installments.find({"trip_admin_id": trip_admin["id"]}).to_list(None)
+    return calculate_trip_admin_fields(trip_admin, installments, await trip_agent_id(trip_id))
+
+@api_router.get("/trips/{trip_id}/admin", response_model=Optional[TripAdmin], dependencies=[Depends(conditional_get("trip_admin", "payment_installments"))])
 async def get_trip_admin(trip_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    trip_admin = await db.trip_admin.find_one({"trip_id": trip_id})
-    if trip_admin:
-        # Get installments and recalculate
-        installments = await db.payment_installments.find({"trip_admin_id": trip_admin["id"]}).to_list(1000)
-        calculated_data = calculate_trip_admin_fields(trip_admin, installments)
-        return TripAdmin(**parse_from_mongo(calculated_data))
+    calculated_data = await load_trip_admin(trip_id)
+    if calculated_data:
+        return TripAdmin(**calculated_data)
     return None
 
 @api_router.put("/trip-admin/{admin_id}", response_model=TripAdmin)
@@ -1025,24 +2899,180 @@ async def update_trip_admin(admin_id: str, admin_data: TripAdminUpdate, current_
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    existing = await db.trip_admin.find_one({"id": admin_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Trip admin not found")
-    
     # Update fields
     update_data = {k: v for k, v in admin_data.dict(exclude_unset=True).items() if v is not None}
-    update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
-    
-    merged_data = {**existing, **prepare_for_mongo(update_data)}
-    
-    # Get installments and recalculate
-    installments = await db.payment_installments.find({"trip_admin_id": admin_id}).to_list(1000)
-    calculated_data = calculate_trip_admin_fields(merged_data, installments)
-    
-    await db.trip_admin.update_one({"id": admin_id}, {"$set": calculated_data})
-    
-    updated_admin = await db.trip_admin.find_one({"id": admin_id})
-    return TripAdmin(**parse_from_mongo(updated_admin))
+    update_data["updated_at"] = datetime.now(timezone.utc)
+    
+    async def update(session):
+        # balance_due below is derived from total_paid, which older practices lack
+        await fill_total_paid(admin_id, session)
+        existing = await db.trip_admin.find_one({"id": admin_id}, session=session)
+        if not existing:
+            raise HTTPException(status_code=404, detail="Trip admin not found")
+        
+        merged_data = {**existing, **prepare_for_mongo(update_data)}
+        
+        # Recalculate; balance_due is derived from total_paid as stored at write time so a
+        # payment posted concurrently is not overwritten
+        agent_id = await trip_agent_id(existing["trip_id"])
+        calculated_data = calculate_trip_admin_fields(merged_data, agent_id=agent_id)
+        for field in ("_id", "total_paid", "balance_due"):
+            calculated_data.pop(field, None)
+        
+        updated_admin = await db.trip_admin.find_one_and_update({"id": admin_id}, [
+            {"$set": {field: {"$literal": value} for field, value in calculated_data.items()}},
+            {"$set": {"balance_due": BALANCE_DUE_EXPR}},
+        ], return_document=ReturnDocument.AFTER, session=session)
+        await apply_rollup_delta(existing, updated_admin, agent_id, session)
+        return updated_admin, agent_id
+    
+    updated_admin, agent_id = await transactions.run(update)
+    await record_write("trip_admin")
+    await notify_deadlines_changed(agent_id)
+    
+    return TripAdmin(**updated_admin)
+
+# Payment balances
+# trip_admin keeps a running total_paid; posting or deleting an installment moves
+# it and balance_due with one $inc instead of re-summing every installment. Both
+# writes, and the practice's rollup bucket, share a transaction when the deployment
+# supports them. Without one, the
+# balance is always moved first: that bumps updated_at, so BalanceReconciler's
+# conditional write loses against an installment write still in flight.
+BALANCE_DUE_EXPR = {"$subtract": [
+    {"$subtract": [{"$ifNull": ["$gross_amount", 0]}, {"$ifNull": ["$confirmation_deposit", 0]}]},
+    {"$ifNull": ["$total_paid", 0]},
+]}
+BALANCE_RECONCILE_INTERVAL_SECONDS = float(os.environ.get('BALANCE_RECONCILE_INTERVAL_SECONDS', '3600'))
+BALANCE_RECONCILE_GRACE_SECONDS = float(os.environ.get('BALANCE_RECONCILE_GRACE_SECONDS', '300'))
+
+class TransactionRunner:
+    """Runs write callbacks in a transaction on replica sets and sharded clusters"""
+    def __init__(self, mode: str = "auto"):
+        self.mode = mode
+        self.available = False
+
+    async def start(self):
+        if self.mode == "off":
+            return
+        try:
+            hello = await client.admin.command("hello")
+        except PyMongoError:
+            hello = {}
+        self.available = "setName" in hello or hello.get("msg") == "isdbgrid"
+        if not self.available:
+            logger.info("MongoDB transactions unavailable (standalone server); payment writes run unwrapped")
+
+    async def run(self, callback: Callable):
+        """await callback(session); session is None when transactions are unavailable"""
+        if not self.available:
+            return await callback(None)
+        async with await client.start_session() as session:
+            return await session.with_transaction(callback)
+
+transactions = TransactionRunner(os.environ.get('MONGO_TRANSACTIONS', 'auto'))
+
+async def fill_total_paid(admin_id: str, session=None):
+    """Seed total_paid from the installments of a practice saved before it was kept.
+
+    Only writes while the field is missing, so of two concurrent callers one sets
+    it and the other's $inc applies on top, whatever the interleaving.
+    """
+    if not await db.trip_admin.find_one({"id": admin_id, "total_paid": {"$exists": False}}, {"_id": 1}, session=session):
+        return
+    paid = await db.payment_installments.aggregate([
+        {"$match": {"trip_admin_id": admin_id}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ], session=session).to_list(1)
+    await db.trip_admin.update_one({"id": admin_id, "total_paid": {"$exists": False}}, [
+        {"$set": {"total_paid": float(paid[0]["total"]) if paid else 0.0}},
+        {"$set": {"balance_due": BALANCE_DUE_EXPR}},
+    ], session=session)
+
+async def move_balance(admin_id: str, amount: float, session=None) -> tuple:
+    """Add amount to a practice's total_paid and its rollup bucket.
+
+    Returns the practice as it was before (None if there is none) and its agent.
+    """
+    await fill_total_paid(admin_id, session)
+    before = await db.trip_admin.find_one_and_update({"id": admin_id}, {
+        "$inc": {"total_paid": amount, "balance_due": -amount},
+        "$set": {"updated_at": mongo_datetime(datetime.now(timezone.utc))},
+    }, session=session)
+    if before is None:
+        return None, None
+    agent_id = await trip_agent_id(before["trip_id"])
+    after = {**before, "balance_due": (before.get("balance_due") or 0) - amount}
+    await apply_rollup_delta(before, after, agent_id, session)
+    return before, agent_id
+
+async def balance_moved(agent_id: Optional[str]) -> None:
+    """Caches and notifications after move_balance"""
+    await record_write("payment_installments", "trip_admin")
+    await notify_deadlines_changed(agent_id)
+
+class BalanceReconciler:
+    """Periodically repairs practices whose total_paid drifted from their installments"""
+    def __init__(self, interval_seconds: float, grace_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.grace_seconds = grace_seconds
+        self.task = None
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        while True:
+            try:
+                await self.reconcile()
+            except NotImplementedError as error:
+                # In-memory databases (mongomock, benchmark --backend fake) lack some operators
+                logger.warning("Balance reconciliation skipped: %s", error)
+            except Exception:
+                logger.exception("Balance reconciliation failed")
+            await asyncio.sleep(self.interval_seconds)
+
+    async def drifted_practices(self) -> List[dict]:
+        """Practices without a total_paid, or whose total_paid no longer matches their installments.
+
+        Practices written within the grace period are skipped: an installment
+        write may still be in flight for them.
+        """
+        cutoff = mongo_datetime(datetime.now(timezone.utc) - timedelta(seconds=self.grace_seconds))
+        return await db.trip_admin.aggregate([
+            {"$match": {"$or": [{"total_paid": {"$exists": False}}, {"updated_at": {"$lt": cutoff}}]}},
+            {"$lookup": {"from": "payment_installments", "localField": "id",
+                         "foreignField": "trip_admin_id", "as": "installments"}},
+            {"$project": {"_id": 0, "id": 1, "trip_id": 1, "total_paid": {"$ifNull": ["$total_paid", None]},
+                          "paid": {"$sum": "$installments.amount"}}},
+            {"$match": {"$or": [
+                {"total_paid": None},
+                {"$expr": {"$gt": [{"$abs": {"$subtract": ["$total_paid", "$paid"]}}, 0.005]}},
+            ]}},
+            {"$project": {"id": 1, "trip_id": 1}},
+        ]).to_list(None)
+
+    async def reconcile(self) -> int:
+        """Recalculate the drifted practices, then rebuild their agents' rollups"""
+        drifted = await self.drifted_practices()
+        if not drifted:
+            return 0
+        fixed = await recalculate_commissions({"id": {"$in": [practice["id"] for practice in drifted]}})
+        if fixed:
+            logger.warning("Reconciled %d practice balance(s)", fixed)
+            await record_write("trip_admin")
+            await rebuild_agent_rollups(await db.trips.distinct(
+                "agent_id", {"id": {"$in": list({practice["trip_id"] for practice in drifted})}}
+            ))
+            await notify_deadlines_changed()
+        return fixed
+
+balance_reconciler = BalanceReconciler(BALANCE_RECONCILE_INTERVAL_SECONDS, BALANCE_RECONCILE_GRACE_SECONDS)
 
 # Payment Installments endpoints
 @api_router.post("/trip-admin/{admin_id}/payments", response_model=PaymentInstallment)
@@ -1050,54 +3080,623 @@ async def create_payment_installment(admin_id: str, payment_data: PaymentInstall
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    payment = PaymentInstallment(**payment_data.dict())
+    payment = PaymentInstallment(**{**payment_data.dict(), "trip_admin_id": admin_id})
     payment_dict = prepare_for_mongo(payment.dict())
     
-    await db.payment_installments.insert_one(payment_dict)
-    
-    # Recalculate trip admin balance
-    installments = await db.payment_installments.find({"trip_admin_id": admin_id}).to_list(1000)
-    trip_admin = await db.trip_admin.find_one({"id": admin_id})
-    if trip_admin:
-        calculated_data = calculate_trip_admin_fields(trip_admin, installments)
-        await db.trip_admin.update_one({"id": admin_id}, {"$set": {"balance_due": calculated_data["balance_due"]}})
+    async def post(session):
+        before, agent_id = await move_balance(admin_id, payment.amount, session)
+        if before is None:
+            raise HTTPException(status_code=404, detail="Trip admin not found")
+        await db.payment_installments.insert_one(payment_dict, session=session)
+        return agent_id
     
+    await balance_moved(await transactions.run(post))
     return payment
 
 @api_router.get("/trip-admin/{admin_id}/payments", response_model=List[PaymentInstallment])
-async def get_payment_installments(admin_id: str, current_user: dict = Depends(get_current_user)):
+async def get_payment_installments(admin_id: str, page: dict = Depends(page_params), current_user: dict = Depends(get_current_user),
+                                   etag: str = Depends(conditional_get("payment_installments"))):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    payments = await db.payment_installments.find({"trip_admin_id": admin_id}).to_list(1000)
-    return [PaymentInstallment(**parse_from_mongo(payment)) for payment in payments]
+    return await list_documents(db.payment_installments, {"trip_admin_id": admin_id}, PaymentInstallment, **page, etag=etag)
 
 @api_router.delete("/payments/{payment_id}")
 async def delete_payment_installment(payment_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Get payment to find admin_id for recalculation
+    # Get payment to find admin_id and amount
     payment = await db.payment_installments.find_one({"id": payment_id})
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found")
     
-    admin_id = payment["trip_admin_id"]
+    amount = payment.get("amount") or 0
     
-    # Delete payment
-    await db.payment_installments.delete_one({"id": payment_id})
+    async def remove(session):
+        before, agent_id = await move_balance(payment["trip_admin_id"], -amount, session)
+        deleted = await db.payment_installments.delete_one({"id": payment_id}, session=session)
+        if not deleted.deleted_count:
+            # Deleted concurrently: the other request already moved the balance
+            if session is None and before is not None:
+                await move_balance(payment["trip_admin_id"], amount)
+            raise HTTPException(status_code=404, detail="Payment not found")
+        return agent_id
     
-    # Recalculate trip admin balance
-    installments = await db.payment_installments.find({"trip_admin_id": admin_id}).to_list(1000)
-    trip_admin = await db.trip_admin.find_one({"id": admin_id})
-    if trip_admin:
-        calculated_data = calculate_trip_admin_fields(trip_admin, installments)
-        await db.trip_admin.update_one({"id": admin_id}, {"$set": {"balance_due": calculated_data["balance_due"]}})
+    await balance_moved(await transactions.run(remove))
     
     return {"message": "Payment deleted successfully"}
 
+# Batch recalculation
+# Re-applies calculate_commissions to many practices at once, e.g. after the
+# commission rates change or after installments were written in bulk.
+RECALCULATION_FIELDS = ["id", "trip_id", "supplier", "gross_amount", "net_amount", "discount",
+                        "confirmation_deposit", "gross_commission", "supplier_commission",
+                        "agent_commission", "total_paid", "balance_due", "updated_at"]
+
+async def recalculate_trip_admins(admins: List[dict]) -> int:
+    """Recompute and store the derived fields of these practices; returns how many changed"""
+    if not admins:
+        return 0
+    admin_ids = [admin["id"] for admin in admins]
+    installments, trips = await asyncio.gather(
+        db.payment_installments.find(
+            {"trip_admin_id": {"$in": admin_ids}}, {"_id": 0, "trip_admin_id": 1, "amount": 1}
+        ).to_list(None),
+        db.trips.find(
+            {"id": {"$in": list({admin["trip_id"] for admin in admins})}}, {"_id": 0, "id": 1, "agent_id": 1}
+        ).to_list(None)
+    )
+    agents = {trip["id"]: trip.get("agent_id") for trip in trips}
+
+    def column(name: str) -> list:
+        return [admin.get(name) or 0 for admin in admins]
+
+    fields = calculate_commissions(
+        admin_ids,
+        column("gross_amount"),
+        column("net_amount"),
+        column("discount"),
+        column("confirmation_deposit"),
+        [installment["trip_admin_id"] for installment in installments],
+        [installment.get("amount") or 0 for installment in installments],
+        agent_ids=[agents.get(admin["trip_id"]) for admin in admins],
+        suppliers=[admin.get("supplier") for admin in admins],
+    )
+    operations = []
+    for position, admin in enumerate(admins):
+        update = {name: float(values[position]) for name, values in fields.items()}
+        if any(admin.get(name) != value for name, value in update.items()):
+            # Skipped if a payment moved the balance since the practice was read
+            operations.append(UpdateOne({"id": admin["id"], "updated_at": admin.get("updated_at")}, {"$set": update}))
+    if not operations:
+        return 0
+    result = await db.trip_admin.bulk_write(operations, ordered=False)
+    return result.modified_count
+
+async def recalculate_commissions(query: Optional[dict] = None, batch_size: int = 2000) -> int:
+    """Recalculate every matching practice, batch_size at a time"""
+    projection = {field: 1 for field in RECALCULATION_FIELDS}
+    updated = 0
+    cursor = None
+    while True:
+        admins, cursor = await fetch_page(db.trip_admin, query or {}, cursor, batch_size, projection)
+        updated += await recalculate_trip_admins(admins)
+        if not cursor:
+            return updated
+
+# Spreadsheet import
+# Back-office CSV/XLSX files are read chunk by chunk (pandas for CSV, openpyxl in
+# read-only mode for XLSX), so memory stays bounded by IMPORT_CHUNK_SIZE rows.
+# Each chunk is parsed and validated with vectorized pandas operations, its
+# derived amounts computed column-wise, and written with one bulk_write.
+# Practices are upserted by practice_number; installments get a deterministic id
+# so importing the same file twice does not duplicate them.
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '5000'))
+IMPORT_MAX_BYTES = int(os.environ.get('IMPORT_MAX_BYTES', str(200 * 1024 * 1024)))
+IMPORT_MAX_REPORTED_REJECTIONS = 1000
+IMPORT_INSTALLMENT_NAMESPACE = uuid.UUID("8a1f7c52-3b0e-4d7e-9a43-1f6c2b9d5e10")
+
+IMPORT_COLUMNS = {
+    # kind: (required, optional)
+    "practices": (
+        ["trip_id", "practice_number", "booking_number", "gross_amount", "net_amount",
+         "practice_confirm_date", "client_departure_date"],
+        ["supplier", "discount", "confirmation_deposit", "status"],
+    ),
+    "installments": (
+        ["practice_number", "amount", "payment_date"],
+        ["payment_type", "notes"],
+    ),
+}
+IMPORT_AMOUNT_COLUMNS = {"gross_amount", "net_amount", "discount", "confirmation_deposit", "amount"}
+IMPORT_DATE_COLUMNS = {"practice_confirm_date", "client_departure_date", "payment_date"}
+
+ImportKind = Literal["practices", "installments"]
+
+def import_column_name(header) -> str:
+    return re.sub(r"[^a-z0-9]+", "_", str(header or "").strip().lower()).strip("_")
+
+def read_spreadsheet_chunks(path: Path, extension: str, chunk_size: int):
+    """Yield DataFrames of at most chunk_size rows; cells are strings, index is the file row number"""
+    import pandas as pd
+
+    first_row = 2  # Row 1 is the header
+    if extension == "xlsx":
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = [import_column_name(value) for value in next(rows, ())]
+            batch = []
+            for row in rows:
+                cells = ["" if value is None else value.isoformat() if isinstance(value, datetime) else str(value)
+                         for value in row[:len(header)]]
+                batch.append(cells + [""] * (len(header) - len(cells)))
+                if len(batch) == chunk_size:
+                    yield pd.DataFrame(batch, columns=header, index=range(first_row, first_row + len(batch)))
+                    first_row += len(batch)
+                    batch = []
+            if batch:
+                yield pd.DataFrame(batch, columns=header, index=range(first_row, first_row + len(batch)))
+        finally:
+            workbook.close()
+        return
+
+    # Italian exports are usually semicolon-separated
+    with open(path, encoding="utf-8-sig", errors="replace") as handle:
+        header_line = handle.readline()
+    separator = ";" if header_line.count(";") > header_line.count(",") else ","
+    for chunk in pd.read_csv(path, sep=separator, dtype=str, keep_default_na=False,
+                             chunksize=chunk_size, encoding="utf-8-sig"):
+        chunk.columns = [import_column_name(column) for column in chunk.columns]
+        chunk.index = range(first_row, first_row + len(chunk))
+        first_row += len(chunk)
+        yield chunk
+
+def parse_amounts(text):
+    """Numbers as 1234.5 or Italian 1.234,50; unparsable cells become NaN"""
+    import pandas as pd
+
+    text = text.str.strip().str.replace(r"[€\s]", "", regex=True)
+    italian = text.str.contains(",", regex=False)
+    text = text.where(~italian, text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False))
+    return pd.to_numeric(text, errors="coerce")
+
+def parse_dates(text):
+    """ISO dates, or day-first dates like 01/11/2026; unparsable cells become NaT (UTC)"""
+    import pandas as pd
+
+    text = text.str.strip()
+    iso = text.str.match(r"^\d{4}-")
+    parsed = pd.Series(pd.NaT, index=text.index, dtype="datetime64[us, UTC]")
+    if iso.any():
+        parsed[iso] = pd.to_datetime(text[iso], utc=True, errors="coerce", format="ISO8601")
+    if (~iso).any():
+        parsed[~iso] = pd.to_datetime(text[~iso], utc=True, errors="coerce", dayfirst=True, format="mixed")
+    return parsed
+
+def parse_import_chunk(frame, kind: str):
+    """Typed columns for the valid rows, and {row number: [errors]} for the rejected ones"""
+    import pandas as pd
+
+    required, optional = IMPORT_COLUMNS[kind]
+    columns = {}
+    errors = pd.Series([[] for _ in range(len(frame))], index=frame.index, dtype=object)
+
+    def reject(mask, message: str):
+        for row in mask[mask].index:
+            errors[row].append(message)
+
+    for name in required + optional:
+        text = frame[name] if name in frame else pd.Series("", index=frame.index)
+        empty = text.str.strip() == ""
+        if name in required:
+            reject(empty, f"{name} is required")
+        if name in IMPORT_AMOUNT_COLUMNS:
+            values = parse_amounts(text)
+            reject(values.isna() & ~empty, f"{name} is not a number")
+            columns[name] = values.fillna(0.0).astype(float)
+        elif name in IMPORT_DATE_COLUMNS:
+            values = parse_dates(text)
+            reject(values.isna() & ~empty, f"{name} is not a date")
+            columns[name] = values
+        else:
+            columns[name] = text.str.strip()
+
+    parsed = pd.DataFrame(columns, index=frame.index)
+    valid = errors.map(len) == 0
+    rejected = {row: messages for row, messages in errors[~valid].items()}
+    return parsed[valid], rejected
+
+def frame_datetimes(series) -> list:
+    return [mongo_datetime(value) for value in series.dt.to_pydatetime()]
+
+async def import_practices_chunk(parsed, rejected: dict) -> dict:
+    """Upsert one chunk of practices by practice_number"""
+    # Later rows win when a file repeats a practice
+    parsed = parsed.drop_duplicates("practice_number", keep="last")
+
+    trip_agents = {trip["id"]: trip.get("agent_id") for trip in await db.trips.find(
+        {"id": {"$in": parsed["trip_id"].unique().tolist()}}, {"_id": 0, "id": 1, "agent_id": 1}
+    ).to_list(None)}
+    unknown = ~parsed["trip_id"].isin(trip_agents.keys())
+    for row in parsed.index[unknown]:
+        rejected[row] = [f"trip {parsed.at[row, 'trip_id']} does not exist"]
+    parsed = parsed[~unknown]
+    if parsed.empty:
+        return {"inserted": 0, "updated": 0, "agent_ids": set()}
+
+    # Installments already recorded against existing practices still count as paid
+    paid_rows = await db.trip_admin.aggregate([
+        {"$match": {"practice_number": {"$in": parsed["practice_number"].tolist()}}},
+        {"$lookup": {"from": "payment_installments", "localField": "id",
+                     "foreignField": "trip_admin_id", "as": "installments"}},
+        {"$project": {"_id": 0, "practice_number": 1, "trip_id": 1, "paid": {"$sum": "$installments.amount"}}},
+    ]).to_list(None)
+    # A practice moved to another agent's trip changes that agent's rollups too
+    agent_ids = {trip_agents[trip_id] for trip_id in parsed["trip_id"]}
+    moved_from = {row.get("trip_id") for row in paid_rows} - trip_agents.keys()
+    if moved_from:
+        agent_ids.update(await db.trips.distinct("agent_id", {"id": {"$in": list(moved_from)}}))
+    calculated = calculate_commissions(
+        parsed["practice_number"].to_numpy(dtype=object),
+        parsed["gross_amount"].to_numpy(),
+        parsed["net_amount"].to_numpy(),
+        parsed["discount"].to_numpy(),
+        parsed["confirmation_deposit"].to_numpy(),
+        [row["practice_number"] for row in paid_rows],
+        [row["paid"] for row in paid_rows],
+        agent_ids=parsed["trip_id"].map(trip_agents).to_numpy(dtype=object),
+        suppliers=parsed["supplier"].to_numpy(dtype=object),
+    )
+    fields = {
+        "trip_id": parsed["trip_id"].tolist(),
+        "booking_number": parsed["booking_number"].tolist(),
+        "supplier": [supplier or None for supplier in parsed["supplier"]],
+        "gross_amount": parsed["gross_amount"].tolist(),
+        "net_amount": parsed["net_amount"].tolist(),
+        "discount": parsed["discount"].tolist(),
+        "confirmation_deposit": parsed["confirmation_deposit"].tolist(),
+        **{name: values.tolist() for name, values in calculated.items()},
+        "practice_confirm_date": frame_datetimes(parsed["practice_confirm_date"]),
+        "client_departure_date": frame_datetimes(parsed["client_departure_date"]),
+    }
+    now = mongo_datetime(datetime.now(timezone.utc))
+    operations = []
+    for position, (practice_number, status_value) in enumerate(zip(parsed["practice_number"], parsed["status"])):
+        update = {name: values[position] for name, values in fields.items()}
+        update["updated_at"] = now
+        on_insert = {"id": str(uuid.uuid4()), "practice_number": practice_number, "created_at": now}
+        if status_value:
+            update["status"] = status_value
+        else:
+            on_insert["status"] = "draft"
+        operations.append(UpdateOne(
+            {"practice_number": practice_number}, {"$set": update, "$setOnInsert": on_insert}, upsert=True
+        ))
+    result = await db.trip_admin.bulk_write(operations, ordered=False)
+    return {"inserted": result.upserted_count, "updated": result.matched_count, "agent_ids": agent_ids}
+
+async def import_installments_chunk(parsed, rejected: dict) -> dict:
+    """Upsert one chunk of installments and refresh their practices' balance_due"""
+    practices = await db.trip_admin.find(
+        {"practice_number": {"$in": parsed["practice_number"].unique().tolist()}},
+        {"_id": 0, "id": 1, "practice_number": 1, "trip_id": 1}
+    ).to_list(None)
+    admins = {admin["practice_number"]: admin["id"] for admin in practices}
+    admin_ids = parsed["practice_number"].map(admins)
+    unknown = admin_ids.isna()
+    for row in parsed.index[unknown]:
+        rejected[row] = [f"practice {parsed.at[row, 'practice_number']} does not exist"]
+    parsed, admin_ids = parsed[~unknown], admin_ids[~unknown]
+    if parsed.empty:
+        return {"inserted": 0, "updated": 0, "agent_ids": set()}
+
+    payment_types = parsed["payment_type"].where(parsed["payment_type"] != "", "installment")
+    now = mongo_datetime(datetime.now(timezone.utc))
+    operations = []
+    for admin_id, amount, payment_date, payment_type, notes in zip(
+        admin_ids, parsed["amount"], parsed["payment_date"].dt.to_pydatetime(), payment_types, parsed["notes"]
+    ):
+        # Same practice, date, amount, type and notes: the same installment imported again
+        installment_id = str(uuid.uuid5(
+            IMPORT_INSTALLMENT_NAMESPACE, f"{admin_id}|{payment_date.isoformat()}|{amount!r}|{payment_type}|{notes}"
+        ))
+        operations.append(UpdateOne({"id": installment_id}, {"$setOnInsert": {
+            "id": installment_id,
+            "trip_admin_id": admin_id,
+            "amount": amount,
+            "payment_date": mongo_datetime(payment_date),
+            "payment_type": payment_type,
+            "notes": notes,
+            "created_at": now,
+        }}, upsert=True))
+    result = await db.payment_installments.bulk_write(operations, ordered=False)
+
+    await recalculate_commissions({"id": {"$in": admin_ids.unique().tolist()}})
+    imported = set(admin_ids)
+    trip_ids = list({admin["trip_id"] for admin in practices if admin["id"] in imported})
+    return {
+        "inserted": result.upserted_count,
+        "updated": len(operations) - result.upserted_count,
+        "agent_ids": set(await db.trips.distinct("agent_id", {"id": {"$in": trip_ids}})),
+    }
+
+async def import_spreadsheet(path: Path, kind: str, extension: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> dict:
+    """Import a practices or installments file, then rebuild the touched agents' rollups"""
+    started = time.perf_counter()
+    required, _ = IMPORT_COLUMNS[kind]
+    import_chunk = import_practices_chunk if kind == "practices" else import_installments_chunk
+    chunks = read_spreadsheet_chunks(path, extension, chunk_size)
+    report = {"kind": kind, "rows": 0, "inserted": 0, "updated": 0, "rejected": 0, "rejections": []}
+    agent_ids = set()
+
+    try:
+        while True:
+            # Parsing is CPU-bound: keep it off the event loop
+            frame = await asyncio.to_thread(next, chunks, None)
+            if frame is None:
+                break
+            missing = [name for name in required if name not in frame.columns]
+            if missing:
+                raise HTTPException(status_code=400, detail=f"Missing columns: {', '.join(missing)}")
+            parsed, rejected = await asyncio.to_thread(parse_import_chunk, frame, kind)
+            counts = await import_chunk(parsed, rejected)
+            agent_ids |= counts["agent_ids"]
+
+            report["rows"] += len(frame)
+            report["inserted"] += counts["inserted"]
+            report["updated"] += counts["updated"]
+            report["rejected"] += len(rejected)
+            room = IMPORT_MAX_REPORTED_REJECTIONS - len(report["rejections"])
+            report["rejections"] += [{"row": row, "errors": errors} for row, errors in sorted(rejected.items())[:room]]
+            logger.info("Imported %d %s row(s) so far", report["rows"], kind)
+    finally:
+        chunks.close()
+
+    await record_write("trip_admin", "payment_installments")
+    await rebuild_agent_rollups(agent_ids)
+    await notify_deadlines_changed()
+    seconds = time.perf_counter() - started
+    report["seconds"] = round(seconds, 3)
+    report["rows_per_second"] = round(report["rows"] / seconds, 1) if seconds else 0.0
+    return report
+
+def import_extension(filename: Optional[str]) -> str:
+    extension = Path(filename or "").suffix.lower().lstrip(".")
+    if extension not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Upload a .csv or .xlsx file")
+    return extension
+
+@api_router.post("/imports/{kind}")
+async def import_file(kind: ImportKind, file: UploadFile = File(...), current_user: dict = Depends(get_current_user)):
+    """Import practices or installments from a CSV/XLSX export (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    extension = import_extension(file.filename)
+    spooled = await spool_upload(file, Path(tempfile.gettempdir()), IMPORT_MAX_BYTES)
+    try:
+        return await import_spreadsheet(spooled.path, kind, extension)
+    finally:
+        os.unlink(spooled.path)
+
+# Financial aggregation
+# Response key -> trip_admin field. Every total has a confirmed-only twin.
+FINANCIAL_TOTALS = {
+    "total_revenue": "gross_amount",
+    "total_net_amount": "net_amount",
+    "total_discounts": "discount",
+    "total_gross_commission": "gross_commission",
+    "total_supplier_commission": "supplier_commission",
+    "total_agent_commission": "agent_commission",
+}
+CONFIRMED_TOTALS = {name: "confirmed_" + name[len("total_"):] for name in FINANCIAL_TOTALS}
+IS_CONFIRMED_EXPR = {"$eq": ["$status", "confirmed"]}
+
+def as_date_expr(field: str) -> dict:
+    """Stored dates as BSON dates; unparseable values become null"""
+    return {"$convert": {"input": field, "to": "date", "onError": None, "onNull": None}}
+
+def financial_group(group_id, bookings=1) -> dict:
+    """A $group stage summing every financial field, overall and for confirmed bookings.
+
+    Over trip_admin each document is one booking; over financial_rollups pass
+    bookings="$bookings" so pre-summed buckets are weighted correctly.
+    """
+    group = {
+        "_id": group_id,
+        "total_bookings": {"$sum": bookings},
+        "confirmed_bookings": {"$sum": {"$cond": [IS_CONFIRMED_EXPR, bookings, 0]}},
+    }
+    for name, field in FINANCIAL_TOTALS.items():
+        amount = {"$ifNull": [f"${field}", 0]}
+        group[name] = {"$sum": amount}
+        group[CONFIRMED_TOTALS[name]] = {"$sum": {"$cond": [IS_CONFIRMED_EXPR, amount, 0]}}
+    return {"$group": group}
+
+def empty_financial_totals() -> dict:
+    totals = {"total_bookings": 0, "confirmed_bookings": 0}
+    for name in FINANCIAL_TOTALS:
+        totals[name] = 0
+        totals[CONFIRMED_TOTALS[name]] = 0
+    return totals
+
+async def financial_totals(match: dict) -> dict:
+    """All totals and confirmed-only totals for the matching trip_admin records"""
+    results = await db.trip_admin.aggregate([{"$match": match}, financial_group(None)]).to_list(1)
+    if not results:
+        return empty_financial_totals()
+    totals = results[0]
+    del totals["_id"]
+    return totals
+
+async def rollup_totals(match: dict) -> dict:
+    """Same as financial_totals, read from the pre-aggregated rollup buckets"""
+    pipeline = [{"$match": match}, financial_group(None, bookings="$bookings")]
+    results = await db.financial_rollups.aggregate(pipeline).to_list(1)
+    if not results:
+        return empty_financial_totals()
+    totals = results[0]
+    del totals["_id"]
+    return totals
+
+async def financial_breakdown(match: dict) -> dict:
+    """Totals plus per-agent, per-year and per-month group-bys over the rollup buckets"""
+    def group(group_id):
+        return financial_group(group_id, bookings="$bookings")
+
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            "totals": [group(None)],
+            "by_agent": [group("$agent_id"), {"$sort": {"_id": 1}}],
+            "by_year": [group("$year"), {"$sort": {"_id": 1}}],
+            "by_month": [group({"year": "$year", "month": "$month"}), {"$sort": {"_id.year": 1, "_id.month": 1}}],
+        }},
+    ]
+    facets = (await db.financial_rollups.aggregate(pipeline).to_list(1))[0]
+
+    def rows(key: str, name: str) -> List[dict]:
+        return [{name: row.pop("_id"), **row} for row in facets[key]]
+
+    totals = facets["totals"][0] if facets["totals"] else empty_financial_totals()
+    totals.pop("_id", None)
+    return {
+        "totals": totals,
+        "by_agent": rows("by_agent", "agent_id"),
+        "by_year": rows("by_year", "year"),
+        "by_month": [{**row.pop("_id"), **row} for row in facets["by_month"]],
+    }
+
+# Financial rollups
+# One document per (agent_id, year, month, status) bucket holding summed amounts.
+# Trip admin and payment writes apply deltas in the same transaction as the practice.
+# BalanceReconciler rebuilds the buckets of agents whose practices it repaired;
+# `manage.py rebuild-rollups --if-drifted` compares every bucket with trip_admin.
+ROLLUP_FIELDS = list(FINANCIAL_TOTALS.values()) + ["balance_due"]
+
+def rollup_key(trip_admin: dict, agent_id: Optional[str]) -> dict:
+    confirm_date = stored_datetime(trip_admin.get("practice_confirm_date"))
+    return {
+        "agent_id": agent_id,
+        "year": confirm_date.year if confirm_date else None,
+        "month": confirm_date.month if confirm_date else None,
+        "status": trip_admin.get("status", "draft")
+    }
+
+def rollup_amounts(trip_admin: dict, sign: int = 1) -> dict:
+    amounts = {"bookings": sign}
+    for field in ROLLUP_FIELDS:
+        amounts[field] = sign * (trip_admin.get(field) or 0)
+    return amounts
+
+async def apply_rollup_delta(old: Optional[dict], new: Optional[dict], agent_id: Optional[str], session=None):
+    """Move a trip_admin record's contribution from its old bucket to its new one"""
+    deltas = []
+    if old is not None:
+        deltas.append((rollup_key(old, agent_id), rollup_amounts(old, -1)))
+    if new is not None:
+        new_key = rollup_key(new, agent_id)
+        new_amounts = rollup_amounts(new)
+        if deltas and deltas[0][0] == new_key:
+            # Same bucket: a single $inc with the difference
+            old_amounts = deltas[0][1]
+            new_amounts = {field: new_amounts[field] + old_amounts[field] for field in new_amounts}
+            deltas = []
+        deltas.append((new_key, new_amounts))
+
+    for key, amounts in deltas:
+        increments = {field: value for field, value in amounts.items() if value}
+        if increments:
+            await db.financial_rollups.update_one(key, {"$inc": increments}, upsert=True, session=session)
+        if amounts["bookings"] < 0:
+            # Drop buckets that no longer hold any booking
+            await db.financial_rollups.delete_one({**key, "bookings": {"$lte": 0}}, session=session)
+
+async def trip_agent_id(trip_id: str) -> Optional[str]:
+    trip = await db.trips.find_one({"id": trip_id}, {"_id": 0, "agent_id": 1})
+    return trip["agent_id"] if trip else None
+
+def rollup_pipeline() -> List[dict]:
+    """Aggregation over trip_admin producing every rollup bucket"""
+    confirm_date = as_date_expr("$practice_confirm_date")
+    group = {
+        "_id": {
+            "agent_id": {"$first": "$trip.agent_id"},
+            "year": {"$year": confirm_date},
+            "month": {"$month": confirm_date},
+            "status": {"$ifNull": ["$status", "draft"]}
+        },
+        "bookings": {"$sum": 1},
+    }
+    for field in ROLLUP_FIELDS:
+        group[field] = {"$sum": {"$ifNull": [f"${field}", 0]}}
+
+    return [
+        {"$lookup": {"from": "trips", "localField": "trip_id", "foreignField": "id", "as": "trip"}},
+        {"$group": group},
+        # Flatten the bucket key into top-level fields
+        {"$replaceWith": {"$mergeObjects": ["$$ROOT", "$_id"]}},
+        {"$unset": "_id"},
+    ]
+
+async def rebuild_financial_rollups():
+    """Recompute every rollup bucket from trip_admin and replace the collection"""
+    await db.trip_admin.aggregate(rollup_pipeline() + [{"$out": "financial_rollups"}]).to_list(None)
+    await record_write("financial_rollups")
+
+async def rebuild_agent_rollups(agent_ids):
+    """Recompute only these agents' rollup buckets, e.g. after an import touched their practices"""
+    # Practices without an agent are left to BalanceReconciler's drift check
+    agent_ids = [agent_id for agent_id in agent_ids if agent_id is not None]
+    if not agent_ids:
+        return
+    trip_ids = await db.trips.distinct("id", {"agent_id": {"$in": agent_ids}})
+    buckets = await db.trip_admin.aggregate(
+        [{"$match": {"trip_id": {"$in": trip_ids}}}] + rollup_pipeline()
+    ).to_list(None)
+
+    async def replace(session):
+        await db.financial_rollups.delete_many({"agent_id": {"$in": agent_ids}}, session=session)
+        if buckets:
+            await db.financial_rollups.insert_many(buckets, session=session)
+
+    await transactions.run(replace)
+    await record_write("financial_rollups")
+
+async def financial_rollups_drifted() -> bool:
+    """Whether the stored buckets differ from a fresh aggregation of trip_admin"""
+    expected, stored = await asyncio.gather(
+        db.trip_admin.aggregate(rollup_pipeline()).to_list(None),
+        db.financial_rollups.find({"bookings": {"$gt": 0}}, {"_id": 0}).to_list(None)
+    )
+
+    def buckets(documents: List[dict]) -> dict:
+        return {
+            tuple(document.get(name) for name in ("agent_id", "year", "month", "status")):
+                tuple(round(document.get(field) or 0, 2) for field in ["bookings"] + ROLLUP_FIELDS)
+            for document in documents
+        }
+
+    return buckets(expected) != buckets(stored)
+
+def year_range(year: int) -> dict:
+    start_date = datetime(year, 1, 1, tzinfo=timezone.utc)
+    end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
+    return {"$gte": mongo_datetime(start_date), "$lt": mongo_datetime(end_date)}
+
 # Financial Analytics endpoints
-@api_router.get("/analytics/agent-commissions")
+# Collections the analytics responses are computed from (for conditional GETs)
+FINANCIAL_COLLECTIONS = ("trips", "users", "trip_admin", "payment_installments", "financial_rollups")
+
+# /analytics/agent-commissions lists at most this many practices, as it always has;
+# GET /analytics/export streams every one of them
+COMMISSION_MAX_ROWS = 1000
+
+@api_router.get("/analytics/agent-commissions", dependencies=[Depends(conditional_get(*FINANCIAL_COLLECTIONS))])
 async def get_agent_commission_analytics(
     year: int = None, 
     agent_id: str = None,
@@ -1114,78 +3713,261 @@ async def get_agent_commission_analytics(
     query = {}
     if agent_id:
         # Get trips for this agent
-        agent_trips = await db.trips.find({"agent_id": agent_id}).to_list(1000)
-        trip_ids = [trip["id"] for trip in agent_trips]
+        trip_ids = await db.trips.distinct("id", {"agent_id": agent_id})
         query["trip_id"] = {"$in": trip_ids}
     
     if year:
-        start_date = datetime(year, 1, 1, tzinfo=timezone.utc)
-        end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-        query["practice_confirm_date"] = {
-            "$gte": start_date.isoformat(),
-            "$lt": end_date.isoformat()
-        }
+        query["practice_confirm_date"] = year_range(year)
     
     # Get confirmed trip admin records
     query["status"] = "confirmed"
     
-    confirmed_trips = await db.trip_admin.find(query).to_list(1000)
-    
-    # Parse MongoDB data to remove ObjectIds
-    parsed_trips = [parse_from_mongo(trip) for trip in confirmed_trips]
-    
-    # Calculate totals
-    total_revenue = sum(trip.get("gross_amount", 0) for trip in confirmed_trips)
-    total_gross_commission = sum(trip.get("gross_commission", 0) for trip in confirmed_trips)
-    total_supplier_commission = sum(trip.get("supplier_commission", 0) for trip in confirmed_trips)
-    total_agent_commission = sum(trip.get("agent_commission", 0) for trip in confirmed_trips)
+    # Totals and rows from one pass over the same practices, so they always agree
+    results = await db.trip_admin.aggregate([
+        {"$match": query},
+        {"$facet": {
+            "totals": [financial_group(None)],
+            "trips": [{"$limit": COMMISSION_MAX_ROWS}, {"$project": {"_id": 0}}],
+        }},
+    ]).to_list(1)
+    facets = results[0] if results else {"totals": [], "trips": []}
+    totals = facets["totals"][0] if facets["totals"] else empty_financial_totals()
     
     return {
         "year": year or "all_time",
         "agent_id": agent_id,
-        "total_confirmed_trips": len(confirmed_trips),
-        "total_revenue": total_revenue,
-        "total_gross_commission": total_gross_commission,
-        "total_supplier_commission": total_supplier_commission,
-        "total_agent_commission": total_agent_commission,
-        "trips": parsed_trips
+        "total_confirmed_trips": totals["total_bookings"],
+        "total_revenue": totals["total_revenue"],
+        "total_gross_commission": totals["total_gross_commission"],
+        "total_supplier_commission": totals["total_supplier_commission"],
+        "total_agent_commission": totals["total_agent_commission"],
+        "trips": facets["trips"]
     }
 
-@api_router.get("/analytics/yearly-summary/{year}")
+@api_router.get("/analytics/yearly-summary/{year}", dependencies=[Depends(conditional_get(*FINANCIAL_COLLECTIONS))])
 async def get_yearly_summary(year: int, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    start_date = datetime(year, 1, 1, tzinfo=timezone.utc)
-    end_date = datetime(year + 1, 1, 1, tzinfo=timezone.utc)
-    
-    query = {
-        "status": "confirmed",
-        "practice_confirm_date": {
-            "$gte": start_date.isoformat(),
-            "$lt": end_date.isoformat()
-        }
-    }
+    query = {"status": "confirmed", "year": year}
     
     # If agent, filter by their trips only
     if current_user["role"] == "agent":
-        agent_trips = await db.trips.find({"agent_id": current_user["id"]}).to_list(1000)
-        trip_ids = [trip["id"] for trip in agent_trips]
-        query["trip_id"] = {"$in": trip_ids}
+        query["agent_id"] = current_user["id"]
     
-    confirmed_trips = await db.trip_admin.find(query).to_list(1000)
+    totals = await rollup_totals(query)
     
     return {
         "year": year,
-        "total_confirmed_trips": len(confirmed_trips),
-        "total_revenue": sum(trip.get("gross_amount", 0) for trip in confirmed_trips),
-        "total_gross_commission": sum(trip.get("gross_commission", 0) for trip in confirmed_trips),
-        "total_supplier_commission": sum(trip.get("supplier_commission", 0) for trip in confirmed_trips),
-        "total_agent_commission": sum(trip.get("agent_commission", 0) for trip in confirmed_trips)
+        "total_confirmed_trips": totals["total_bookings"],
+        "total_revenue": totals["total_revenue"],
+        "total_gross_commission": totals["total_gross_commission"],
+        "total_supplier_commission": totals["total_supplier_commission"],
+        "total_agent_commission": totals["total_agent_commission"]
     }
 
+@api_router.get("/analytics/breakdown", dependencies=[Depends(conditional_get(*FINANCIAL_COLLECTIONS))])
+async def get_financial_breakdown(
+    year: int = None,
+    agent_id: str = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Financial totals grouped by agent, year and month"""
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # If agent, can only see own data
+    if current_user["role"] == "agent":
+        agent_id = current_user["id"]
+    
+    query = {}
+    if agent_id:
+        query["agent_id"] = agent_id
+    if year:
+        query["year"] = year
+    
+    return {"year": year or "all_time", "agent_id": agent_id, **await financial_breakdown(query)}
+
+# Financial export
+# Rows come from an aggregation cursor over trip_admin (joined to the trip and
+# its agent) and are written out one batch at a time: CSV is streamed straight
+# to the client, XLSX (openpyxl write-only) and Parquet (pyarrow) are
+# written batch by batch to a temp file that is sent and then deleted.
+EXPORT_BATCH_SIZE = 2000
+EXPORT_COLUMNS = [
+    # (column, kind)
+    ("practice_number", "text"),
+    ("booking_number", "text"),
+    ("supplier", "text"),
+    ("status", "text"),
+    ("trip_id", "text"),
+    ("trip_title", "text"),
+    ("trip_destination", "text"),
+    ("agent_id", "text"),
+    ("agent_name", "text"),
+    ("practice_confirm_date", "date"),
+    ("client_departure_date", "date"),
+    ("gross_amount", "amount"),
+    ("net_amount", "amount"),
+    ("discount", "amount"),
+    ("gross_commission", "amount"),
+    ("supplier_commission", "amount"),
+    ("agent_commission", "amount"),
+    ("confirmation_deposit", "amount"),
+    ("balance_due", "amount"),
+]
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+ExportFormat = Literal["csv", "xlsx", "parquet"]
+
+def export_pipeline(query: dict) -> List[dict]:
+    projection = {"_id": 0, **{column: 1 for column, _ in EXPORT_COLUMNS}}
+    projection.update({
+        "trip_title": "$trip.title",
+        "trip_destination": "$trip.destination",
+        "agent_id": "$trip.agent_id",
+        "agent_name": {"$concat": [
+            {"$ifNull": ["$agent.first_name", ""]}, " ", {"$ifNull": ["$agent.last_name", ""]}
+        ]},
+    })
+    return [
+        {"$match": query},
+        # Stable row order, so two exports of the same data can be diffed
+        {"$sort": {"practice_confirm_date": 1, "_id": 1}},
+        {"$lookup": {"from": "trips", "localField": "trip_id", "foreignField": "id", "as": "trip"}},
+        {"$unwind": {"path": "$trip", "preserveNullAndEmptyArrays": True}},
+        {"$lookup": {"from": "users", "localField": "trip.agent_id", "foreignField": "id", "as": "agent"}},
+        {"$unwind": {"path": "$agent", "preserveNullAndEmptyArrays": True}},
+        {"$project": projection},
+    ]
+
+def export_row(document: dict) -> list:
+    row = []
+    for column, kind in EXPORT_COLUMNS:
+        value = document.get(column)
+        if kind == "date":
+            value = stored_datetime(value)
+        elif kind == "amount":
+            value = float(value or 0)
+        else:
+            value = str(value).strip() if value is not None else ""
+        row.append(value)
+    return row
+
+async def export_batches(query: dict):
+    """Yield lists of at most EXPORT_BATCH_SIZE export rows"""
+    batch = []
+    cursor = db.trip_admin.aggregate(export_pipeline(query), batchSize=EXPORT_BATCH_SIZE, allowDiskUse=True)
+    async for document in cursor:
+        batch.append(export_row(document))
+        if len(batch) == EXPORT_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def stream_export_csv(query: dict):
+    # The BOM makes Excel read the file as UTF-8
+    yield "\ufeff" + ",".join(column for column, _ in EXPORT_COLUMNS) + "\r\n"
+    async for batch in export_batches(query):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerows([[value.isoformat() if isinstance(value, datetime) else value for value in row]
+                          for row in batch])
+        yield buffer.getvalue()
+
+class XlsxExportWriter:
+    """openpyxl in write-only mode keeps memory flat however many rows are appended"""
+    def __init__(self, path: Path):
+        from openpyxl import Workbook
+
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = self.workbook.create_sheet("Pratiche")
+        self.sheet.append([column for column, _ in EXPORT_COLUMNS])
+
+    def write(self, batch: List[list]):
+        for row in batch:
+            # Excel has no time zones: write UTC wall-clock times
+            self.sheet.append([value.replace(tzinfo=None) if isinstance(value, datetime) else value
+                               for value in row])
+
+    def close(self):
+        self.workbook.save(self.path)
+
+class ParquetExportWriter:
+    """Every batch becomes one Parquet row group"""
+    def __init__(self, path: Path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        types = {"text": pa.string(), "date": pa.timestamp("us", tz="UTC"), "amount": pa.float64()}
+        self.pa = pa
+        self.schema = pa.schema([(column, types[kind]) for column, kind in EXPORT_COLUMNS])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, batch: List[list]):
+        columns = [list(values) for values in zip(*batch)]
+        self.writer.write_table(self.pa.Table.from_arrays(columns, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+async def write_export_file(query: dict, export_format: str) -> Path:
+    """Write an XLSX or Parquet export to a temp file and return its path"""
+    handle, temp_name = tempfile.mkstemp(prefix=".export-", suffix=f".{export_format}")
+    os.close(handle)
+    path = Path(temp_name)
+    try:
+        writer_class = XlsxExportWriter if export_format == "xlsx" else ParquetExportWriter
+        writer = await asyncio.to_thread(writer_class, path)
+        async for batch in export_batches(query):
+            await asyncio.to_thread(writer.write, batch)
+        await asyncio.to_thread(writer.close)
+    except BaseException:
+        path.unlink(missing_ok=True)
+        raise
+    return path
+
+@api_router.get("/analytics/export")
+async def export_financials(
+    format: ExportFormat = "csv",
+    year: Optional[int] = None,
+    agent_id: Optional[str] = None,
+    practice_status: Optional[str] = Query(None, alias="status"),
+    current_user: dict = Depends(get_current_user)
+):
+    """Every practice with its commission columns, as CSV, XLSX or Parquet"""
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    # If agent, can only export own data
+    if current_user["role"] == "agent":
+        agent_id = current_user["id"]
+    
+    query = {}
+    if agent_id:
+        query["trip_id"] = {"$in": await db.trips.distinct("id", {"agent_id": agent_id})}
+    if year:
+        query["practice_confirm_date"] = year_range(year)
+    if practice_status:
+        query["status"] = practice_status
+    
+    filename = f"pratiche-{year or 'tutte'}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+    if format == "csv":
+        return StreamingResponse(stream_export_csv(query), media_type=EXPORT_MEDIA_TYPES["csv"], headers=headers)
+    
+    path = await write_export_file(query, format)
+    return FileResponse(path, media_type=EXPORT_MEDIA_TYPES[format], headers=headers,
+                        background=BackgroundTask(path.unlink, missing_ok=True))
+
 # Client financial summary endpoint
-@api_router.get("/clients/{client_id}/financial-summary")
+@api_router.get("/clients/{client_id}/financial-summary", dependencies=[Depends(conditional_get(*FINANCIAL_COLLECTIONS))])
 async def get_client_financial_summary(client_id: str, current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
@@ -1193,43 +3975,29 @@ async def get_client_financial_summary(client_id: str, current_user: dict = Depe
     # If agent, verify they can access this client's data
     if current_user["role"] == "agent":
         # Get client's trips created by this agent
-        agent_trips = await db.trips.find({"client_id": client_id, "agent_id": current_user["id"]}).to_list(1000)
-        if not agent_trips:
+        agent_trip = await db.trips.find_one({"client_id": client_id, "agent_id": current_user["id"]}, {"_id": 1})
+        if not agent_trip:
             raise HTTPException(status_code=403, detail="Not authorized to access this client's data")
     
     # Get all trips for this client
-    client_trips = await db.trips.find({"client_id": client_id}).to_list(1000)
-    trip_ids = [trip["id"] for trip in client_trips]
-    
-    # Get all trip admin data for client's trips
-    trip_admin_data = await db.trip_admin.find({"trip_id": {"$in": trip_ids}}).to_list(1000)
-    
-    # Parse MongoDB data to remove ObjectIds
-    parsed_admin_data = [parse_from_mongo(admin) for admin in trip_admin_data]
-    
-    # Calculate totals
-    total_bookings = len(trip_admin_data)
-    total_revenue = sum(admin.get("gross_amount", 0) for admin in trip_admin_data)
-    total_net_amount = sum(admin.get("net_amount", 0) for admin in trip_admin_data)
-    total_discounts = sum(admin.get("discount", 0) for admin in trip_admin_data)
-    total_gross_commission = sum(admin.get("gross_commission", 0) for admin in trip_admin_data)
-    total_supplier_commission = sum(admin.get("supplier_commission", 0) for admin in trip_admin_data)
-    total_agent_commission = sum(admin.get("agent_commission", 0) for admin in trip_admin_data)
-    
-    # Get confirmed bookings only (status = "confirmed")
-    confirmed_bookings = [admin for admin in trip_admin_data if admin.get("status") == "confirmed"]
-    confirmed_revenue = sum(admin.get("gross_amount", 0) for admin in confirmed_bookings)
-    confirmed_net_amount = sum(admin.get("net_amount", 0) for admin in confirmed_bookings)
-    confirmed_discounts = sum(admin.get("discount", 0) for admin in confirmed_bookings)
-    confirmed_gross_commission = sum(admin.get("gross_commission", 0) for admin in confirmed_bookings)
-    confirmed_supplier_commission = sum(admin.get("supplier_commission", 0) for admin in confirmed_bookings)
-    confirmed_agent_commission = sum(admin.get("agent_commission", 0) for admin in confirmed_bookings)
+    client_trips = await db.trips.find(
+        {"client_id": client_id}, {"_id": 0, "id": 1, "title": 1, "destination": 1}
+    ).to_list(None)
+    trips_by_id = {trip["id"]: trip for trip in client_trips}
+    query = {"trip_id": {"$in": list(trips_by_id)}}
+    
+    # Totals and confirmed-only totals in one pass, alongside the booking rows
+    totals, trip_admin_data = await asyncio.gather(
+        financial_totals(query),
+        db.trip_admin.find(query, {"_id": 0}).to_list(None)
+    )
     
     # Calculate confirmed booking details with trip info
     confirmed_booking_details = []
-    for admin in confirmed_bookings:
-        # Find corresponding trip
-        trip = next((t for t in client_trips if t["id"] == admin["trip_id"]), None)
+    for admin in trip_admin_data:
+        if admin.get("status") != "confirmed":
+            continue
+        trip = trips_by_id.get(admin["trip_id"])
         if trip:
             confirmed_booking_details.append({
                 "trip_id": admin["trip_id"],
@@ -1249,169 +4017,691 @@ async def get_client_financial_summary(client_id: str, current_user: dict = Depe
     
     return {
         "client_id": client_id,
-        "total_bookings": total_bookings,
-        "confirmed_bookings": len(confirmed_bookings),
-        "total_revenue": total_revenue,
-        "confirmed_revenue": confirmed_revenue,
-        "total_net_amount": total_net_amount,
-        "total_discounts": total_discounts,
-        "total_gross_commission": total_gross_commission,
-        "total_supplier_commission": total_supplier_commission,
-        "total_agent_commission": total_agent_commission,
+        "total_bookings": totals["total_bookings"],
+        "confirmed_bookings": totals["confirmed_bookings"],
+        "total_revenue": totals["total_revenue"],
+        "total_net_amount": totals["total_net_amount"],
+        "total_discounts": totals["total_discounts"],
+        "total_gross_commission": totals["total_gross_commission"],
+        "total_supplier_commission": totals["total_supplier_commission"],
+        "total_agent_commission": totals["total_agent_commission"],
         # Confirmed bookings specific data
-        "confirmed_revenue": confirmed_revenue,
-        "confirmed_net_amount": confirmed_net_amount, 
-        "confirmed_discounts": confirmed_discounts,
-        "confirmed_gross_commission": confirmed_gross_commission,
-        "confirmed_supplier_commission": confirmed_supplier_commission,
-        "confirmed_agent_commission": confirmed_agent_commission,
+        "confirmed_revenue": totals["confirmed_revenue"],
+        "confirmed_net_amount": totals["confirmed_net_amount"],
+        "confirmed_discounts": totals["confirmed_discounts"],
+        "confirmed_gross_commission": totals["confirmed_gross_commission"],
+        "confirmed_supplier_commission": totals["confirmed_supplier_commission"],
+        "confirmed_agent_commission": totals["confirmed_agent_commission"],
         "confirmed_booking_details": confirmed_booking_details,
-        "bookings": parsed_admin_data
+        "bookings": trip_admin_data
     }
 
 # Notifications endpoint for payment deadlines
+DAY_MS = 24 * 60 * 60 * 1000
+
+def days_until_expr(date_expr, today: datetime) -> dict:
+    """Whole days from today, floored like timedelta.days"""
+    return {"$toInt": {"$floor": {"$divide": [{"$subtract": [date_expr, today]}, DAY_MS]}}}
+
+PRIORITY_RANK_EXPR = {"$switch": {
+    "branches": [
+        {"case": {"$lte": ["$days_until_due", 7]}, "then": 0},
+        {"case": {"$lte": ["$days_until_due", 14]}, "then": 1}
+    ],
+    "default": 2
+}}
+PRIORITY_NAMES = ["high", "medium", "low"]
+
+def deadline_stages(trip_field: str, agent_id: Optional[str], date_field: str, today: datetime) -> List[dict]:
+    """Join trip and client onto a deadline source and compute days_until_due and priority"""
+    stages = [
+        {"$lookup": {"from": "trips", "localField": trip_field, "foreignField": "id", "as": "trip"}},
+        {"$unwind": "$trip"},
+    ]
+    if agent_id:
+        stages.append({"$match": {"trip.agent_id": agent_id}})
+    stages += [
+        {"$lookup": {"from": "users", "localField": "trip.client_id", "foreignField": "id", "as": "client"}},
+        {"$unwind": "$client"},
+        {"$addFields": {"due_date": as_date_expr(date_field)}},
+        # Skip records whose date can't be parsed
+        {"$match": {"due_date": {"$ne": None}}},
+        {"$addFields": {
+            "days_until_due": days_until_expr("$due_date", today),
+            "client_name": {"$concat": ["$client.first_name", " ", "$client.last_name"]}
+        }},
+        {"$addFields": {"priority_rank": PRIORITY_RANK_EXPR}},
+        {"$addFields": {"priority": {"$arrayElemAt": [PRIORITY_NAMES, "$priority_rank"]}}},
+    ]
+    return stages
+
+def payment_deadlines_pipeline(today: datetime, until: datetime, agent_id: Optional[str] = None) -> List[dict]:
+    """One pipeline over installments, unioned with balances due before departure"""
+    installments = [
+        {"$match": {"payment_date": {"$gte": mongo_datetime(today), "$lte": mongo_datetime(until)}}},
+        {"$lookup": {"from": "trip_admin", "localField": "trip_admin_id", "foreignField": "id", "as": "trip_admin"}},
+        {"$unwind": "$trip_admin"},
+        *deadline_stages("trip_admin.trip_id", agent_id, "$payment_date", today),
+        {"$project": {
+            "_id": 1,
+            "source_rank": {"$literal": 0},
+            "id": 1,
+            "type": {"$literal": "payment_deadline"},
+            "title": {"$concat": ["Pagamento ", {"$ifNull": ["$payment_type", ""]}, " in scadenza"]},
+            "message": {"$concat": ["Cliente ", "$client_name", " - ", "$trip.title"]},
+            "amount": 1,
+            "payment_date": 1,
+            "days_until_due": 1,
+            "priority": 1,
+            "priority_rank": 1,
+            "client_name": 1,
+            "trip_title": "$trip.title",
+            "trip_id": "$trip.id",
+            "payment_type": 1
+        }},
+    ]
+    balances = [
+        {"$match": {
+            "client_departure_date": {"$gte": mongo_datetime(today), "$lte": mongo_datetime(until)},
+            "balance_due": {"$gt": 0}
+        }},
+        *deadline_stages("trip_id", agent_id, "$client_departure_date", today),
+        {"$project": {
+            "_id": 1,
+            "source_rank": {"$literal": 1},
+            "id": {"$concat": ["balance_", "$id"]},
+            "type": {"$literal": "balance_due"},
+            "title": {"$literal": "Saldo da versare entro partenza"},
+            "message": {"$concat": ["Cliente ", "$client_name", " - ", "$trip.title"]},
+            "amount": "$balance_due",
+            "payment_date": "$client_departure_date",
+            "days_until_due": 1,
+            "priority": 1,
+            "priority_rank": 1,
+            "client_name": 1,
+            "trip_title": "$trip.title",
+            "trip_id": "$trip.id",
+            "payment_type": {"$literal": "balance"}
+        }},
+    ]
+    return [
+        *installments,
+        {"$unionWith": {"coll": "trip_admin", "pipeline": balances}},
+        # Sort by priority and days until due; installments before balances on ties
+        {"$sort": {"priority_rank": 1, "days_until_due": 1, "source_rank": 1, "_id": 1}},
+        {"$unset": ["_id", "source_rank", "priority_rank"]},
+    ]
+
+NOTIFICATION_WINDOW_DAYS = 30
+
+async def load_payment_deadlines(agent_id: Optional[str] = None) -> List[dict]:
+    """Deadlines in the notification window, for one agent's trips or for all"""
+    today = datetime.now(timezone.utc)
+    until = today + timedelta(days=NOTIFICATION_WINDOW_DAYS)
+    pipeline = payment_deadlines_pipeline(today, until, agent_id)
+    return await db.payment_installments.aggregate(pipeline).to_list(None)
+
+def deadline_counts(notifications) -> dict:
+    priority_counts = {priority: 0 for priority in PRIORITY_NAMES}
+    for notification in notifications:
+        priority_counts[notification["priority"]] += 1
+    
+    return {
+        "total_count": len(notifications),
+        "high_priority_count": priority_counts["high"],
+        "medium_priority_count": priority_counts["medium"],
+        "low_priority_count": priority_counts["low"]
+    }
+
+# No conditional GET: days_until_due, priority and the 30-day window move with the
+# clock, so a response can go stale without any write
 @api_router.get("/notifications/payment-deadlines")
 async def get_payment_deadlines(current_user: dict = Depends(get_current_user)):
     if current_user["role"] not in ["admin", "agent"]:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Get upcoming payment deadlines (next 30 days)
-    from datetime import datetime, timedelta, timezone
-    today = datetime.now(timezone.utc)
-    thirty_days = today + timedelta(days=30)
-    
-    # Find payment installments due in next 30 days
-    query = {
-        "payment_date": {
-            "$gte": today.isoformat(),
-            "$lte": thirty_days.isoformat()
-        }
-    }
-    
     # If agent, filter to their trips only
-    if current_user["role"] == "agent":
-        # Get agent's trip admin IDs
-        agent_trips = await db.trips.find({"agent_id": current_user["id"]}).to_list(1000)
-        trip_ids = [trip["id"] for trip in agent_trips]
-        agent_trip_admins = await db.trip_admin.find({"trip_id": {"$in": trip_ids}}).to_list(1000)
-        admin_ids = [admin["id"] for admin in agent_trip_admins]
-        query["trip_admin_id"] = {"$in": admin_ids}
-    
-    upcoming_payments = await db.payment_installments.find(query).to_list(1000)
-    
-    # Get related trip and client information
-    notifications = []
-    for payment in upcoming_payments:
-        # Get trip admin data
-        trip_admin = await db.trip_admin.find_one({"id": payment["trip_admin_id"]})
-        if not trip_admin:
-            continue
-            
-        # Get trip data
-        trip = await db.trips.find_one({"id": trip_admin["trip_id"]})
-        if not trip:
-            continue
-            
-        # Get client data
-        client = await db.users.find_one({"id": trip["client_id"]})
-        if not client:
-            continue
-        
-        # Calculate days until due
-        try:
-            payment_date_str = payment["payment_date"]
-            if isinstance(payment_date_str, str):
-                payment_date = datetime.fromisoformat(payment_date_str.replace('Z', '+00:00'))
-            else:
-                # Handle datetime object
-                payment_date = payment_date_str
-                if payment_date.tzinfo is None:
-                    payment_date = payment_date.replace(tzinfo=timezone.utc)
-            days_until_due = (payment_date - today).days
-        except Exception as e:
-            # Skip this payment if date parsing fails
-            print(f"Date parsing error for payment {payment.get('id', 'unknown')}: {e}")
-            continue
+    agent_id = current_user["id"] if current_user["role"] == "agent" else None
+    notifications = await load_payment_deadlines(agent_id)
+    
+    return {"notifications": notifications, **deadline_counts(notifications)}
+
+# Notification stream
+# GET /notifications/stream pushes the same notifications over Server-Sent Events:
+# a "snapshot" on connect, then "delta" events (upserted items, removed ids, new
+# counts). Connections are grouped by scope (an agent id, or None for admins), so
+# each change costs one pipeline run per active scope, not one per connection.
+# Writes publish "deadlines_changed" through the broadcaster, which reaches every
+# worker. Date-driven changes (days_until_due ticking over, an item moving from
+# medium to high) are scheduled from the due dates already loaded.
+def sse_event(event: str, payload: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + to_json(payload) + b"\n\n"
+
+class NotificationScope:
+    def __init__(self, notifications: List[dict], refresh_at: datetime):
+        self.notifications: Dict[str, dict] = {notification["id"]: notification for notification in notifications}
+        self.refresh_at = refresh_at
+        self.subscribers: set = set()
+
+    def snapshot(self) -> bytes:
+        notifications = list(self.notifications.values())
+        return sse_event("snapshot", {"notifications": notifications, "counts": deadline_counts(notifications)})
+
+class NotificationHub:
+    """Per-worker fan-out of payment deadline deltas to SSE subscribers"""
+    def __init__(self, resync_seconds: float, debounce_seconds: float, queue_size: int):
+        self.resync_seconds = resync_seconds
+        self.debounce_seconds = debounce_seconds
+        self.queue_size = queue_size
+        self.scopes: Dict[Optional[str], NotificationScope] = {}
+        self.dirty: set = set()
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def next_refresh(self, notifications, now: datetime) -> datetime:
+        """When the earliest loaded item's days_until_due changes, capped by the resync interval"""
+        refresh_at = now + timedelta(seconds=self.resync_seconds)
+        for notification in notifications:
+            due = stored_datetime(notification["payment_date"])
+            if due:
+                # floor((due - now) / 1 day) drops once now passes due - days_until_due days
+                changes_at = due - timedelta(days=notification["days_until_due"]) + timedelta(seconds=1)
+                refresh_at = min(refresh_at, max(changes_at, now))
+        return refresh_at
+
+    async def load_scope(self, agent_id: Optional[str]) -> NotificationScope:
+        notifications = await load_payment_deadlines(agent_id)
+        return NotificationScope(notifications, self.next_refresh(notifications, datetime.now(timezone.utc)))
+
+    async def subscribe(self, agent_id: Optional[str]) -> asyncio.Queue:
+        scope = self.scopes.get(agent_id)
+        if scope is None:
+            loaded = await self.load_scope(agent_id)
+            scope = self.scopes.setdefault(agent_id, loaded)
+            self.wakeup.set()  # Its refresh_at may be the earliest
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        queue.put_nowait(scope.snapshot())
+        scope.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, agent_id: Optional[str], queue: asyncio.Queue):
+        scope = self.scopes.get(agent_id)
+        if scope:
+            scope.subscribers.discard(queue)
+            if not scope.subscribers:
+                del self.scopes[agent_id]
+
+    def mark_changed(self, agent_id: Optional[str]):
+        """Broadcaster handler: the admin scope always changes, plus the agent's (or all if unknown)"""
+        self.dirty.add(None)
+        if agent_id:
+            self.dirty.add(agent_id)
+        else:
+            self.dirty.update(self.scopes)
+        self.wakeup.set()
+
+    async def refresh(self, agent_id: Optional[str]):
+        scope = self.scopes.get(agent_id)
+        if scope is None:
+            return
+        # Retry in a minute if loading fails, rather than in a tight loop
+        scope.refresh_at = datetime.now(timezone.utc) + timedelta(seconds=60)
+        fresh = await self.load_scope(agent_id)
+        upserted = [notification for notification_id, notification in fresh.notifications.items()
+                    if scope.notifications.get(notification_id) != notification]
+        removed = [notification_id for notification_id in scope.notifications if notification_id not in fresh.notifications]
+        scope.notifications, scope.refresh_at = fresh.notifications, fresh.refresh_at
+        if not upserted and not removed:
+            return
         
-        notifications.append({
-            "id": payment["id"],
-            "type": "payment_deadline",
-            "title": f"Pagamento {payment['payment_type']} in scadenza",
-            "message": f"Cliente {client['first_name']} {client['last_name']} - {trip['title']}",
-            "amount": payment["amount"],
-            "payment_date": payment["payment_date"],
-            "days_until_due": days_until_due,
-            "priority": "high" if days_until_due <= 7 else "medium" if days_until_due <= 14 else "low",
-            "client_name": f"{client['first_name']} {client['last_name']}",
-            "trip_title": trip["title"],
-            "trip_id": trip["id"],
-            "payment_type": payment["payment_type"]
+        delta = sse_event("delta", {
+            "upserted": upserted,
+            "removed": removed,
+            "counts": deadline_counts(scope.notifications.values())
         })
+        for queue in scope.subscribers:
+            try:
+                queue.put_nowait(delta)
+            except asyncio.QueueFull:
+                # Too far behind for deltas to be useful: replace its backlog with a snapshot
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(scope.snapshot())
+
+    async def run(self):
+        while True:
+            now = datetime.now(timezone.utc)
+            next_refresh = min((scope.refresh_at for scope in self.scopes.values()), default=None)
+            timeout = max(0.0, (next_refresh - now).total_seconds()) if next_refresh else None
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout)
+                await asyncio.sleep(self.debounce_seconds)  # Coalesce bursts of writes
+            except asyncio.TimeoutError:
+                pass
+            self.wakeup.clear()
+            
+            now = datetime.now(timezone.utc)
+            due = {agent_id for agent_id, scope in self.scopes.items()
+                   if agent_id in self.dirty or scope.refresh_at <= now}
+            self.dirty.clear()
+            for agent_id in due:
+                try:
+                    await self.refresh(agent_id)
+                except Exception:
+                    logger.exception("Refreshing payment deadline notifications failed")
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+notification_hub = NotificationHub(
+    resync_seconds=float(os.environ.get('NOTIFICATION_RESYNC_SECONDS', '900')),
+    debounce_seconds=float(os.environ.get('NOTIFICATION_DEBOUNCE_SECONDS', '0.5')),
+    queue_size=int(os.environ.get('NOTIFICATION_QUEUE_SIZE', '64'))
+)
+broadcaster.subscribe("deadlines_changed", notification_hub.mark_changed)
+
+async def notify_deadlines_changed(agent_id: Optional[str] = None):
+    await broadcaster.publish("deadlines_changed", agent_id)
+
+SSE_HEARTBEAT_SECONDS = 20
+# EventSource cannot send headers, so the stream authenticates with a ticket in
+# the query string. Tickets expire quickly and are useless anywhere else, so one
+# leaked through a URL log does not expose the login token.
+STREAM_TICKET_SCOPE = "notifications_stream"
+STREAM_TICKET_SECONDS = int(os.environ.get('STREAM_TICKET_SECONDS', '60'))
+
+@api_router.post("/notifications/stream-ticket")
+async def create_stream_ticket(current_user: dict = Depends(get_current_user)):
+    """A short-lived ticket for opening /notifications/stream"""
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Also check for balance due dates from trip admin
-    trip_admin_query = {
-        "client_departure_date": {
-            "$gte": today.isoformat(),
-            "$lte": thirty_days.isoformat()
-        },
-        "balance_due": {"$gt": 0}
-    }
-    
-    if current_user["role"] == "agent":
-        trip_admin_query["trip_id"] = {"$in": trip_ids}
+    ticket = jwt.encode({
+        "user_id": current_user["id"],
+        "scope": STREAM_TICKET_SCOPE,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=STREAM_TICKET_SECONDS)
+    }, JWT_SECRET, algorithm=JWT_ALGORITHM)
+    return {"ticket": ticket, "expires_in": STREAM_TICKET_SECONDS}
+
+@api_router.get("/notifications/stream")
+async def stream_notifications(ticket: str = Query(..., description="From POST /notifications/stream-ticket")):
+    """Payment deadline notifications as Server-Sent Events"""
+    current_user = await user_from_token(ticket, scope=STREAM_TICKET_SCOPE)
+    if current_user["role"] not in ["admin", "agent"]:
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    balance_due_trips = await db.trip_admin.find(trip_admin_query).to_list(1000)
+    agent_id = current_user["id"] if current_user["role"] == "agent" else None
+    queue = await notification_hub.subscribe(agent_id)
     
-    for admin in balance_due_trips:
-        trip = await db.trips.find_one({"id": admin["trip_id"]})
-        client = await db.users.find_one({"id": trip["client_id"]}) if trip else None
-        
-        if trip and client:
+    async def events():
+        try:
+            while True:
+                try:
+                    yield await asyncio.wait_for(queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+        finally:
+            notification_hub.unsubscribe(agent_id, queue)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Profiling
+# An opt-in sampling profiler for finding where a slow route spends its time.
+# A request is profiled when PROFILE_SAMPLE_PERCENT picks it, or, with
+# PROFILE_SLOW_MS set, every request is profiled and only the slow ones are kept.
+# Every PROFILE_INTERVAL_MS a sampler thread records one stack per profiled
+# request. A request running on the event loop contributes the frames below
+# ProfilerMiddleware. A suspended request contributes the chain of coroutines it
+# is awaiting, ending in "[await]". Together these give wall-clock time, database
+# waits included. Stacks are stored folded (flamegraph.pl / speedscope input)
+# with the route, the caller's role and the request's query log. Each profile is
+# a JSON file in PROFILE_DIR, and the oldest files are deleted once the
+# directory exceeds PROFILE_MAX_BYTES. Settings are per worker process.
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(Path(tempfile.gettempdir()) / 'travel_agency_profiles')))
+PROFILE_MAX_BYTES = int(os.environ.get('PROFILE_MAX_BYTES', str(50 * 1024 * 1024)))
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', '5'))
+PROFILE_STACK_DEPTH = 128
+
+class RequestProfile:
+    def __init__(self, reason: str):
+        self.id = str(uuid.uuid4())
+        self.reason = reason
+        self.created_at = datetime.now(timezone.utc)
+        self.role: Optional[str] = None
+        # The middleware's frame (on the thread stack while the request runs) and
+        # the coroutine it awaits (walked while the request is suspended)
+        self.frame = None
+        self.coro = None
+        self.stacks: Dict[str, int] = defaultdict(int)
+        self.samples = 0
+
+current_profile: contextvars.ContextVar[Optional[RequestProfile]] = contextvars.ContextVar("current_profile", default=None)
+
+class ProfileStore:
+    """Profiles as JSON files named by creation time; the oldest go first past max_bytes"""
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def write(self, profile: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        name = f"{profile['created_at'].strftime('%Y%m%dT%H%M%S%f')}_{profile['id']}.json"
+        # Not *.json until complete, so list() and trim() never see a partial file
+        temporary = self.directory / f"{name}.tmp"
+        temporary.write_bytes(to_json(profile))
+        temporary.replace(self.directory / name)
+        self.trim()
+
+    def trim(self):
+        files = sorted(self.directory.glob("*.json"))
+        sizes = [path.stat().st_size for path in files]
+        total = sum(sizes)
+        for path, size in zip(files, sizes):
+            if total <= self.max_bytes:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
+
+    def list(self, limit: int) -> List[dict]:
+        """Newest first, without stacks and queries"""
+        if not self.directory.exists():
+            return []
+        summaries = []
+        for path in sorted(self.directory.glob("*.json"), reverse=True)[:limit]:
             try:
-                departure_date_str = admin["client_departure_date"]
-                if isinstance(departure_date_str, str):
-                    departure_date = datetime.fromisoformat(departure_date_str.replace('Z', '+00:00'))
-                else:
-                    # Handle datetime object
-                    departure_date = departure_date_str
-                    if departure_date.tzinfo is None:
-                        departure_date = departure_date.replace(tzinfo=timezone.utc)
-                days_until_departure = (departure_date - today).days
-            except Exception as e:
-                # Skip this admin record if date parsing fails
-                print(f"Date parsing error for admin {admin.get('id', 'unknown')}: {e}")
+                profile = json.loads(path.read_bytes())
+            except (OSError, ValueError):
+                continue  # Trimmed by another worker meanwhile
+            summaries.append({key: value for key, value in profile.items() if key not in ("stacks", "queries")})
+        return summaries
+
+    def get(self, profile_id: str) -> Optional[dict]:
+        if not re.fullmatch(r"[0-9a-f-]{36}", profile_id):
+            return None
+        for path in self.directory.glob(f"*_{profile_id}.json"):
+            try:
+                return json.loads(path.read_bytes())
+            except (OSError, ValueError):
+                return None
+        return None
+
+def awaited_frames(awaitable) -> list:
+    """Frames of a suspended coroutine and of everything it awaits, outermost first"""
+    frames = []
+    while awaitable is not None and len(frames) < PROFILE_STACK_DEPTH:
+        if isinstance(awaitable, asyncio.Task):
+            awaitable = awaitable.get_coro()
+            continue
+        if hasattr(awaitable, "cr_frame"):
+            frame, awaitable = awaitable.cr_frame, awaitable.cr_await
+        elif hasattr(awaitable, "ag_frame"):
+            frame, awaitable = awaitable.ag_frame, awaitable.ag_await
+        elif hasattr(awaitable, "gi_frame"):
+            frame, awaitable = awaitable.gi_frame, awaitable.gi_yieldfrom
+        else:
+            break  # A Future: the wait itself
+        if frame is None:
+            break
+        frames.append(frame)
+    return frames
+
+class SamplingProfiler:
+    """Samples the event loop thread while profiled requests are in flight"""
+    def __init__(self, store: ProfileStore, interval_ms: float, sample_percent: float, slow_ms: float):
+        self.store = store
+        self.interval_ms = interval_ms
+        self.sample_percent = sample_percent
+        self.slow_ms = slow_ms
+        self.active: Dict[str, RequestProfile] = {}
+        self.labels: Dict[Any, str] = {}
+        self.wake = threading.Event()
+        # Held for a whole sample, so once end() returns no sample still writes to the profile
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.loop_thread_id: Optional[int] = None
+
+    def settings(self) -> dict:
+        return {"sample_percent": self.sample_percent, "slow_ms": self.slow_ms, "interval_ms": self.interval_ms}
+
+    def choose(self) -> Optional[str]:
+        """Why the next request should be profiled, or None"""
+        if self.sample_percent and random.random() * 100 < self.sample_percent:
+            return "sampled"
+        if self.slow_ms:
+            return "slow"
+        return None
+
+    def begin(self, profile: RequestProfile):
+        if self.thread is None:
+            self.loop_thread_id = threading.get_ident()
+            self.thread = threading.Thread(target=self.run, name="profiler", daemon=True)
+            self.thread.start()
+        self.active[profile.id] = profile
+        self.wake.set()
+
+    def end(self, profile: RequestProfile):
+        with self.lock:
+            self.active.pop(profile.id, None)
+
+    def run(self):
+        while True:
+            # Cleared before checking, so a begin() in between is not missed
+            self.wake.clear()
+            if not self.active:
+                self.wake.wait()
                 continue
-            
-            notifications.append({
-                "id": f"balance_{admin['id']}",
-                "type": "balance_due",
-                "title": f"Saldo da versare entro partenza",
-                "message": f"Cliente {client['first_name']} {client['last_name']} - {trip['title']}",
-                "amount": admin["balance_due"],
-                "payment_date": admin["client_departure_date"],
-                "days_until_due": days_until_departure,
-                "priority": "high" if days_until_departure <= 7 else "medium" if days_until_departure <= 14 else "low",
-                "client_name": f"{client['first_name']} {client['last_name']}",
-                "trip_title": trip["title"],
-                "trip_id": trip["id"],
-                "payment_type": "balance"
-            })
+            time.sleep(self.interval_ms / 1000)
+            try:
+                with self.lock:
+                    self.sample()
+            except Exception:
+                logger.exception("Profiler sample failed")
+
+    def sample(self):
+        frame = sys._current_frames().get(self.loop_thread_id)
+        thread_stack = []  # innermost first
+        while frame is not None and len(thread_stack) < PROFILE_STACK_DEPTH * 2:
+            thread_stack.append(frame)
+            frame = frame.f_back
+        for profile in list(self.active.values()):
+            try:
+                index = thread_stack.index(profile.frame)
+                frames, suffix = reversed(thread_stack[:index]), []
+            except ValueError:
+                frames, suffix = awaited_frames(profile.coro), ["[await]"]
+            stack = ";".join([*map(self.label, frames), *suffix])
+            profile.stacks[stack] += 1
+            profile.samples += 1
+
+    def label(self, frame) -> str:
+        code = frame.f_code
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+profiler = SamplingProfiler(
+    ProfileStore(PROFILE_DIR, PROFILE_MAX_BYTES),
+    interval_ms=PROFILE_INTERVAL_MS,
+    sample_percent=float(os.environ.get('PROFILE_SAMPLE_PERCENT', '0')),
+    slow_ms=float(os.environ.get('PROFILE_SLOW_MS', '0')),
+)
+
+class ProfilerMiddleware:
+    """Added before every other middleware, so it runs in the endpoint's task"""
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        reason = profiler.choose() if scope["type"] == "http" else None
+        if reason is None:
+            return await self.app(scope, receive, send)
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        profile = RequestProfile(reason)
+        profile.frame = sys._getframe()
+        profile.coro = self.app(scope, receive, send_status)
+        token = current_profile.set(profile)
+        started = time.perf_counter()
+        profiler.begin(profile)
+        try:
+            with track_queries() as queries:
+                await profile.coro
+        finally:
+            profiler.end(profile)
+            current_profile.reset(token)
+        duration_ms = (time.perf_counter() - started) * 1000
+        if reason == "slow" and duration_ms < profiler.slow_ms:
+            return
+        route = scope.get("route")
+        await asyncio.get_running_loop().run_in_executor(None, profiler.store.write, {
+            "id": profile.id,
+            "created_at": profile.created_at,
+            "reason": reason,
+            "method": scope["method"],
+            "route": route.path if route else "unmatched",
+            "path": scope["path"],
+            "status": status_code,
+            "role": profile.role,
+            "duration_ms": round(duration_ms, 2),
+            "interval_ms": profiler.interval_ms,
+            "samples": profile.samples,
+            "db_operations": queries.operations,
+            "db_ms": round(queries.seconds * 1000, 2),
+            "stacks": profile.stacks,
+            "queries": queries.log,
+        })
+
+app.add_middleware(ProfilerMiddleware)
+
+class ProfilerSettings(BaseModel):
+    sample_percent: float = Field(ge=0, le=100)
+    slow_ms: float = Field(ge=0)
+
+@api_router.get("/profiles")
+async def list_profiles(limit: int = Query(50, ge=1, le=500), current_user: dict = Depends(get_current_user)):
+    """Stored profiles, newest first (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    # Sort by priority and days until due
-    priority_order = {"high": 0, "medium": 1, "low": 2}
-    notifications.sort(key=lambda x: (priority_order[x["priority"]], x["days_until_due"]))
+    return {"settings": profiler.settings(),
+            "profiles": await asyncio.get_running_loop().run_in_executor(None, profiler.store.list, limit)}
+
+@api_router.put("/profiles/settings")
+async def update_profiler_settings(settings: ProfilerSettings, current_user: dict = Depends(get_current_user)):
+    """Change what this worker profiles, until it restarts (admin only)"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
     
-    return {
-        "notifications": notifications,
-        "total_count": len(notifications),
-        "high_priority_count": len([n for n in notifications if n["priority"] == "high"]),
-        "medium_priority_count": len([n for n in notifications if n["priority"] == "medium"]),
-        "low_priority_count": len([n for n in notifications if n["priority"] == "low"])
-    }
+    profiler.sample_percent = settings.sample_percent
+    profiler.slow_ms = settings.slow_ms
+    return profiler.settings()
+
+@api_router.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: Literal["json", "folded"] = "json",
+                      current_user: dict = Depends(get_current_user)):
+    """One profile; format=folded returns the stacks alone, one "frame;frame count" per line"""
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    profile = await asyncio.get_running_loop().run_in_executor(None, profiler.store.get, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "folded":
+        return Response("".join(f"{stack} {count}\n" for stack, count in profile["stacks"].items()),
+                        media_type="text/plain")
+    return profile
+
+# Database query totals per route, from QueryMonitor (admin only)
+@api_router.get("/debug/queries")
+async def get_query_stats(current_user: dict = Depends(get_current_user)):
+    if current_user["role"] != "admin":
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    return {"repeat_threshold": QUERY_REPEAT_THRESHOLD, "routes": query_monitor.stats()}
 
 # Include router
 app.include_router(api_router)
 
+@app.middleware("http")
+async def account_queries(request: Request, call_next):
+    # Counts cover the endpoint; a streamed body's later queries are not included
+    with track_queries() as stats:
+        response = await call_next(request)
+    route = request.scope.get("route")
+    query_monitor.observe(f"{request.method} {route.path if route else 'unmatched'}", stats)
+    if QUERY_DEBUG_HEADERS:
+        response.headers.update(stats.headers())
+    return response
+
+# Request body limit
+# Bodies are counted as the server receives them, so a chunked upload without a
+# Content-Length is cut off at the limit too; a declared length over the limit
+# is refused before anything is read. Imports may be up to IMPORT_MAX_BYTES,
+# every other request MAX_UPLOAD_BYTES, plus room for the multipart framing.
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+def request_body_limit(path: str) -> int:
+    limit = IMPORT_MAX_BYTES if path.startswith("/api/imports/") else MAX_UPLOAD_BYTES
+    return limit + MULTIPART_OVERHEAD_BYTES
+
+class BodySizeLimitMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        too_large = JSONResponse(status_code=413, content={"detail": "File too large"})
+        limit = request_body_limit(scope["path"])
+        content_length = Headers(scope=scope).get("content-length")
+        if content_length and content_length.isdigit() and int(content_length) > limit:
+            return await too_large(scope, receive, send)
+        received = 0
+        refused = False
+        response_started = False
+
+        async def receive_limited():
+            # Past the limit the app sees a disconnect, and whatever it answers is replaced by the 413
+            nonlocal received, refused
+            if refused:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                refused = received > limit
+                if refused:
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def send_unless_refused(message):
+            nonlocal response_started
+            if refused and not response_started:
+                return
+            response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, receive_limited, send_unless_refused)
+        except Exception:
+            if not refused or response_started:
+                raise
+        if refused and not response_started:
+            await too_large(scope, receive, send)
+
+app.add_middleware(BodySizeLimitMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -1419,8 +4709,197 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "X-DB-Operations", "X-DB-Documents", "X-DB-Time-Ms", "X-DB-Repeated-Queries"],
 )
 
+# Request metrics
+# A plain ASGI middleware, added last so it wraps every other one. Per request it
+# costs two clock reads and a few dict updates; routes are labelled with their
+# template (/api/trips/{trip_id}), unmatched paths with "unmatched". Streamed
+# responses are timed and sized up to their last chunk.
+HTTP_REQUESTS = metrics.add(Counter("http_requests_total", "Requests by route and status code", ("method", "route", "status")))
+HTTP_DURATION = metrics.add(Histogram(
+    "http_request_duration_seconds", "Time until the last response byte", ("method", "route"), LATENCY_BUCKETS
+))
+HTTP_RESPONSE_SIZE = metrics.add(Histogram(
+    "http_response_size_bytes", "Response body size", ("method", "route"), SIZE_BUCKETS
+))
+HTTP_IN_FLIGHT = metrics.add(Gauge("http_requests_in_flight", "Requests being served"))
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status_code = 500
+        size = 0
+
+        async def send_counted(message):
+            nonlocal status_code, size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_counted)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route else "unmatched")
+            HTTP_DURATION.observe(time.perf_counter() - started, *labels)
+            HTTP_RESPONSE_SIZE.observe(size, *labels)
+            HTTP_REQUESTS.inc(*labels, status_code)
+
+app.add_middleware(MetricsMiddleware)
+
+# Event loop lag: how late a periodic wake-up runs, i.e. how long the loop was
+# blocked by synchronous work
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.environ.get('EVENT_LOOP_LAG_INTERVAL_SECONDS', '0.5'))
+
+class EventLoopMonitor:
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self.task = None
+        self.lag = metrics.add(Histogram(
+            "event_loop_lag_seconds", "Delay of a timer scheduled every EVENT_LOOP_LAG_INTERVAL_SECONDS",
+            buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+        ))
+        self.last_lag = metrics.add(Gauge("event_loop_lag_last_seconds", "Most recent event loop lag"))
+
+    def start(self):
+        if self.interval_seconds > 0:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval_seconds
+            await asyncio.sleep(self.interval_seconds)
+            lag = max(0.0, loop.time() - expected)
+            self.lag.observe(lag)
+            self.last_lag.set(lag)
+
+event_loop_monitor = EventLoopMonitor(EVENT_LOOP_LAG_INTERVAL_SECONDS)
+
+# Executor and database counters, read when /metrics is scraped
+PASSWORD_HASH_QUEUE = metrics.add(Gauge("password_hash_queue_depth", "Hashes waiting for a password worker"))
+PASSWORD_HASH_IN_FLIGHT = metrics.add(Gauge("password_hash_in_flight", "Hashes being computed"))
+PASSWORD_HASH_COMPLETED = metrics.add(Counter("password_hash_completed_total", "Hashes and verifications completed"))
+PASSWORD_HASH_REJECTED = metrics.add(Counter("password_hash_rejected_total", "Sign-ins refused with 503 while the queue was full"))
+PHOTO_QUEUE = metrics.add(Gauge("photo_variants_queue_depth", "Photos waiting for variant rendering"))
+PHOTO_ACTIVE = metrics.add(Gauge("photo_variants_active", "Photos being rendered"))
+PHOTO_PROCESSED = metrics.add(Counter("photo_variants_processed_total", "Photos rendered", ("result",)))
+MONGO_POOL_MAX = metrics.add(Gauge("mongodb_pool_max_size", "maxPoolSize of each server's connection pool"))
+DB_OPERATIONS = metrics.add(Counter("db_operations_total", "Database commands issued by requests", ("method", "route")))
+DB_DOCUMENTS = metrics.add(Counter("db_documents_total", "Documents returned or written for requests", ("method", "route")))
+DB_SECONDS = metrics.add(Counter("db_seconds_total", "Time requests spent waiting on the database", ("method", "route")))
+DB_REPEATED = metrics.add(Counter(
+    "db_repeated_query_requests_total", "Requests that repeated a query shape QUERY_REPEAT_THRESHOLD times", ("method", "route")
+))
+
+@metrics.collector
+def collect_executors():
+    engine = password_engine.stats()
+    PASSWORD_HASH_QUEUE.set(engine["queue_depth"])
+    PASSWORD_HASH_IN_FLIGHT.set(engine["in_flight"])
+    PASSWORD_HASH_COMPLETED.set(engine["completed"])
+    PASSWORD_HASH_REJECTED.set(engine["rejected"])
+    photos = photo_processor.stats()
+    PHOTO_QUEUE.set(photos["queue_depth"])
+    PHOTO_ACTIVE.set(photos["active"])
+    PHOTO_PROCESSED.set(photos["processed"], "ready")
+    PHOTO_PROCESSED.set(photos["failed"], "failed")
+
+@metrics.collector
+def collect_database():
+    max_pool_size = client.options.pool_options.max_pool_size
+    # In-memory test clients (mongomock-motor) have no real pool options
+    if isinstance(max_pool_size, int):
+        MONGO_POOL_MAX.set(max_pool_size)
+    for route, totals in query_monitor.routes.items():
+        labels = route.split(" ", 1)
+        DB_OPERATIONS.set(totals["operations"], *labels)
+        DB_DOCUMENTS.set(totals["documents"], *labels)
+        DB_SECONDS.set(totals["seconds"], *labels)
+        DB_REPEATED.set(totals["repeated_requests"], *labels)
+
+# Scraped by Prometheus, outside /api. Scrapes must send METRICS_TOKEN as a bearer
+# token; without one the endpoint is refused unless METRICS_PUBLIC=true.
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_PUBLIC = os.environ.get('METRICS_PUBLIC', 'false').lower() == 'true'
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics(authorization: Optional[str] = Header(None)):
+    if not METRICS_TOKEN:
+        if not METRICS_PUBLIC:
+            raise HTTPException(status_code=403, detail="Metrics disabled: set METRICS_TOKEN or METRICS_PUBLIC=true")
+    elif not hmac.compare_digest(authorization or "", f"Bearer {METRICS_TOKEN}"):
+        raise HTTPException(status_code=401, detail="Invalid metrics token")
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.on_event("startup")
+async def create_indexes():
+    if os.environ.get('AUTO_MIGRATE_INDEXES', 'true').lower() == 'true':
+        await apply_index_migrations()
+
+@app.on_event("startup")
+async def check_stored_datetimes():
+    # Native range filters never match ISO strings: nothing is served until every
+    # stored date is a BSON date. Rewriting a large database would hold up startup,
+    # so that is left to `manage.py migrate-datetimes`, run before the upgrade.
+    if DATETIME_STORAGE != 'native':
+        return
+    pending = await collections_with_string_dates()
+    if pending:
+        raise RuntimeError(
+            f"String dates left in {', '.join(pending)}: run `python manage.py migrate-datetimes` "
+            "or start with DATETIME_STORAGE=iso"
+        )
+
+@app.on_event("startup")
+async def build_financial_rollups():
+    # First start after upgrading: seed the rollups from existing practices
+    if await db.financial_rollups.estimated_document_count() == 0 and \
+       await db.trip_admin.estimated_document_count() > 0:
+        await rebuild_financial_rollups()
+
+@app.on_event("startup")
+async def start_broadcaster():
+    await broadcaster.start()
+
+@app.on_event("startup")
+async def start_photo_processor():
+    await photo_processor.start()
+
+@app.on_event("startup")
+async def start_notification_hub():
+    notification_hub.start()
+
+@app.on_event("startup")
+async def start_balance_reconciler():
+    await transactions.start()
+    balance_reconciler.start()
+
+@app.on_event("startup")
+async def start_event_loop_monitor():
+    event_loop_monitor.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await photo_processor.stop()
+    await notification_hub.stop()
+    await balance_reconciler.stop()
+    await event_loop_monitor.stop()
+    password_engine.shutdown()
+    await broadcaster.stop()
     client.close()
\ No newline at end of file
@@ -21,6 +21,7 @@ import {
   UserCheck,
   Plane
 } from 'lucide-react';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -39,8 +40,8 @@ const AdminDashboard = () => {
     try {
       const [statsRes, tripsRes, usersRes] = await Promise.all([
         axios.get(`${API}/dashboard/stats`),
-        axios.get(`${API}/trips/with-details`),
-        axios.get(`${API}/users`)
+        getAllPages(`${API}/trips/with-details`),
+        getAllPages(`${API}/users`)
       ]);
 
       setStats(statsRes.data);
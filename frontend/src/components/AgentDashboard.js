@@ -20,6 +20,7 @@ import {
   Route,
   Users
 } from 'lucide-react';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -38,7 +39,7 @@ const AgentDashboard = () => {
     try {
       const [statsRes, tripsRes] = await Promise.all([
         axios.get(`${API}/dashboard/stats`),
-        axios.get(`${API}/trips`)
+        getAllPages(`${API}/trips`)
       ]);
 
       setStats(statsRes.data);
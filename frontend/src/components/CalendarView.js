@@ -1,5 +1,4 @@
 import React, { useState, useEffect } from 'react';
-import axios from 'axios';
 import { toast } from 'sonner';
 import { useAuth } from '../App';
 import Dashboard from './Dashboard';
@@ -20,6 +19,7 @@ import {
 import { format, isSameDay, parseISO, startOfMonth, endOfMonth, eachDayOfInterval } from 'date-fns';
 import { it } from 'date-fns/locale';
 import { Link } from 'react-router-dom';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -38,7 +38,7 @@ const CalendarView = () => {
   const fetchTrips = async () => {
     try {
       setLoading(true);
-      const response = await axios.get(`${API}/trips`);
+      const response = await getAllPages(`${API}/trips`);
       setTrips(response.data);
     } catch (error) {
       console.error('Error fetching trips:', error);
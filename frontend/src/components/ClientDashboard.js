@@ -24,6 +24,7 @@ import {
   Percent,
   CreditCard
 } from 'lucide-react';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -43,7 +44,7 @@ const ClientDashboard = () => {
     try {
       const requests = [
         axios.get(`${API}/dashboard/stats`),
-        axios.get(`${API}/trips`)
+        getAllPages(`${API}/trips`)
       ];
       
       // Only fetch financial summary if user is a client
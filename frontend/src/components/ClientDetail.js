@@ -24,6 +24,7 @@ import {
 } from 'lucide-react';
 import { format } from 'date-fns';
 import { it } from 'date-fns/locale';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -46,7 +47,7 @@ const ClientDetail = () => {
     try {
       const [userRes, tripsRes, financialRes] = await Promise.all([
         axios.get(`${API}/users/${clientId}`),
-        axios.get(`${API}/trips?client_id=${clientId}`),
+        getAllPages(`${API}/trips?client_id=${clientId}`),
         axios.get(`${API}/clients/${clientId}/financial-summary`)
       ]);
       
@@ -7,6 +7,7 @@ import { Card, CardContent, CardDescription, CardHeader, CardTitle } from './ui/
 import { Button } from './ui/button';
 import { Badge } from './ui/badge';
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from './ui/select';
+import { DropdownMenu, DropdownMenuContent, DropdownMenuItem, DropdownMenuTrigger } from './ui/dropdown-menu';
 import { 
   FileText,
   TrendingUp,
@@ -28,6 +29,7 @@ const FinancialReports = () => {
   const [analytics, setAnalytics] = useState(null);
   const [yearlyData, setYearlyData] = useState(null);
   const [loading, setLoading] = useState(false);
+  const [exporting, setExporting] = useState(false);
   const [selectedYear, setSelectedYear] = useState(new Date().getFullYear());
 
   useEffect(() => {
@@ -83,6 +85,32 @@ const FinancialReports = () => {
     }
   };
 
+  const exportData = async (format) => {
+    try {
+      setExporting(true);
+      const params = new URLSearchParams({ format });
+      if (selectedYear) params.append('year', selectedYear);
+      
+      // The server streams the rows; the browser only assembles the file
+      const response = await axios.get(`${API}/analytics/export?${params}`, { responseType: 'blob' });
+      const url = URL.createObjectURL(response.data);
+      const link = document.createElement('a');
+      link.href = url;
+      link.download = `pratiche-${selectedYear}.${format}`;
+      document.body.appendChild(link);
+      link.click();
+      link.remove();
+      URL.revokeObjectURL(url);
+    } catch (error) {
+      console.error('Error exporting data:', error);
+      toast.error(error.response?.status === 501
+        ? 'Formato non disponibile su questo server'
+        : 'Errore durante l\'esportazione');
+    } finally {
+      setExporting(false);
+    }
+  };
+
   const formatCurrency = (amount) => {
     return new Intl.NumberFormat('it-IT', {
       style: 'currency',
@@ -172,13 +200,23 @@ const FinancialReports = () => {
               <RefreshCw size={14} className="mr-2" />
               Aggiorna
             </Button>
-            <Button 
-              size="sm"
-              className="bg-gradient-to-r from-green-600 to-emerald-600 hover:from-green-700 hover:to-emerald-700"
-            >
-              <Download size={14} className="mr-2" />
-              Esporta
-            </Button>
+            <DropdownMenu>
+              <DropdownMenuTrigger asChild>
+                <Button 
+                  size="sm"
+                  className="bg-gradient-to-r from-green-600 to-emerald-600 hover:from-green-700 hover:to-emerald-700"
+                  disabled={exporting}
+                >
+                  <Download size={14} className="mr-2" />
+                  {exporting ? 'Esportazione...' : 'Esporta'}
+                </Button>
+              </DropdownMenuTrigger>
+              <DropdownMenuContent align="end">
+                <DropdownMenuItem onClick={() => exportData('csv')}>CSV</DropdownMenuItem>
+                <DropdownMenuItem onClick={() => exportData('xlsx')}>Excel (XLSX)</DropdownMenuItem>
+                <DropdownMenuItem onClick={() => exportData('parquet')}>Parquet</DropdownMenuItem>
+              </DropdownMenuContent>
+            </DropdownMenu>
           </div>
         </div>
 
@@ -351,7 +389,7 @@ const FinancialReports = () => {
                         <span className="font-semibold">{formatCurrency(yearlyData.total_gross_commission)}</span>
                       </div>
                       <div className="flex justify-between text-sm">
-                        <span className="text-slate-600">Commissioni Fornitore (4%)</span>
+                        <span className="text-slate-600">Commissioni Fornitore</span>
                         <span className="font-semibold">{formatCurrency(yearlyData.total_supplier_commission)}</span>
                       </div>
                       <div className="flex justify-between text-sm font-semibold border-t pt-2">
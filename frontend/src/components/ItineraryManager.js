@@ -54,13 +54,12 @@ const ItineraryManager = () => {
 
   const fetchTripAndItineraries = async () => {
     try {
-      const [tripRes, itinerariesRes] = await Promise.all([
-        axios.get(`${API}/trips/${tripId}/full`),
-        axios.get(`${API}/trips/${tripId}/itineraries`)
-      ]);
+      const { data } = await axios.get(`${API}/trips/${tripId}/full`, {
+        params: { include: 'itineraries' }
+      });
       
-      setTrip(tripRes.data.trip);
-      setItineraries(itinerariesRes.data.sort((a, b) => a.day_number - b.day_number));
+      setTrip(data.trip);
+      setItineraries(data.itineraries.sort((a, b) => a.day_number - b.day_number));
     } catch (error) {
       console.error('Error fetching data:', error);
       toast.error('Errore nel caricamento dei dati');
@@ -25,28 +25,88 @@ import { it } from 'date-fns/locale';
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
+const PRIORITY_RANK = { high: 0, medium: 1, low: 2 };
+const TYPE_RANK = { payment_deadline: 0, balance_due: 1 };
+
+// Same order as the server: priority, days until due, installments before balances
+const sortNotifications = (items) => [...items].sort((a, b) =>
+  PRIORITY_RANK[a.priority] - PRIORITY_RANK[b.priority] ||
+  a.days_until_due - b.days_until_due ||
+  TYPE_RANK[a.type] - TYPE_RANK[b.type]
+);
+
+const statsFromCounts = (counts) => ({
+  total: counts.total_count,
+  high: counts.high_priority_count,
+  medium: counts.medium_priority_count,
+  low: counts.low_priority_count
+});
+
 const NotificationCenter = () => {
   const navigate = useNavigate();
-  const { user } = useAuth();
+  const { user, token } = useAuth();
   const [notifications, setNotifications] = useState([]);
   const [loading, setLoading] = useState(true);
   const [stats, setStats] = useState({});
 
+  // Live updates: a snapshot on connect, then deltas as payments and deadlines change.
+  // The stream is opened with a short-lived ticket, so a dropped connection is
+  // reopened with a fresh one (and a fresh snapshot) rather than by EventSource.
   useEffect(() => {
-    fetchNotifications();
-  }, []);
+    if (!token || typeof EventSource === 'undefined') {
+      fetchNotifications();
+      return undefined;
+    }
+
+    let source = null;
+    let retry = null;
+    let closed = false;
+
+    const connect = async () => {
+      try {
+        const response = await axios.post(`${API}/notifications/stream-ticket`);
+        if (closed) return;
+        source = new EventSource(`${API}/notifications/stream?ticket=${encodeURIComponent(response.data.ticket)}`);
+      } catch (error) {
+        console.error('Error opening notification stream:', error);
+        if (!closed) retry = setTimeout(connect, 5000);
+        return;
+      }
+      source.addEventListener('snapshot', (event) => {
+        const data = JSON.parse(event.data);
+        setNotifications(data.notifications);
+        setStats(statsFromCounts(data.counts));
+        setLoading(false);
+      });
+      source.addEventListener('delta', (event) => {
+        const data = JSON.parse(event.data);
+        const changed = new Set([...data.removed, ...data.upserted.map((item) => item.id)]);
+        setNotifications((current) => sortNotifications([
+          ...current.filter((item) => !changed.has(item.id)),
+          ...data.upserted
+        ]));
+        setStats(statsFromCounts(data.counts));
+      });
+      source.onerror = () => {
+        source.close();
+        if (!closed) retry = setTimeout(connect, 3000);
+      };
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, [token]);
 
   const fetchNotifications = async () => {
     try {
       setLoading(true);
       const response = await axios.get(`${API}/notifications/payment-deadlines`);
       setNotifications(response.data.notifications);
-      setStats({
-        total: response.data.total_count,
-        high: response.data.high_priority_count,
-        medium: response.data.medium_priority_count,
-        low: response.data.low_priority_count
-      });
+      setStats(statsFromCounts(response.data));
     } catch (error) {
       console.error('Error fetching notifications:', error);
       toast.error('Errore nel caricamento delle notifiche');
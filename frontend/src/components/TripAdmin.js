@@ -25,6 +25,7 @@ import {
 } from 'lucide-react';
 import { format } from 'date-fns';
 import { it } from 'date-fns/locale';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -43,6 +44,7 @@ const TripAdmin = () => {
   const [adminData, setAdminData] = useState({
     practice_number: '',
     booking_number: '',
+    supplier: '',
     gross_amount: 0,
     net_amount: 0,
     discount: 0,
@@ -82,6 +84,7 @@ const TripAdmin = () => {
           setAdminData({
             practice_number: adminRes.data.practice_number,
             booking_number: adminRes.data.booking_number,
+            supplier: adminRes.data.supplier || '',
             gross_amount: adminRes.data.gross_amount,
             net_amount: adminRes.data.net_amount,
             discount: adminRes.data.discount,
@@ -92,7 +95,7 @@ const TripAdmin = () => {
           });
           
           // Fetch payments
-          const paymentsRes = await axios.get(`${API}/trip-admin/${adminRes.data.id}/payments`);
+          const paymentsRes = await getAllPages(`${API}/trip-admin/${adminRes.data.id}/payments`);
           setPayments(paymentsRes.data);
         }
       } catch (error) {
@@ -206,6 +209,11 @@ const TripAdmin = () => {
     }).format(amount || 0);
   };
 
+  const formatPercentage = (value, total) => {
+    if (!total) return '0%';
+    return `${((value / total) * 100).toFixed(1)}%`;
+  };
+
   const formatDate = (dateString) => {
     return format(new Date(dateString), "PPP", { locale: it });
   };
@@ -265,7 +273,7 @@ const TripAdmin = () => {
                 </CardDescription>
               </CardHeader>
               <CardContent className="space-y-4">
-                <div className="grid grid-cols-1 md:grid-cols-2 gap-4">
+                <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
                   <div className="space-y-2">
                     <Label htmlFor="practice_number">Numero Scheda Pratica *</Label>
                     <Input
@@ -284,6 +292,15 @@ const TripAdmin = () => {
                       onChange={(e) => handleInputChange('booking_number', e.target.value)}
                     />
                   </div>
+                  <div className="space-y-2">
+                    <Label htmlFor="supplier">Fornitore</Label>
+                    <Input
+                      id="supplier"
+                      placeholder="es. MSC Crociere"
+                      value={adminData.supplier}
+                      onChange={(e) => handleInputChange('supplier', e.target.value)}
+                    />
+                  </div>
                 </div>
 
                 <Separator />
@@ -435,7 +452,9 @@ const TripAdmin = () => {
                       <span className="font-bold text-green-600">{formatCurrency(tripAdmin.gross_commission)}</span>
                     </div>
                     <div className="flex justify-between items-center p-3 bg-orange-50 rounded-lg">
-                      <span className="font-medium text-orange-800">Commissione Fornitore (4%)</span>
+                      <span className="font-medium text-orange-800">
+                        Commissione Fornitore ({formatPercentage(tripAdmin.supplier_commission, tripAdmin.gross_amount)})
+                      </span>
                       <span className="font-bold text-orange-600">{formatCurrency(tripAdmin.supplier_commission)}</span>
                     </div>
                     <div className="flex justify-between items-center p-3 bg-blue-50 rounded-lg">
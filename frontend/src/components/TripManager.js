@@ -27,6 +27,7 @@ import {
 } from 'lucide-react';
 import { format } from 'date-fns';
 import { it } from 'date-fns/locale';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -77,7 +78,7 @@ const TripManager = () => {
     try {
       // Use clients endpoint for agents, users for admins
       const endpoint = currentUser?.role === 'admin' ? `${API}/users` : `${API}/clients`;
-      const response = await axios.get(endpoint);
+      const response = await getAllPages(endpoint);
       
       // Filter only clients if using admin endpoint
       const clients = currentUser?.role === 'admin' 
@@ -35,6 +35,7 @@ import {
 } from 'lucide-react';
 import { format } from 'date-fns';
 import { it } from 'date-fns/locale';
+import { assetUrl } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -71,26 +72,16 @@ const TripView = () => {
   const fetchTripData = async () => {
     try {
       setLoading(true);
-      const [tripRes, itinerariesRes, photosRes, notesRes] = await Promise.all([
-        axios.get(`${API}/trips/${tripId}`),
-        axios.get(`${API}/trips/${tripId}/itineraries`),
-        axios.get(`${API}/trips/${tripId}/photos`),
-        axios.get(`${API}/trips/${tripId}/notes`)
-      ]);
-
-      setTrip(tripRes.data);
-      setItineraries(itinerariesRes.data);
-      setPhotos(photosRes.data);
-      setNotes(notesRes.data);
-
-      // If it's a cruise, fetch cruise info
-      if (tripRes.data.trip_type === 'cruise') {
-        try {
-          const cruiseRes = await axios.get(`${API}/trips/${tripId}/cruise-info`);
-          setCruiseInfo(cruiseRes.data);
-        } catch (error) {
-          console.log('No cruise info found');
-        }
+      const { data } = await axios.get(`${API}/trips/${tripId}/full`, {
+        params: { include: 'itineraries,photos,notes,cruise_info', photo_size: 'medium' }
+      });
+
+      setTrip(data.trip);
+      setItineraries(data.itineraries);
+      setPhotos(data.photos);
+      setNotes(data.notes);
+      if (data.trip.trip_type === 'cruise') {
+        setCruiseInfo(data.cruise_info);
       }
     } catch (error) {
       console.error('Error fetching trip data:', error);
@@ -418,8 +409,9 @@ const TripView = () => {
                       {photos.slice(0, 4).map((photo) => (
                         <div key={photo.id} className="relative aspect-square rounded-lg overflow-hidden">
                           <img
-                            src={`${BACKEND_URL}${photo.url}`}
+                            src={assetUrl(photo.url)}
                             alt={photo.caption}
+                            loading="lazy"
                             className="w-full h-full object-cover"
                           />
                           <div className="absolute inset-0 bg-black bg-opacity-40 opacity-0 hover:opacity-100 transition-opacity flex items-end">
@@ -573,10 +565,15 @@ const TripView = () => {
                 {photos.length > 0 ? (
                   <div className="photo-grid">
                     {photos.map((photo) => (
-                      <div key={photo.id} className="photo-item">
+                      <div
+                        key={photo.id}
+                        className="photo-item cursor-pointer"
+                        onClick={() => window.open(assetUrl(photo.variants?.original || photo.url), '_blank', 'noopener')}
+                      >
                         <img
-                          src={`${BACKEND_URL}${photo.url}`}
+                          src={assetUrl(photo.url)}
                           alt={photo.caption}
+                          loading="lazy"
                         />
                         <div className="photo-overlay">
                           <Badge className="mb-2 text-xs">{photo.photo_category}</Badge>
@@ -28,6 +28,7 @@ import {
   Search,
   X
 } from 'lucide-react';
+import { getAllPages } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -66,7 +67,7 @@ const UserManagement = () => {
         endpoint = `${API}/clients`; // Agent endpoint (only clients)
       }
       
-      const response = await axios.get(endpoint);
+      const response = await getAllPages(endpoint);
       setUsers(response.data);
     } catch (error) {
       console.error('Error fetching users:', error);
@@ -1,6 +1,27 @@
+import axios from "axios";
 import { clsx } from "clsx";
 import { twMerge } from "tailwind-merge"
 
 export function cn(...inputs) {
   return twMerge(clsx(inputs));
 }
+
+// List endpoints answer one page at a time; follow X-Next-Cursor to collect every row.
+// Resolves like axios.get, with the concatenated rows as `data`.
+export async function getAllPages(url, config = {}) {
+  const rows = [];
+  let cursor = null;
+  do {
+    const params = { limit: 1000, ...config.params, ...(cursor ? { cursor } : {}) };
+    const response = await axios.get(url, { ...config, params });
+    rows.push(...response.data);
+    cursor = response.headers['x-next-cursor'];
+  } while (cursor);
+  return { data: rows };
+}
+
+// Photo URLs are server paths ("/uploads/...") with local storage, absolute with S3.
+export function assetUrl(url) {
+  if (!url || /^https?:\/\//i.test(url)) return url;
+  return `${process.env.REACT_APP_BACKEND_URL}${url}`;
+}
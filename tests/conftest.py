@@ -0,0 +1,85 @@
+"""Shared fixtures: the ASGI app on an in-memory mongomock-motor database.
+
+Collection calls are reported to server.query_monitor by fakedb.MonitoredMongoMock,
+so query counts in these tests are the commands issued by the code.
+"""
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ["DB_NAME"] = "travel_agency_test"
+os.environ.setdefault("UPLOAD_DIR", tempfile.mkdtemp(prefix="travel_agency_test_uploads"))
+os.environ.setdefault("PROFILE_DIR", tempfile.mkdtemp(prefix="travel_agency_test_profiles"))
+
+import server  # noqa: E402  (DB_NAME must be set before the client is created)
+from fakedb import MonitoredMongoMock  # noqa: E402
+from mongomock_motor import AsyncMongoMockClient  # noqa: E402
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    monitored = MonitoredMongoMock(server.query_monitor).install(monkeypatch.setattr)
+    client = AsyncMongoMockClient()
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", client[os.environ["DB_NAME"]])
+    monkeypatch.setattr(server.transactions, "mode", "off")
+    server.user_cache.clear()
+    server.dashboard_cache.clear()
+    server.query_monitor.routes.clear()
+    return monitored
+
+
+@pytest.fixture
+def db(mongo):
+    return server.db
+
+
+@pytest.fixture
+async def http(mongo):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+@pytest.fixture
+async def users(db):
+    """An admin, an agent and a client, with their Authorization headers"""
+    created = {}
+    for role in ("admin", "agent", "client"):
+        user = server.User(email=f"{role}@example.com", first_name=role.title(), last_name="Test", role=role)
+        document = server.prepare_for_mongo(user.dict())
+        await db.users.insert_one({**document, "hashed_password": "unused"})
+        created[role] = {**document, "headers": {"Authorization": f"Bearer {server.create_token(document)}"}}
+    return created
+
+
+@pytest.fixture
+async def practice(db, users):
+    """A confirmed trip of the agent's with its practice; returns the trip_admin document"""
+    trip_id = str(uuid.uuid4())
+    await db.trips.insert_one({
+        "id": trip_id, "title": "Crociera", "destination": "Mediterraneo", "description": "",
+        "agent_id": users["agent"]["id"], "client_id": users["client"]["id"],
+        "start_date": server.mongo_datetime(server.datetime(2025, 6, 1, tzinfo=server.timezone.utc)),
+        "end_date": server.mongo_datetime(server.datetime(2025, 6, 8, tzinfo=server.timezone.utc)),
+        "trip_type": "cruise", "status": "active",
+    })
+    admin = server.TripAdmin(**server.calculate_trip_admin_fields({
+        "trip_id": trip_id, "status": "confirmed", "practice_number": "P-1", "booking_number": "B-1",
+        "gross_amount": 2000.0, "net_amount": 1800.0, "discount": 0.0, "confirmation_deposit": 300.0,
+        "practice_confirm_date": server.datetime(2025, 3, 1, tzinfo=server.timezone.utc),
+        "client_departure_date": server.datetime(2025, 6, 1, tzinfo=server.timezone.utc),
+    }, installments=[], agent_id=users["agent"]["id"])).dict()
+    await db.trip_admin.insert_one(server.prepare_for_mongo(dict(admin)))
+    return admin
@@ -0,0 +1,32 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_agent_commissions_totals_match_rows(http, db, users, practice):
+    await db.trip_admin.insert_one(server.prepare_for_mongo({**practice, "id": str(uuid.uuid4()), "practice_number": "P-2"}))
+    await db.trip_admin.insert_one(server.prepare_for_mongo({
+        **practice, "id": str(uuid.uuid4()), "practice_number": "P-3", "status": "draft",
+    }))
+    response = await http.get("/api/analytics/agent-commissions", headers=users["agent"]["headers"], params={"year": 2025})
+    assert response.status_code == 200
+    body = response.json()
+    assert set(body) == {"year", "agent_id", "total_confirmed_trips", "total_revenue", "total_gross_commission",
+                         "total_supplier_commission", "total_agent_commission", "trips"}
+    assert body["total_confirmed_trips"] == len(body["trips"]) == 2
+    assert body["total_revenue"] == sum(trip["gross_amount"] for trip in body["trips"]) == 4000.0
+    assert body["total_agent_commission"] == 2 * practice["agent_commission"]
+    # Whole practices, as before
+    assert {"status", "client_departure_date", "confirmation_deposit", "balance_due", "total_paid"} <= set(body["trips"][0])
+    assert "_id" not in body["trips"][0]
+
+
+async def test_agent_commissions_follow_trip_reassignment(http, db, users, practice):
+    await db.trips.update_one({"id": practice["trip_id"]}, {"$set": {"agent_id": "someone-else"}})
+    response = await http.get("/api/analytics/agent-commissions", headers=users["agent"]["headers"])
+    assert response.json()["total_confirmed_trips"] == 0
+    assert response.json()["trips"] == []
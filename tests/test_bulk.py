@@ -0,0 +1,61 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+DAY = "2025-06-02T00:00:00Z"
+
+
+def day(trip_id: str, number: int, **extra) -> dict:
+    return {"trip_id": trip_id, "day_number": number, "date": DAY, "title": f"Giorno {number}", "description": "",
+            "itinerary_type": "port_day", **extra}
+
+
+def poi(name: str) -> dict:
+    return {"name": name, "category": "restaurant", "address": "Via Roma 1"}
+
+
+async def test_itinerary_days_are_created_with_their_port_schedules(http, db, users, practice):
+    schedule = {"port_name": "Napoli", "arrival_time": DAY, "departure_time": DAY, "all_aboard_time": DAY}
+    response = await http.post("/api/itineraries/bulk", headers=users["agent"]["headers"], json={"items": [
+        day(practice["trip_id"], 1), day(practice["trip_id"], 2, port_schedule=schedule),
+    ]})
+    body = response.json()
+    assert (body["created"], body["invalid"]) == (2, 0)
+    first, second = body["results"]
+    assert "port_schedule_id" not in first
+    stored = await db.port_schedules.find_one({"id": second["port_schedule_id"]})
+    assert (stored["itinerary_id"], stored["trip_id"], stored["port_name"]) == (second["id"], practice["trip_id"], "Napoli")
+    assert await db.itineraries.count_documents({"trip_id": practice["trip_id"]}) == 2
+
+
+@pytest.mark.parametrize("ordered, statuses", [
+    (True, ["created", "invalid", "skipped"]),
+    (False, ["created", "invalid", "created"]),
+])
+async def test_invalid_items_stop_only_ordered_batches(http, db, users, ordered, statuses):
+    response = await http.post("/api/pois/bulk", headers=users["admin"]["headers"], json={
+        "ordered": ordered, "items": [poi("Uno"), {"name": "Senza indirizzo", "category": "restaurant"}, poi("Tre")],
+    })
+    body = response.json()
+    assert [result["status"] for result in body["results"]] == statuses
+    assert body["results"][1]["errors"][0]["loc"] == ["address"]
+    assert await db.pois.count_documents({}) == statuses.count("created")
+
+
+async def test_a_retried_batch_is_replayed_not_written_again(http, db, users):
+    headers = {**users["admin"]["headers"], "Idempotency-Key": "batch-1"}
+    first = await http.post("/api/pois/bulk", headers=headers, json={"items": [poi("Uno")]})
+    retry = await http.post("/api/pois/bulk", headers=headers, json={"items": [poi("Uno")]})
+
+    assert retry.json() == {**first.json(), "replayed": True}
+    assert await db.pois.count_documents({}) == 1
+
+    different = await http.post("/api/pois/bulk", headers=headers, json={"items": [poi("Due")]})
+    assert different.status_code == 422
+
+
+async def test_clients_cannot_write_in_bulk(http, users):
+    response = await http.post("/api/pois/bulk", headers=users["client"]["headers"], json={"items": [poi("Uno")]})
+    assert response.status_code == 403
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+import server
+
+RATES = server.CommissionRates(0.04, agents={"agent-b": 0.03}, suppliers={"MSC": 0.05, "Costa": 0.06})
+
+
+def scalar_fields(practice: dict, installments: list, agent_id, rates: server.CommissionRates) -> dict:
+    """One practice at a time, as calculate_trip_admin_fields worked before the batch engine"""
+    rate = rates.suppliers.get(practice["supplier"], rates.agents.get(agent_id, rates.default))
+    gross_commission = practice["gross_amount"] - practice["discount"] - practice["net_amount"]
+    supplier_commission = practice["gross_amount"] * rate
+    total_paid = sum(amount for key, amount in installments if key == practice["id"])
+    return {
+        "gross_commission": gross_commission,
+        "supplier_commission": supplier_commission,
+        "agent_commission": gross_commission - supplier_commission,
+        "total_paid": total_paid,
+        "balance_due": practice["gross_amount"] - practice["confirmation_deposit"] - total_paid,
+    }
+
+
+@pytest.fixture
+def batch():
+    rng = random.Random(7)
+    practices = [{
+        "id": f"p{index}",
+        "gross_amount": round(rng.uniform(500, 5000), 2),
+        "net_amount": round(rng.uniform(300, 450), 2),
+        "discount": rng.choice([0.0, 25.0]),
+        "confirmation_deposit": rng.choice([0.0, 200.0]),
+        "supplier": rng.choice(["MSC", "Costa", "Alpitour", None]),
+    } for index in range(200)]
+    agent_ids = [rng.choice(["agent-a", "agent-b", None]) for _ in practices]
+    installments = [(f"p{rng.randrange(220)}", round(rng.uniform(10, 300), 2)) for _ in range(500)]
+    return practices, agent_ids, installments
+
+
+def test_batch_engine_matches_the_scalar_formulas(batch):
+    practices, agent_ids, installments = batch
+    fields = server.calculate_commissions(
+        [practice["id"] for practice in practices],
+        *[[practice[column] for practice in practices]
+          for column in ("gross_amount", "net_amount", "discount", "confirmation_deposit")],
+        [key for key, _ in installments], [amount for _, amount in installments],
+        agent_ids=agent_ids, suppliers=[practice["supplier"] for practice in practices], rates=RATES,
+    )
+    for position, (practice, agent_id) in enumerate(zip(practices, agent_ids)):
+        expected = scalar_fields(practice, installments, agent_id, RATES)
+        assert {name: float(values[position]) for name, values in fields.items()} == pytest.approx(expected)
+
+
+def test_supplier_rates_take_precedence_over_agent_rates():
+    rates = RATES.rates_for(4, agent_ids=["agent-b", "agent-b", "agent-a", None],
+                            suppliers=["MSC", None, "Alpitour", "Costa"])
+    assert rates.tolist() == [0.05, 0.03, 0.04, 0.06]
+
+
+def test_single_practice_wrapper_uses_the_stored_total_without_installments(batch, monkeypatch):
+    monkeypatch.setattr(server, "commission_rates", RATES)
+    practice = {**batch[0][0], "supplier": None, "total_paid": 150.0}
+
+    stored = server.calculate_trip_admin_fields(practice, agent_id="agent-b")
+    assert stored["supplier_commission"] == pytest.approx(practice["gross_amount"] * 0.03)
+    assert stored["balance_due"] == pytest.approx(practice["gross_amount"] - practice["confirmation_deposit"] - 150.0)
+
+    # Given the installments, those are summed instead
+    summed = server.calculate_trip_admin_fields(practice, [{"amount": 40.0}, {"amount": 60.0}], agent_id="agent-b")
+    assert summed["total_paid"] == 100.0
@@ -0,0 +1,69 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def versions() -> dict:
+    return {document["_id"]: document["version"] async for document in server.db.collection_versions.find()}
+
+
+async def test_unchanged_reads_are_answered_with_304(http, users, practice):
+    path, headers = f"/api/trips/{practice['trip_id']}", users["agent"]["headers"]
+    first = await http.get(path, headers=headers)
+    etag = first.headers["ETag"]
+    assert etag.startswith('W/"')
+
+    cached = await http.get(path, headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.headers["ETag"] == etag and cached.content == b""
+
+    # Another caller never shares a tag, even for the same path
+    other = await http.get(path, headers=users["admin"]["headers"])
+    assert other.headers["ETag"] != etag
+
+    await http.put(path, headers=headers, json={"title": "Crociera ai Caraibi"})
+    changed = await http.get(path, headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["title"] == "Crociera ai Caraibi"
+
+
+async def test_every_write_endpoint_bumps_its_collections(http, users, practice):
+    agent, admin, client = (users[role]["headers"] for role in ("agent", "admin", "client"))
+    trip_id = practice["trip_id"]
+    day = "2025-06-02T00:00:00Z"
+    itinerary = {"trip_id": trip_id, "day_number": 2, "date": day, "title": "Roma", "description": "",
+                 "itinerary_type": "port_day"}
+    writes = [
+        ("POST", "/api/trips", agent, {"title": "Tour", "destination": "Roma", "description": "", "client_id": users["client"]["id"],
+                                       "start_date": day, "end_date": day, "trip_type": "tour"}, {"trips"}),
+        ("PUT", f"/api/trips/{trip_id}", agent, {"status": "active"}, {"trips"}),
+        ("POST", "/api/itineraries", agent, itinerary, {"itineraries"}),
+        ("POST", "/api/itineraries/bulk", agent, {"items": [itinerary]}, {"itineraries"}),
+        ("POST", f"/api/trips/{trip_id}/cruise-info", agent, {"trip_id": trip_id, "ship_name": "MSC", "cabin_number": "1",
+                                                             "departure_time": day, "return_time": day}, {"cruise_info"}),
+        ("POST", "/api/pois", admin, {"name": "Trattoria", "category": "restaurant", "address": "Via Roma 1"}, {"pois"}),
+        ("POST", f"/api/trips/{trip_id}/notes", client, {"trip_id": trip_id, "day_number": 1, "note_text": "Nota"}, {"client_notes"}),
+        ("PUT", f"/api/trip-admin/{practice['id']}", agent, {"discount": 50.0}, {"trip_admin"}),
+        ("POST", f"/api/trip-admin/{practice['id']}/payments", agent, {"trip_admin_id": practice["id"], "amount": 100.0,
+                                                                      "payment_date": day}, {"trip_admin", "payment_installments"}),
+        ("PUT", f"/api/users/{users['client']['id']}", admin, {"first_name": "Cliente"}, {"users"}),
+        ("POST", f"/api/users/{users['client']['id']}/block", admin, None, {"users"}),
+    ]
+    for method, path, headers, body, collections in writes:
+        before = await versions()
+        response = await http.request(method, path, headers=headers, json=body)
+        assert response.status_code == 200, (path, response.text)
+        after = await versions()
+        bumped = {name for name in after if after[name] != before.get(name)}
+        assert collections <= bumped, (method, path, bumped)
+
+
+async def test_the_datetime_migration_bumps_what_it_rewrites(db):
+    await db.itineraries.insert_one({"id": "legacy", "trip_id": "t", "date": "2025-06-01T00:00:00+00:00"})
+    before = await versions()
+
+    assert (await server.migrate_datetimes())["itineraries"] == 1
+    assert (await versions())["itineraries"] == before.get("itineraries", 0) + 1
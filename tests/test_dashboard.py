@@ -0,0 +1,51 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def stats(http, users, role: str) -> dict:
+    response = await http.get("/api/dashboard/stats", headers=users[role]["headers"])
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_stats_are_cached_per_user(http, db, users):
+    assert (await stats(http, users, "agent"))["my_trips"] == 0
+    # Written behind the API's back: the cached counts stand until they expire
+    await db.trips.insert_one({"id": str(uuid.uuid4()), "agent_id": users["agent"]["id"], "client_id": "c", "status": "active"})
+    assert (await stats(http, users, "agent"))["my_trips"] == 0
+
+    server.dashboard_cache.clear()
+    assert (await stats(http, users, "agent"))["my_trips"] == 1
+
+
+async def test_trip_writes_refresh_the_agent_client_and_admin_stats(http, users):
+    before = {role: await stats(http, users, role) for role in ("admin", "agent", "client")}
+    response = await http.post("/api/trips", headers=users["agent"]["headers"], json={
+        "title": "Tour", "destination": "Roma", "description": "", "client_id": users["client"]["id"],
+        "start_date": "2099-06-01T00:00:00Z", "end_date": "2099-06-08T00:00:00Z", "trip_type": "tour",
+    })
+    assert response.status_code == 200
+
+    assert (await stats(http, users, "admin"))["total_trips"] == before["admin"]["total_trips"] + 1
+    assert (await stats(http, users, "agent"))["my_trips"] == before["agent"]["my_trips"] + 1
+    assert (await stats(http, users, "client"))["upcoming_trips"] == before["client"]["upcoming_trips"] + 1
+
+    await http.delete(f"/api/trips/{response.json()['id']}", headers=users["agent"]["headers"])
+    assert await stats(http, users, "agent") == before["agent"]
+    assert await stats(http, users, "client") == before["client"]
+
+
+async def test_photo_uploads_refresh_the_client_stats(http, users, practice, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "photo_storage", server.LocalPhotoStorage(tmp_path))
+    assert (await stats(http, users, "client"))["my_photos"] == 0
+    response = await http.post(
+        f"/api/trips/{practice['trip_id']}/photos", headers=users["client"]["headers"],
+        files={"file": ("photo.jpg", b"not really a jpeg", "image/jpeg")}, data={"photo_category": "destination"},
+    )
+    assert response.status_code == 200
+    assert (await stats(http, users, "client"))["my_photos"] == 1
@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def legacy_trip(db, users):
+    """A trip written by the ISO string storage"""
+    await db.trips.insert_one({
+        "id": "legacy", "title": "Tour", "destination": "Roma", "description": "",
+        "agent_id": users["agent"]["id"], "client_id": users["client"]["id"],
+        "start_date": "2025-06-01T00:00:00+00:00", "end_date": "2025-06-08T00:00:00+00:00",
+        "trip_type": "tour", "status": "active",
+    })
+
+
+async def test_startup_refuses_string_dates_without_rewriting_them(db, legacy_trip):
+    with pytest.raises(RuntimeError, match="String dates left in trips: run `python manage.py migrate-datetimes`"):
+        await server.check_stored_datetimes()
+    assert (await db.trips.find_one({"id": "legacy"}))["start_date"] == "2025-06-01T00:00:00+00:00"
+
+
+async def test_startup_proceeds_once_the_migration_has_run(db, legacy_trip):
+    assert (await server.migrate_datetimes())["trips"] == 1
+    trip = await db.trips.find_one({"id": "legacy"})
+    assert isinstance(trip["start_date"], datetime)
+
+    await server.check_stored_datetimes()
+    progress = await db.schema_migrations.find_one({"_id": "datetimes:trips"})
+    assert progress["completed"]
+
+
+async def test_an_interrupted_migration_resumes_after_its_checkpoint(db, legacy_trip):
+    later = await db.trips.find_one({"id": "legacy"})
+    await db.trips.insert_one({**{key: value for key, value in later.items() if key != "_id"}, "id": "second"})
+    # As left by a run that stopped after the first document
+    await db.schema_migrations.insert_one({"_id": "datetimes:trips", "kind": "datetimes", "last_id": later["_id"], "updated": 1})
+
+    assert (await server.migrate_datetimes())["trips"] == 2
+    assert isinstance((await db.trips.find_one({"id": "second"}))["start_date"], datetime)
+    assert (await db.trips.find_one({"id": "legacy"}))["start_date"] == "2025-06-01T00:00:00+00:00"
+
+
+async def test_collections_found_clean_are_not_scanned_again(db, users):
+    assert await server.collections_with_string_dates() == []
+    completed = await db.schema_migrations.distinct("_id", {"kind": "datetimes", "completed": True})
+    assert sorted(completed) == sorted(f"datetimes:{name}" for name in server.COLLECTION_MODELS)
+
+
+async def test_iso_storage_is_left_alone(db, legacy_trip, monkeypatch):
+    monkeypatch.setattr(server, "DATETIME_STORAGE", "iso")
+    await server.check_stored_datetimes()
+    assert (await db.trips.find_one({"id": "legacy"}))["start_date"] == "2025-06-01T00:00:00+00:00"
@@ -0,0 +1,58 @@
+import csv
+import io
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_csv_export_is_ordered_by_confirm_date(http, db, users, practice):
+    for number, month in ((2, 1), (3, 5), (4, 2)):
+        await db.trip_admin.insert_one(server.prepare_for_mongo({
+            **practice, "id": str(uuid.uuid4()), "practice_number": f"P-{number}",
+            "practice_confirm_date": server.datetime(2025, month, 1, tzinfo=server.timezone.utc),
+        }))
+    response = await http.get("/api/analytics/export", headers=users["admin"]["headers"], params={"format": "csv"})
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert [row[0] for row in rows[1:]] == ["P-2", "P-4", "P-1", "P-3"]
+
+
+async def test_csv_export_filters_by_status(http, db, users, practice):
+    await db.trip_admin.insert_one(server.prepare_for_mongo({
+        **practice, "id": str(uuid.uuid4()), "practice_number": "P-2", "status": "cancelled",
+    }))
+    response = await http.get("/api/analytics/export", headers=users["admin"]["headers"],
+                              params={"format": "csv", "status": "cancelled"})
+    rows = list(csv.reader(io.StringIO(response.text)))
+    assert [row[0] for row in rows[1:]] == ["P-2"]
+
+
+async def test_xlsx_export_has_typed_cells(http, users, practice):
+    openpyxl = pytest.importorskip("openpyxl")
+    response = await http.get("/api/analytics/export", headers=users["admin"]["headers"], params={"format": "xlsx"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == server.EXPORT_MEDIA_TYPES["xlsx"]
+
+    header, row = openpyxl.load_workbook(io.BytesIO(response.content), read_only=True)["Pratiche"].values
+    assert list(header) == [column for column, _ in server.EXPORT_COLUMNS]
+    values = dict(zip(header, row))
+    assert values["practice_number"] == "P-1"
+    assert values["gross_amount"] == 2000.0
+    assert values["practice_confirm_date"] == server.datetime(2025, 3, 1)
+
+
+async def test_parquet_export_matches_the_columns(http, users, practice):
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    response = await http.get("/api/analytics/export", headers=users["admin"]["headers"], params={"format": "parquet"})
+    assert response.status_code == 200
+
+    table = pyarrow_parquet.read_table(io.BytesIO(response.content))
+    assert table.column_names == [column for column, _ in server.EXPORT_COLUMNS]
+    [row] = table.to_pylist()
+    assert row["practice_number"] == "P-1"
+    assert row["agent_name"] == "Agent Test"
+    assert row["practice_confirm_date"] == server.datetime(2025, 3, 1, tzinfo=server.timezone.utc)
@@ -0,0 +1,65 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def rollup_writes(monkeypatch):
+    """Records, for each apply_rollup_delta call, whether it ran inside transactions.run"""
+    calls = []
+    inside = []
+    run, apply_rollup_delta = server.transactions.run, server.apply_rollup_delta
+
+    async def tracked_run(callback):
+        inside.append(True)
+        try:
+            return await run(callback)
+        finally:
+            inside.pop()
+
+    async def tracked_delta(*args, **kwargs):
+        calls.append(bool(inside))
+        return await apply_rollup_delta(*args, **kwargs)
+
+    monkeypatch.setattr(server.transactions, "run", tracked_run)
+    monkeypatch.setattr(server, "apply_rollup_delta", tracked_delta)
+    return calls
+
+
+async def bucket(db, status="confirmed"):
+    return await db.financial_rollups.find_one({"status": status, "year": 2025, "month": 3})
+
+
+async def test_creating_a_practice_moves_its_bucket_in_the_transaction(http, db, users, rollup_writes):
+    trip_id = "trip-1"
+    await db.trips.insert_one({"id": trip_id, "agent_id": users["agent"]["id"], "client_id": users["client"]["id"]})
+    response = await http.post(f"/api/trips/{trip_id}/admin", headers=users["agent"]["headers"], json={
+        "trip_id": trip_id, "practice_number": "P-9", "booking_number": "B-9",
+        "gross_amount": 1000.0, "net_amount": 900.0, "confirmation_deposit": 100.0,
+        "practice_confirm_date": "2025-03-10T00:00:00Z", "client_departure_date": "2025-06-01T00:00:00Z",
+    })
+    assert response.status_code == 200
+    assert rollup_writes == [True]
+    stored = await bucket(db, "draft")
+    assert stored["bookings"] == 1
+    assert stored["gross_amount"] == 1000.0
+
+
+async def test_payments_and_updates_move_buckets_in_the_transaction(http, db, users, practice, rollup_writes):
+    await server.apply_rollup_delta(None, server.prepare_for_mongo(dict(practice)), users["agent"]["id"])
+    rollup_writes.clear()
+
+    response = await http.post(f"/api/trip-admin/{practice['id']}/payments", headers=users["agent"]["headers"], json={
+        "trip_admin_id": practice["id"], "amount": 200.0, "payment_date": "2025-04-01T00:00:00Z",
+    })
+    assert response.status_code == 200
+    assert (await bucket(db))["balance_due"] == practice["balance_due"] - 200.0
+
+    response = await http.put(f"/api/trip-admin/{practice['id']}", headers=users["agent"]["headers"], json={"status": "cancelled"})
+    assert response.status_code == 200
+    assert await bucket(db) is None
+    assert (await bucket(db, "cancelled"))["bookings"] == 1
+    assert rollup_writes == [True, True]
+
@@ -0,0 +1,57 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def rebuilt_agents(monkeypatch):
+    rebuilt = []
+
+    async def rebuild_agent_rollups(agent_ids):
+        rebuilt.append(set(agent_ids))
+
+    async def rebuild_financial_rollups():
+        raise AssertionError("imports must not rebuild every rollup")
+
+    monkeypatch.setattr(server, "rebuild_agent_rollups", rebuild_agent_rollups)
+    monkeypatch.setattr(server, "rebuild_financial_rollups", rebuild_financial_rollups)
+    return rebuilt
+
+
+async def test_practice_import_rebuilds_only_previous_and_new_agents(db, users, practice, rebuilt_agents, tmp_path):
+    await db.trips.insert_one({"id": "trip-2", "agent_id": "agent-2", "client_id": users["client"]["id"]})
+    path = tmp_path / "practices.csv"
+    path.write_text(
+        "trip_id;practice_number;booking_number;gross_amount;net_amount;practice_confirm_date;client_departure_date\n"
+        "trip-2;P-1;B-1;1000;900;2025-03-01;2025-06-01\n"
+    )
+    report = await server.import_spreadsheet(path, "practices", "csv")
+    assert report["updated"] == 1
+    assert rebuilt_agents == [{users["agent"]["id"], "agent-2"}]
+
+
+async def test_installment_import_rebuilds_the_practice_agent(db, users, practice, rebuilt_agents, tmp_path):
+    path = tmp_path / "installments.csv"
+    path.write_text("practice_number;amount;payment_date\nP-1;100;2025-04-01\n")
+    report = await server.import_spreadsheet(path, "installments", "csv")
+    assert report["inserted"] == 1
+    assert rebuilt_agents == [{users["agent"]["id"]}]
+
+
+async def test_practice_number_index_is_unique_for_numbered_practices(db):
+    await server.apply_index_migrations()
+    indexes = await db.trip_admin.index_information()
+    assert "practice_number_1" not in indexes
+    assert indexes["practice_number_unique"]["unique"]
+    # mongomock does not report partial filters: check the declaration
+    declared = {model.document["name"]: model.document for model in server.declared_indexes()["trip_admin"]
+                if "name" in model.document}
+    assert declared["practice_number_unique"]["partialFilterExpression"] == {"practice_number": {"$gt": ""}}
+
+
+async def test_duplicate_practice_numbers_stop_the_migration(db):
+    await db.trip_admin.insert_many([{"id": "a", "practice_number": "P-1"}, {"id": "b", "practice_number": "P-1"}])
+    with pytest.raises(RuntimeError, match="Index migration 7"):
+        await server.apply_index_migrations()
@@ -0,0 +1,35 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_migrations_apply_once_in_version_order(db):
+    versions = [migration["version"] for migration in server.INDEX_MIGRATIONS]
+    assert versions == sorted(versions)
+
+    assert await server.apply_index_migrations() == versions
+    assert await server.apply_index_migrations() == []
+    recorded = await db.schema_migrations.distinct("version", {"kind": "indexes"})
+    assert sorted(recorded) == versions
+
+
+async def test_every_declared_index_exists(db):
+    await server.apply_index_migrations()
+    for collection_name, indexes in server.declared_indexes().items():
+        existing = [tuple(info["key"]) for info in (await db[collection_name].index_information()).values()]
+        for index in indexes:
+            assert tuple(index.document["key"].items()) in existing, (collection_name, index.document)
+
+
+async def test_an_index_dropped_by_hand_is_recreated(db):
+    await server.apply_index_migrations()
+    await db.users.drop_index("email_1")
+
+    assert await server.apply_index_migrations() == []
+    assert "email_1" in await db.users.index_information()
+    await db.users.insert_one({"id": "a", "email": "same@example.com"})
+    with pytest.raises(DuplicateKeyError):
+        await db.users.insert_one({"id": "b", "email": "same@example.com"})
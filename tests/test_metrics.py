@@ -0,0 +1,26 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics_are_refused_without_a_token(http, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "")
+    monkeypatch.setattr(server, "METRICS_PUBLIC", False)
+    assert (await http.get("/metrics")).status_code == 403
+
+
+async def test_metrics_can_be_made_public(http, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "")
+    monkeypatch.setattr(server, "METRICS_PUBLIC", True)
+    response = await http.get("/metrics")
+    assert response.status_code == 200
+    assert "http_requests_total" in response.text
+
+
+async def test_metrics_require_the_token(http, monkeypatch):
+    monkeypatch.setattr(server, "METRICS_TOKEN", "secret")
+    assert (await http.get("/metrics")).status_code == 401
+    assert (await http.get("/metrics", headers={"Authorization": "Bearer wrong"})).status_code == 401
+    assert (await http.get("/metrics", headers={"Authorization": "Bearer secret"})).status_code == 200
@@ -0,0 +1,42 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def ticket_for(http, headers):
+    response = await http.post("/api/notifications/stream-ticket", headers=headers)
+    assert response.status_code == 200
+    return response.json()["ticket"]
+
+
+async def test_stream_refuses_the_login_token(http, users):
+    token = users["agent"]["headers"]["Authorization"].removeprefix("Bearer ")
+    response = await http.get("/api/notifications/stream", params={"ticket": token})
+    assert response.status_code == 401
+    response = await http.get("/api/notifications/stream", params={"token": token})
+    assert response.status_code == 422
+
+
+async def test_ticket_opens_the_stream_only(http, users):
+    ticket = await ticket_for(http, users["agent"]["headers"])
+    user = await server.user_from_token(ticket, scope=server.STREAM_TICKET_SCOPE)
+    assert user["id"] == users["agent"]["id"]
+
+    response = await http.get("/api/auth/me", headers={"Authorization": f"Bearer {ticket}"})
+    assert response.status_code == 401
+
+
+async def test_expired_ticket_is_refused(http, users, monkeypatch):
+    monkeypatch.setattr(server, "STREAM_TICKET_SECONDS", -1)
+    ticket = await ticket_for(http, users["agent"]["headers"])
+    with pytest.raises(HTTPException) as refused:
+        await server.user_from_token(ticket, scope=server.STREAM_TICKET_SCOPE)
+    assert refused.value.status_code == 401
+
+
+async def test_clients_get_no_ticket(http, users):
+    response = await http.post("/api/notifications/stream-ticket", headers=users["client"]["headers"])
+    assert response.status_code == 403
@@ -0,0 +1,39 @@
+import json
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def trips(db, users):
+    for number in range(5):
+        await db.trips.insert_one(server.prepare_for_mongo(server.Trip(
+            id=str(uuid.uuid4()), title=f"Trip {number}", destination="Roma", description="",
+            start_date=server.datetime(2025, 6, 1, tzinfo=server.timezone.utc),
+            end_date=server.datetime(2025, 6, 8, tzinfo=server.timezone.utc),
+            agent_id=users["agent"]["id"], client_id=users["client"]["id"], trip_type="tour",
+        ).dict()))
+
+
+async def test_list_without_limit_returns_default_page(http, users, trips, monkeypatch):
+    monkeypatch.setattr(server, "DEFAULT_PAGE_SIZE", 3)
+    headers = users["agent"]["headers"]
+    first = await http.get("/api/trips", headers=headers)
+    assert len(first.json()) == 3
+    second = await http.get("/api/trips", headers=headers, params={"cursor": first.headers["X-Next-Cursor"]})
+    assert len(second.json()) == 2
+    assert "X-Next-Cursor" not in second.headers
+    assert {trip["id"] for trip in first.json()}.isdisjoint(trip["id"] for trip in second.json())
+
+
+async def test_stream_without_limit_returns_every_row(http, users, trips, monkeypatch):
+    monkeypatch.setattr(server, "DEFAULT_PAGE_SIZE", 3)
+    response = await http.get("/api/trips", headers=users["agent"]["headers"], params={"stream": "true"})
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) == 5
+    assert all("next_cursor" not in row for row in rows)
+
@@ -0,0 +1,54 @@
+import threading
+
+import pytest
+from passlib.hash import argon2
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def engine(scheme: str) -> server.PasswordEngine:
+    # Cheapest settings: these tests are about where and when hashing happens
+    return server.PasswordEngine(scheme, workers=2, max_pending=10, bcrypt_rounds=4,
+                                 argon2_memory_kib=1024, argon2_time_cost=1)
+
+
+def test_a_missing_backend_fails_at_startup(monkeypatch):
+    def missing():
+        raise server.MissingBackendError("argon2: no backends available")
+
+    monkeypatch.setattr(argon2, "get_backend", missing)
+    with pytest.raises(RuntimeError, match="argon2-cffi"):
+        engine("argon2")
+
+
+async def test_hashing_runs_on_the_password_pool(monkeypatch):
+    passwords = engine("bcrypt")
+    threads = []
+    context_hash = passwords.context.hash
+    monkeypatch.setattr(passwords.context, "hash",
+                        lambda password: threads.append(threading.current_thread().name) or context_hash(password))
+
+    hashed = await passwords.hash("secret")
+    assert threads[0].startswith("password") and threads[0] != threading.current_thread().name
+    assert (await passwords.verify_and_update("secret", hashed)) == (True, None)
+    assert passwords.stats()["completed"] == 2
+    passwords.shutdown()
+
+
+async def test_login_rehashes_bcrypt_passwords_with_argon2(http, db, users, monkeypatch):
+    old_hash = await engine("bcrypt").hash("secret")
+    await db.users.update_one({"id": users["client"]["id"]}, {"$set": {"hashed_password": old_hash}})
+    monkeypatch.setattr(server, "password_engine", engine("argon2"))
+
+    response = await http.post("/api/auth/login", json={"email": "client@example.com", "password": "secret"})
+    assert response.status_code == 200
+    new_hash = (await db.users.find_one({"id": users["client"]["id"]}))["hashed_password"]
+    assert new_hash.startswith("$argon2")
+    assert server.password_engine.rehashed == 1
+
+    # The upgraded hash is what later sign-ins verify against
+    response = await http.post("/api/auth/login", json={"email": "client@example.com", "password": "secret"})
+    assert response.status_code == 200
+    assert server.password_engine.rehashed == 1
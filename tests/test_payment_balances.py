@@ -0,0 +1,111 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def legacy_practice(db, practice):
+    """A practice saved before total_paid existed, with 1000 already paid"""
+    for amount in (600.0, 400.0):
+        await db.payment_installments.insert_one(server.prepare_for_mongo(server.PaymentInstallment(
+            trip_admin_id=practice["id"], amount=amount,
+            payment_date=server.datetime(2025, 4, 1, tzinfo=server.timezone.utc),
+        ).dict()))
+    await db.trip_admin.update_one({"id": practice["id"]}, {"$unset": {"total_paid": ""}, "$set": {"balance_due": 700.0}})
+    return practice
+
+
+async def test_payment_on_legacy_practice_counts_earlier_installments(http, db, users, legacy_practice):
+    response = await http.post(f"/api/trip-admin/{legacy_practice['id']}/payments", headers=users["agent"]["headers"], json={
+        "trip_admin_id": legacy_practice["id"], "amount": 100.0, "payment_date": "2025-05-01T00:00:00Z",
+    })
+    assert response.status_code == 200
+
+    stored = await db.trip_admin.find_one({"id": legacy_practice["id"]})
+    assert stored["total_paid"] == 1100.0
+    assert stored["balance_due"] == 600.0
+    response = await http.get(f"/api/trips/{legacy_practice['trip_id']}/admin", headers=users["agent"]["headers"])
+    assert response.json()["balance_due"] == 600.0
+
+
+async def test_deleting_a_payment_on_legacy_practice(http, db, users, legacy_practice):
+    payment = await db.payment_installments.find_one({"trip_admin_id": legacy_practice["id"], "amount": 400.0})
+    response = await http.delete(f"/api/payments/{payment['id']}", headers=users["agent"]["headers"])
+    assert response.status_code == 200
+
+    stored = await db.trip_admin.find_one({"id": legacy_practice["id"]})
+    assert stored["total_paid"] == 600.0
+    assert stored["balance_due"] == 1100.0
+
+
+async def test_update_on_legacy_practice_keeps_paid_amount(http, db, users, legacy_practice):
+    response = await http.put(f"/api/trip-admin/{legacy_practice['id']}", headers=users["agent"]["headers"],
+                              json={"booking_number": "B-2"})
+    assert response.status_code == 200
+    assert response.json()["balance_due"] == 700.0
+    assert response.json()["total_paid"] == 1000.0
+
+
+async def test_payment_on_unknown_practice(http, users):
+    admin_id = str(uuid.uuid4())
+    response = await http.post(f"/api/trip-admin/{admin_id}/payments", headers=users["agent"]["headers"], json={
+        "trip_admin_id": admin_id, "amount": 100.0, "payment_date": "2025-05-01T00:00:00Z",
+    })
+    assert response.status_code == 404
+
+
+@pytest.fixture
+def reconciler(monkeypatch):
+    """A reconciler with no grace period; records the ids it recalculates and the agents it rebuilds"""
+    calls = {"recalculated": [], "rebuilt": []}
+    recalculate_commissions = server.recalculate_commissions
+
+    async def recalculate(query=None, *args, **kwargs):
+        calls["recalculated"].extend(query["id"]["$in"])
+        return await recalculate_commissions(query, *args, **kwargs)
+
+    async def rebuild_agent_rollups(agent_ids):
+        calls["rebuilt"].extend(agent_ids)
+
+    monkeypatch.setattr(server, "recalculate_commissions", recalculate)
+    monkeypatch.setattr(server, "rebuild_agent_rollups", rebuild_agent_rollups)
+    reconciler = server.BalanceReconciler(3600, 0)
+    reconciler.calls = calls
+    return reconciler
+
+
+async def test_reconciler_repairs_only_drifted_practices(db, users, practice, reconciler):
+    settled = {**practice, "id": str(uuid.uuid4()), "practice_number": "P-2", "total_paid": 0.0}
+    await db.trip_admin.insert_one(server.prepare_for_mongo(settled))
+    await db.payment_installments.insert_one(server.prepare_for_mongo(server.PaymentInstallment(
+        trip_admin_id=practice["id"], amount=500.0, payment_date=server.datetime(2025, 4, 1, tzinfo=server.timezone.utc),
+    ).dict()))
+
+    assert await reconciler.reconcile() == 1
+    assert reconciler.calls["recalculated"] == [practice["id"]]
+    assert reconciler.calls["rebuilt"] == [users["agent"]["id"]]
+    stored = await db.trip_admin.find_one({"id": practice["id"]})
+    assert stored["total_paid"] == 500.0
+    assert stored["balance_due"] == 2000.0 - 300.0 - 500.0
+
+
+async def test_reconciler_fills_missing_total_paid(db, legacy_practice, reconciler):
+    assert await reconciler.reconcile() == 1
+    assert (await db.trip_admin.find_one({"id": legacy_practice["id"]}))["total_paid"] == 1000.0
+
+
+async def test_reconciler_skips_practices_written_within_the_grace_period(db, practice, reconciler):
+    await db.payment_installments.insert_one({"id": "late", "trip_admin_id": practice["id"], "amount": 500.0})
+    await db.trip_admin.update_one({"id": practice["id"]}, {"$set": {"updated_at": server.datetime.now(server.timezone.utc)}})
+    reconciler.grace_seconds = 300
+    assert await reconciler.reconcile() == 0
+    assert reconciler.calls["recalculated"] == []
+
+
+async def test_reconciler_needs_no_work_when_balances_match(db, practice, reconciler):
+    assert await reconciler.reconcile() == 0
+    assert reconciler.calls == {"recalculated": [], "rebuilt": []}
@@ -0,0 +1,60 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def in_days(days: int) -> server.datetime:
+    return server.datetime.now(server.timezone.utc) + server.timedelta(days=days, hours=1)
+
+
+async def add_installment(db, trip_admin_id: str, days: int, amount: float = 100.0) -> str:
+    installment = server.PaymentInstallment(trip_admin_id=trip_admin_id, amount=amount, payment_date=in_days(days))
+    await db.payment_installments.insert_one(server.prepare_for_mongo(installment.dict()))
+    return installment.id
+
+
+@pytest.fixture
+async def other_agents_practice(db, users):
+    trip_id = str(uuid.uuid4())
+    await db.trips.insert_one({"id": trip_id, "title": "Tour", "agent_id": "other-agent", "client_id": users["client"]["id"]})
+    trip_admin_id = str(uuid.uuid4())
+    await db.trip_admin.insert_one({"id": trip_admin_id, "trip_id": trip_id, "balance_due": 0})
+    return trip_admin_id
+
+
+async def test_deadlines_are_sorted_by_priority_and_due_date(http, db, users, practice):
+    await db.trip_admin.update_one({"id": practice["id"]}, {"$set": {"client_departure_date": in_days(20)}})
+    medium = await add_installment(db, practice["id"], 10)
+    high = await add_installment(db, practice["id"], 3, amount=250.0)
+    await add_installment(db, practice["id"], 45)  # outside the 30-day window
+
+    response = await http.get("/api/notifications/payment-deadlines", headers=users["agent"]["headers"])
+    body = response.json()
+    assert [(item["id"], item["priority"], item["days_until_due"]) for item in body["notifications"]] == [
+        (high, "high", 3), (medium, "medium", 10), (f"balance_{practice['id']}", "low", 20),
+    ]
+    expected = {"amount": 250.0, "type": "payment_deadline", "client_name": "Client Test",
+                "trip_title": "Crociera", "trip_id": practice["trip_id"]}
+    assert {key: body["notifications"][0][key] for key in expected} == expected
+    assert body["notifications"][2]["amount"] == practice["balance_due"]
+    assert (body["total_count"], body["high_priority_count"], body["medium_priority_count"],
+            body["low_priority_count"]) == (3, 1, 1, 1)
+
+
+async def test_agents_only_see_their_own_trips(http, db, users, practice, other_agents_practice):
+    own = await add_installment(db, practice["id"], 5)
+    other = await add_installment(db, other_agents_practice, 5)
+
+    agent = await http.get("/api/notifications/payment-deadlines", headers=users["agent"]["headers"])
+    admin = await http.get("/api/notifications/payment-deadlines", headers=users["admin"]["headers"])
+    assert [item["id"] for item in agent.json()["notifications"]] == [own]
+    assert {item["id"] for item in admin.json()["notifications"]} == {own, other}
+
+
+async def test_clients_cannot_list_deadlines(http, users):
+    response = await http.get("/api/notifications/payment-deadlines", headers=users["client"]["headers"])
+    assert response.status_code == 403
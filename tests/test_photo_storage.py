@@ -0,0 +1,83 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def test_storage_backends_must_implement_the_interface():
+    class Incomplete(server.PhotoStorage):
+        async def put_file(self, path, key):
+            pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_local_storage_urls_are_server_paths(tmp_path):
+    storage = server.LocalPhotoStorage(tmp_path)
+    assert storage.url_for("abc.jpg") == "/uploads/abc.jpg"
+
+
+async def test_local_storage_keeps_identical_photos_once(tmp_path):
+    storage = server.LocalPhotoStorage(tmp_path)
+    first = await storage.save(server.UploadFile(io.BytesIO(b"same photo"), filename="beach.JPG"))
+    second = await storage.save(server.UploadFile(io.BytesIO(b"same photo"), filename="copy.jpg"))
+
+    assert first.key == second.key == f"{hashlib.sha256(b'same photo').hexdigest()}.jpg"
+    assert [path.name for path in tmp_path.iterdir()] == [first.key]
+
+
+async def test_local_storage_renames_the_spooled_file_into_place(tmp_path, monkeypatch):
+    renames = []
+    replace = os.replace
+    monkeypatch.setattr(server.os, "replace", lambda source, target: renames.append((source, target)) or replace(source, target))
+    stored = await server.LocalPhotoStorage(tmp_path).save(server.UploadFile(io.BytesIO(b"photo"), filename="a.jpg"))
+
+    # Written next to its final name, so readers never see a partial file
+    [(source, target)] = renames
+    assert Path(source).parent == Path(target).parent == tmp_path
+    assert Path(source).name.startswith(".upload-")
+    assert Path(target).read_bytes() == b"photo" and Path(target).name == stored.key
+
+
+async def test_spooling_stops_at_the_limit_and_leaves_no_temp_file(tmp_path):
+    with pytest.raises(server.HTTPException) as error:
+        await server.spool_upload(server.UploadFile(io.BytesIO(b"x" * 2048)), tmp_path, max_bytes=1024)
+    assert error.value.status_code == 413
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.fixture
+def small_uploads(monkeypatch):
+    monkeypatch.setattr(server, "MAX_UPLOAD_BYTES", 1024)
+    return server.MAX_UPLOAD_BYTES + server.MULTIPART_OVERHEAD_BYTES
+
+
+async def test_oversized_upload_is_refused_from_its_content_length(http, db, users, practice, small_uploads):
+    response = await http.post(
+        f"/api/trips/{practice['trip_id']}/photos", headers=users["client"]["headers"],
+        files={"file": ("big.jpg", b"x" * (small_uploads + 1), "image/jpeg")}, data={"photo_category": "destination"},
+    )
+    assert response.status_code == 413
+    assert await db.client_photos.count_documents({}) == 0
+
+
+async def test_chunked_upload_is_cut_off_at_the_limit(http, db, users, practice, small_uploads):
+    async def body():
+        yield b'--boundary\r\nContent-Disposition: form-data; name="file"; filename="big.jpg"\r\n\r\n'
+        for _ in range(8):
+            yield b"x" * (small_uploads // 4)
+        yield b'\r\n--boundary--\r\n'
+
+    response = await http.post(
+        f"/api/trips/{practice['trip_id']}/photos", content=body(),
+        headers={**users["client"]["headers"], "Content-Type": "multipart/form-data; boundary=boundary"},
+    )
+    assert response.status_code == 413
+    assert await db.client_photos.count_documents({}) == 0
@@ -0,0 +1,69 @@
+import io
+
+import pytest
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def jpeg(width: int, height: int) -> bytes:
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (30, 120, 180)).save(buffer, "JPEG")
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    storage = server.LocalPhotoStorage(tmp_path)
+    monkeypatch.setattr(server, "photo_storage", storage)
+    return storage
+
+
+async def upload(http, users, practice, data: bytes) -> dict:
+    response = await http.post(
+        f"/api/trips/{practice['trip_id']}/photos", headers=users["client"]["headers"],
+        files={"file": ("photo.jpg", data, "image/jpeg")}, data={"photo_category": "destination"},
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_variants_fit_their_bounding_box():
+    variants = server.render_photo_variants(jpeg(3000, 1500))
+    assert set(variants) == set(server.PHOTO_VARIANTS)
+    for name, content in variants.items():
+        with Image.open(io.BytesIO(content)) as image:
+            assert image.format == "JPEG"
+            assert image.size == (server.PHOTO_VARIANTS[name][0], server.PHOTO_VARIANTS[name][0] // 2)
+
+
+async def test_processed_photos_are_listed_at_the_requested_size(http, db, users, practice, storage):
+    photo = await upload(http, users, practice, jpeg(800, 600))
+    assert photo["variants_status"] == "pending"
+
+    await server.photo_processor.process(photo["id"])
+    stored = await db.client_photos.find_one({"id": photo["id"]})
+    assert stored["variants_status"] == "ready"
+    assert stored["variants"]["small"] == storage.url_for(f"{photo['sha256']}_small.jpg")
+
+    response = await http.get(f"/api/trips/{practice['trip_id']}/photos?size=small", headers=users["client"]["headers"])
+    [listed] = response.json()
+    assert listed["url"] == stored["variants"]["small"]
+    assert listed["variants"]["original"] == photo["url"]
+
+
+async def test_identical_uploads_reuse_the_rendered_variants(http, db, users, practice, storage, monkeypatch):
+    data = jpeg(640, 480)
+    first = await upload(http, users, practice, data)
+    await server.photo_processor.process(first["id"])
+
+    def render_again(data):
+        raise AssertionError("variants rendered twice for the same content")
+
+    monkeypatch.setattr(server, "render_photo_variants", render_again)
+    second = await upload(http, users, practice, data)
+    await server.photo_processor.process(second["id"])
+    rows = {row["id"]: row async for row in db.client_photos.find()}
+    assert rows[second["id"]]["variants"] == rows[first["id"]]["variants"]
@@ -0,0 +1,26 @@
+import threading
+
+import server
+
+
+def test_end_waits_for_a_running_sample(tmp_path):
+    profiler = server.SamplingProfiler(server.ProfileStore(tmp_path, 1 << 20), 1, 0, 0)
+    profile = server.RequestProfile("sampled")
+    profiler.active[profile.id] = profile
+    ended = threading.Event()
+
+    with profiler.lock:  # A sample in progress
+        thread = threading.Thread(target=lambda: (profiler.end(profile), ended.set()))
+        thread.start()
+        assert not ended.wait(0.05)
+    assert ended.wait(1)
+    assert profile.id not in profiler.active
+
+
+def test_partial_profile_files_are_not_listed(tmp_path):
+    store = server.ProfileStore(tmp_path, 1 << 20)
+    profile = server.RequestProfile("sampled")
+    store.write({"id": profile.id, "created_at": profile.created_at, "stacks": {}, "queries": []})
+    (tmp_path / "20990101T000000000000_partial.json.tmp").write_bytes(b'{"id": "trunc')
+
+    assert [summary["id"] for summary in store.list(10)] == [profile.id]
@@ -0,0 +1,83 @@
+import uuid
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_payment_deadlines_query_budget(http, db, users, practice):
+    departure = server.datetime.now(server.timezone.utc) + server.timedelta(days=10)
+    await db.trip_admin.update_one({"id": practice["id"]}, {"$set": {"client_departure_date": departure}})
+    for role in ("agent", "admin"):
+        server.user_cache.clear()
+        # User lookup and one aggregation
+        with server.query_budget(max_operations=2):
+            response = await http.get("/api/notifications/payment-deadlines", headers=users[role]["headers"])
+        assert response.status_code == 200
+        assert [notification["type"] for notification in response.json()["notifications"]] == ["balance_due"]
+        # Priorities move with the clock, so no ETag a client could revalidate against
+        assert "ETag" not in response.headers
+
+
+async def test_agent_commissions_query_count_does_not_grow_with_practices(http, db, users, practice):
+    path = "/api/analytics/agent-commissions?year=2025"
+    with server.query_budget(max_operations=5) as one_practice:
+        response = await http.get(path, headers=users["agent"]["headers"])
+    assert response.status_code == 200
+    assert len(response.json()["trips"]) == 1
+
+    for number in range(2, 12):
+        await db.trip_admin.insert_one({**practice, "id": str(uuid.uuid4()), "practice_number": f"P-{number}"})
+    server.user_cache.clear()
+    with server.query_budget(max_operations=one_practice.operations) as many_practices:
+        response = await http.get(path, headers=users["agent"]["headers"])
+    assert response.status_code == 200
+    assert many_practices.operations == one_practice.operations
+
+
+async def test_repeated_find_one_is_flagged(db, mongo):
+    with pytest.raises(server.QueryBudgetExceeded, match='"find", "trips"'):
+        with server.query_budget():
+            for _ in range(server.QUERY_REPEAT_THRESHOLD):
+                await db.trips.find_one({"id": str(uuid.uuid4())})
+
+
+async def test_distinct_queries_are_not_flagged(db, mongo):
+    with server.query_budget() as stats:
+        for collection in ("trips", "users", "itineraries", "trip_admin", "client_photos"):
+            await db[collection].find_one({"id": "x"})
+    assert stats.operations == 5
+    assert stats.repeated() == {}
+
+
+async def test_query_budget_counts_operations(db, mongo):
+    with pytest.raises(server.QueryBudgetExceeded, match="3 database operations, budget 2"):
+        with server.query_budget(max_operations=2):
+            await db.trips.find_one({"id": "a"})
+            await db.users.find_one({"id": "b"})
+            await db.trip_admin.find_one({"id": "c"})
+
+
+async def test_debug_headers(http, users, monkeypatch):
+    monkeypatch.setattr(server, "QUERY_DEBUG_HEADERS", True)
+    response = await http.get("/api/trips", headers=users["agent"]["headers"])
+    assert response.status_code == 200
+    assert int(response.headers["X-DB-Operations"]) >= 2
+    assert int(response.headers["X-DB-Documents"]) >= 1
+    assert float(response.headers["X-DB-Time-Ms"]) > 0
+    assert response.headers["X-DB-Repeated-Queries"] == "0"
+
+    monkeypatch.setattr(server, "QUERY_DEBUG_HEADERS", False)
+    response = await http.get("/api/trips", headers=users["agent"]["headers"])
+    assert "X-DB-Operations" not in response.headers
+
+
+async def test_route_totals(http, users):
+    await http.get("/api/trips", headers=users["agent"]["headers"])
+    totals = server.query_monitor.routes["GET /api/trips"]
+    assert totals["requests"] == 1
+    assert totals["operations"] >= 2
+    response = await http.get("/api/debug/queries", headers=users["admin"]["headers"])
+    assert response.json()["routes"]["GET /api/trips"]["requests"] == 1
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def validated_json(model, document: dict):
+    """What the endpoints returned before the codec: the model built from the row, dumped by FastAPI"""
+    return json.loads(model(**{key: value for key, value in document.items() if key != "_id"}).model_dump_json())
+
+
+async def stored(collection, instance) -> dict:
+    await collection.insert_one(server.prepare_for_mongo(instance.dict()))
+    return await collection.find_one({"id": instance.id})
+
+
+async def test_codec_matches_model_validation(db, practice):
+    start = server.datetime(2025, 6, 1, 9, 30, tzinfo=server.timezone.utc)
+    rows = [
+        (server.Trip, await stored(db.trips, server.Trip(
+            title="Tour", destination="Roma", description="", start_date=start, end_date=start,
+            client_id="c", agent_id="a", trip_type="tour"))),
+        (server.ClientPhoto, await stored(db.client_photos, server.ClientPhoto(
+            trip_id="t", client_id="c", url="/uploads/x.jpg", photo_category="destination",
+            variants={"thumb": "/uploads/x-thumb.jpg"}))),
+        (server.TripAdmin, await db.trip_admin.find_one({"id": practice["id"]})),
+    ]
+    for model, document in rows:
+        assert json.loads(server.codec_for(model).encode(document)) == validated_json(model, document), model
+
+
+async def test_codec_never_returns_fields_outside_the_model(db, users):
+    document = await db.users.find_one({"id": users["client"]["id"]})
+    row = json.loads(server.codec_for(server.User).encode(document))
+    assert "hashed_password" not in row and "_id" not in row
+    assert row == validated_json(server.User, document)
+
+
+def test_codec_reads_dates_still_stored_as_strings():
+    document = {"id": "t", "title": "Tour", "destination": "Roma", "description": "", "client_id": "c",
+                "agent_id": "a", "trip_type": "tour", "status": "active",
+                "start_date": "2025-06-01T09:30:00+00:00", "end_date": "2025-06-08T00:00:00Z",
+                "created_at": "2025-01-01T00:00:00+00:00"}
+    assert json.loads(server.codec_for(server.Trip).encode(document)) == validated_json(server.Trip, document)
+
+
+def test_rows_missing_a_required_field_are_validated():
+    with pytest.raises(server.ValidationError):
+        server.codec_for(server.Trip).decode({"id": "t", "title": "Tour"})
+    # A missing field with a default factory is filled in by the model
+    row = server.codec_for(server.ClientNote).decode({"trip_id": "t", "client_id": "c", "day_number": 1, "note_text": "Nota"})
+    assert row["id"] and row["note_text"] == "Nota"
@@ -0,0 +1,60 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+DAY = server.datetime(2025, 6, 1, tzinfo=server.timezone.utc)
+
+
+@pytest.fixture
+async def trip_parts(db, users, practice):
+    trip_id = practice["trip_id"]
+    itinerary = server.Itinerary(trip_id=trip_id, day_number=1, date=DAY, title="Genova", description="",
+                                 itinerary_type="port_day")
+    await db.itineraries.insert_one(server.prepare_for_mongo(itinerary.dict()))
+    cruise = server.CruiseInfo(trip_id=trip_id, ship_name="MSC", cabin_number="101", departure_time=DAY, return_time=DAY)
+    await db.cruise_info.insert_one(server.prepare_for_mongo(cruise.dict()))
+    for client_id, text in ((users["client"]["id"], "Mia nota"), ("someone-else", "Altra nota")):
+        note = server.ClientNote(trip_id=trip_id, client_id=client_id, day_number=1, note_text=text)
+        await db.client_notes.insert_one(server.prepare_for_mongo(note.dict()))
+    return {"itinerary": itinerary, "cruise": cruise}
+
+
+async def get_full(http, users, practice, role: str, include=None):
+    params = {"include": include} if include else {}
+    return await http.get(f"/api/trips/{practice['trip_id']}/full", headers=users[role]["headers"], params=params)
+
+
+async def test_without_include_only_the_trip_and_its_people_are_returned(http, users, practice, trip_parts):
+    body = (await get_full(http, users, practice, "agent")).json()
+    assert set(body) == {"trip", "agent", "client"}
+    assert body["agent"]["id"] == users["agent"]["id"]
+    assert body["client"]["email"] == "client@example.com"
+
+
+async def test_included_parts_are_embedded(http, users, practice, trip_parts):
+    body = (await get_full(http, users, practice, "agent", "itineraries,cruise_info,admin,port_schedules")).json()
+    assert [row["id"] for row in body["itineraries"]] == [trip_parts["itinerary"].id]
+    assert body["cruise_info"]["ship_name"] == "MSC"
+    assert body["admin"]["id"] == practice["id"]
+    assert body["port_schedules"] == []
+
+
+async def test_clients_get_all_but_the_practice_and_only_their_notes(http, users, practice, trip_parts):
+    body = (await get_full(http, users, practice, "client", "all")).json()
+    assert set(body) == {"trip", "agent", "client", *server.TRIP_PARTS} - server.STAFF_TRIP_PARTS
+    assert [note["note_text"] for note in body["notes"]] == ["Mia nota"]
+
+    response = await get_full(http, users, practice, "client", "admin")
+    assert response.status_code == 403
+
+
+async def test_unknown_parts_and_other_agents_are_refused(http, db, users, practice):
+    response = await get_full(http, users, practice, "agent", "itineraries,bookings")
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Unknown include: bookings"
+
+    await db.trips.update_one({"id": practice["trip_id"]}, {"$set": {"agent_id": "other-agent"}})
+    response = await get_full(http, users, practice, "agent", "all")
+    assert response.status_code == 403
@@ -0,0 +1,32 @@
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_blocked_user_loses_access_on_the_next_request(http, users):
+    client_headers = users["client"]["headers"]
+    assert (await http.get("/api/auth/me", headers=client_headers)).status_code == 200
+    assert server.user_cache.get(users["client"]["id"]) is not None
+
+    response = await http.post(f"/api/users/{users['client']['id']}/block", headers=users["admin"]["headers"])
+    assert response.status_code == 200
+    assert (await http.get("/api/auth/me", headers=client_headers)).status_code == 403
+
+    await http.post(f"/api/users/{users['client']['id']}/unblock", headers=users["admin"]["headers"])
+    assert (await http.get("/api/auth/me", headers=client_headers)).status_code == 200
+
+
+async def test_deleted_user_loses_access_on_the_next_request(http, users):
+    client_headers = users["client"]["headers"]
+    assert (await http.get("/api/auth/me", headers=client_headers)).status_code == 200
+    await http.delete(f"/api/users/{users['client']['id']}", headers=users["admin"]["headers"])
+    assert (await http.get("/api/auth/me", headers=client_headers)).status_code == 401
+
+
+def test_several_workers_use_the_mongo_broadcaster():
+    assert server.broadcast_backend({}) == "local"
+    assert server.broadcast_backend({"WEB_CONCURRENCY": "4"}) == "mongo"
+    with pytest.raises(RuntimeError, match="BROADCAST_BACKEND=mongo"):
+        server.broadcast_backend({"WEB_CONCURRENCY": "4", "BROADCAST_BACKEND": "local"})